@@ -5,42 +5,47 @@
 
 ..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
 """
-from typing import Any, List, Optional, Iterator, Iterable, Tuple
+from typing import Any, Dict, List, Optional, Iterator, Iterable, Set, Tuple
 from datetime import datetime
 import traceback
 import argparse
-import copy
 import json
 import glob
 import sys
+import os
 import re
 
-from jsonschema import validate
 import pyspark
 import pydoop.hdfs as hdfs
 from pyspark.accumulators import AccumulatorParam
 from warcio.archiveiterator import ArchiveIterator
 from warcio.recordloader import ArchiveLoadFailed
 
-from WebPageTypeIdentification import WebPageTypeIdentifier  # noqa: F401
-from TopicIdentification import TopicIdentifier  # noqa: F401
-from SentimentAnalysis import SentimentAnalyzer  # noqa: F401
-from TextExtraction import HTMLTextExtractor, PDFTextExtractor  # noqa: F401
-from BaseAlgorithms import BaseAlgorithm  # noqa: F401
-from SOUAlgorithms import FleschReadingEase  # noqa: F401
-from Tokenization import WordTokenizer, SentenceTokenizer  # noqa: F401
+from WebPageTypeIdentification import WebPageTypeIdentifier
+from TopicIdentification import TopicIdentifier
+from SentimentAnalysis import SentimentAnalyzer
+from TextExtraction import HTMLTextExtractor, PDFTextExtractor
+from BaseAlgorithms import BaseAlgorithm
+from SOUAlgorithms import FleschReadingEase
+from Tokenization import WordTokenizer, SentenceTokenizer
 from Record import Record
-from HBase import HBase
-from utils import warc_name_to_harvest_info
+from HBase import HBase, HBaseAsyncWriter
+from ConfigCache import get_config
+from executor import get_or_create
+from SchemaValidation import get_schema_validator, SchemaValidator
+from utils import warc_name_to_harvest_info, pack_by_size, bytes_to_base64
 from metadata import (
     ID,
     URL,
+    CONTENT,
     EXTRA,
     MIMETYPE,
+    RESPONSECODE,
     RECHEADERS,
     WARCFILENAME,
     WARCOFFSET,
-    HARVESTID
+    HARVESTID,
+    REFERSTO
 )
 from config import (
     RECORD_TYPES,
@@ -49,6 +54,8 @@ from config import (
     HBASE_MAIN_TABLE,
     HBASE_HARV_TABLE,
     HBASE_PROC_TABLE,
+    HBASE_INDEXES,
+    HBASE_COLUMN_CODECS,
     PROC_STATUS_RUNNING,
     PROC_STATUS_FINISHED,
     PROC_STATUS_FAILED,
@@ -56,19 +63,38 @@ from config import (
     JSON_SCHEMA,
     RECORD_MIME_TYPES,
     UNNECESSARY_FIELDS,
+    FIELD_PROVIDERS,
     RECORD_FILTERS,
-    MAX_ALLOWED_WARC_CONTENT_SIZE
+    MAX_ALLOWED_WARC_CONTENT_SIZE,
+    WARC_SPLIT_SIZE,
+    WARC_CDX_SUFFIX,
+    WARC_PARTITION_SIZE,
+    HBASE_SCAN_BATCH_SIZE
 )
 
+# processing algorithms available in --algseq by their names; classes are
+# looked up here instead of in this module's namespace, which is not
+# available on executors when this file is run as the main script
+ALGORITHMS = dict((cls.__name__, cls) for cls in (
+    WebPageTypeIdentifier,
+    TopicIdentifier,
+    SentimentAnalyzer,
+    HTMLTextExtractor,
+    PDFTextExtractor,
+    FleschReadingEase,
+    WordTokenizer,
+    SentenceTokenizer,
+))
 
-class ListAccumulatorParam(AccumulatorParam):
-    """Extension of AccumulatorParam to lists.
+
+class SetAccumulatorParam(AccumulatorParam):
+    """Extension of AccumulatorParam to sets.
 
     We use it to accumulate processed harvest IDs.
 
     """
 
-    def zero(self, v: Any) -> List:
+    def zero(self, v: Any) -> Set:
         """Provide a zero value for the type.
 
         Args:
@@ -78,20 +104,24 @@ class ListAccumulatorParam(AccumulatorParam):
             The zero value.
 
         """
-        return []
+        return set()
 
-    def addInPlace(self, variable: List, value: Any) -> List:
-        """Add a value to the accumulator.
+    def addInPlace(self, variable: Set, value: Any) -> Set:
+        """Add a value (or merge a set of values) to the accumulator.
 
         Args:
             variable: Accumulator's variable.
-            value: The new value.
+            value: The new value, or a set of values (when merging results
+                of tasks).
 
         Returns:
             The updated variable.
 
         """
-        variable.append(value)
+        if isinstance(value, (set, frozenset)):
+            variable |= value
+        else:
+            variable.add(value)
         return variable
 
 
@@ -111,7 +141,8 @@ class ArchiveProcessor(BaseAlgorithm):
 
     Supported input formats of data are:
       - Collection of WARC files: WARC files are passed to the python driver
-        as pyspark dataframes; each WARC is then read by one worker using
+        as pyspark dataframes; each WARC (or each chunk of a large WARC, see
+        `WARC_SPLIT_SIZE` in `config.py`) is then read by one worker using
         warcio package and processed according to given arguments.
       - HBase main table (each row consisting of key and the record decomposed
         into `OUTPUT_SEPARATE_COLS` and the rest of IF.
@@ -207,6 +238,14 @@ class ArchiveProcessor(BaseAlgorithm):
             "application_id": "",
         }
 
+        # large read-only data are sent to executors as broadcast variables
+        # (see `_broadcast_data`), not with every task
+        self._schema = None
+        self._processIDs = None
+        self._bc_schema = None
+        self._bc_processIDs = None
+        self._validator = None
+
         self._load_JSON_schema()
         self._init_algorithms()
         self._load_onlyIDs()
@@ -215,6 +254,10 @@ class ArchiveProcessor(BaseAlgorithm):
             self._check_HBase()
 
         self.output_col_names = OUTPUT_SEPARATE_COLS + ['IF']
+        # columns of the main table to be loaded when reading HBase
+        self.input_columns = (
+            self._get_input_columns() if self.input_hbase else None
+        )
 
     def _load_JSON_schema(self) -> None:
         """Read the JSON schema from file."""
@@ -225,23 +268,173 @@ class ArchiveProcessor(BaseAlgorithm):
                 f'Cannot load JSON schema from {JSON_SCHEMA} ({e}).'
             )
 
+    def __getstate__(self) -> Dict[str, Any]:
+        """Return the state to be pickled (shipped to Spark executors).
+
+        Algorithms, the validator and caches are created again on executors
+        (once per process), broadcast data are not pickled at all.
+
+        """
+        state = self.__dict__.copy()
+        state['_validator'] = None
+        state.pop('_CACHEALGSEQ', None)
+        if self._bc_schema is not None:
+            state['_schema'] = None
+        if self._bc_processIDs is not None:
+            state['_processIDs'] = None
+        return state
+
+    @property
+    def schema(self) -> Dict[str, Any]:
+        """JSON schema of intermediary format."""
+        if self._schema is None and self._bc_schema is not None:
+            self._schema = self._bc_schema.value
+        return self._schema
+
+    @schema.setter
+    def schema(self, schema: Dict[str, Any]) -> None:
+        self._schema = schema
+        self._validator = None
+
+    @property
+    def processIDs(self) -> Set[str]:
+        """Set of record IDs to be processed (empty set = all records)."""
+        if self._processIDs is None and self._bc_processIDs is not None:
+            self._processIDs = self._bc_processIDs.value
+        return self._processIDs
+
+    @processIDs.setter
+    def processIDs(self, processIDs: Set[str]) -> None:
+        self._processIDs = processIDs
+
+    def _broadcast_data(self, sc: pyspark.SparkContext) -> None:
+        """Send the schema and the set of IDs to executors.
+
+        Args:
+            sc: Spark context.
+
+        """
+        self._bc_schema = sc.broadcast(self.schema)
+        self._bc_processIDs = sc.broadcast(self.processIDs)
+
+    @property
+    def validator(self) -> SchemaValidator:
+        """Precompiled validator of JSON schema."""
+        if self._validator is None:
+            self._validator = get_schema_validator(self.schema)
+        return self._validator
+
     def _check_HBase(self) -> None:
         """Check the HBase tables. Create or enable them if necessary."""
-        hb = HBase(HBASE_HOST, HBASE_PORT)
+        hb = HBase(HBASE_HOST, HBASE_PORT, pooled=True)
         hb.check_tables()
         hb.close()
 
     def _init_algorithms(self) -> None:
-        """Initialize processing algorithms for all supported MIME types."""
-        self.algorithms = {}
+        """Initialize processing algorithms for all supported MIME types.
+
+        Algorithms are initialized here to find out any errors before the
+        processing starts. Executors initialize their own instances on first
+        use (see `_get_algorithm`), so only algorithm names are shipped with
+        the tasks.
+
+        """
         if not self.algseq:
             return
         if not isinstance(self.algseq, list):
             self.algseq = [self.algseq]
-        # set of all algorithms for all defined MIME types
-        algs = set(a for mt, agsq in self.algseq for a in agsq)
+        # set of all algorithms (including prerequisites) for all defined
+        # MIME types
+        algs = set(
+            a for mt, agsq in self.algseq for a, _ in self._plan_algseq(agsq)
+        )
         for alg in algs:
-            self.algorithms[alg] = self._init_alg_or_terminate(alg)
+            get_or_create(
+                ('algorithm', alg),
+                lambda: self._init_alg_or_terminate(alg)
+            )
+
+    def _configure_algorithms(self) -> None:
+        """Pass runtime settings from HBase config table to the algorithms.
+
+        Called once per partition. The settings are read from the cache
+        shared by the (executor) process, see `ConfigCache.get_config`. The
+        config table is read only if HBase is used for input or output,
+        otherwise the algorithms keep their default settings.
+
+        """
+        if not self.algseq or not (self.input_hbase or self.output_hbase):
+            return
+        names = set(
+            a for mt, agsq in self.algseq for a, _ in self._plan_algseq(agsq)
+        )
+        for name in names:
+            keys = getattr(ALGORITHMS.get(name), 'CONFIG_KEYS', ())
+            if keys:
+                self._get_algorithm(name).configure(
+                    dict((key, get_config(key)) for key in keys)
+                )
+
+    def _plan_algseq(self, algnames: List[str]) -> List[Tuple[str, List]]:
+        """Plan the processing by a sequence of algorithms.
+
+        Algorithms providing fields required by the algorithms in the
+        sequence (see FIELD_PROVIDERS in config.py) are inserted right before
+        the first algorithm requiring them, each algorithm is run only once.
+        For each algorithm, the fields from UNNECESSARY_FIELDS which are not
+        required by any later algorithm are listed to be dropped from the
+        record right after the algorithm.
+
+        Args:
+            algnames: Names of algorithms in the order of processing.
+
+        Returns:
+            List of pairs (algorithm name, fields to drop after it).
+
+        """
+        def get_class(name):
+            return ALGORITHMS.get(name)
+
+        names = []
+        for name in algnames:
+            required = getattr(get_class(name), 'REQUIRED_FIELDS', ())
+            for field in required:
+                provider = FIELD_PROVIDERS.get(field)
+                if provider and provider not in names and provider != name:
+                    names.append(provider)
+            if name not in names:
+                names.append(name)
+
+        # index of the last algorithm using (reading or writing) each field
+        last_use = {}
+        for i, name in enumerate(names):
+            cls = get_class(name)
+            for field in getattr(cls, 'REQUIRED_FIELDS', ()) + \
+                    getattr(cls, 'PROVIDED_FIELDS', ()):
+                last_use[field] = i
+        drop = [[] for _ in names]
+        for field in UNNECESSARY_FIELDS:
+            if field in last_use:
+                drop[last_use[field]].append(field)
+        return list(zip(names, drop))
+
+    def _get_algorithm(self, alg_name: str) -> Any:
+        """Get the instance of algorithm specified by given name.
+
+        The instance is created on first use and shared by all tasks running
+        in the same (executor) process.
+
+        Args:
+            alg_name: The name of the algorithm.
+
+        Returns:
+            The instance of initialized algorithm.
+
+        """
+        return get_or_create(
+            ('algorithm', alg_name),
+            ALGORITHMS[alg_name]
+        )
 
     def _init_alg_or_terminate(self, alg_name: str, *args, **kwargs) -> Any:
         """Initialize algorithm specified by given name.
@@ -257,8 +450,8 @@ class ArchiveProcessor(BaseAlgorithm):
         """
         try:
             # get class object
-            cls = getattr(sys.modules[__name__], alg_name)
-        except AttributeError:
+            cls = ALGORITHMS[alg_name]
+        except KeyError:
             self.terminate(f'No imported algorithm with name "{alg_name}".')
         try:
             instance = cls(*args, **kwargs)
@@ -307,22 +500,18 @@ class ArchiveProcessor(BaseAlgorithm):
                 "t_finished": int(datetime.timestamp(datetime.now()) * 1000),
             })
         if update_accumulators and hasattr(self, "Nprocessed"):
-            # each executor adds harvests into its own list,
-            # the accumulator must be flattened and deduplicated
-            harvests = set()
-            for sublist in self.harvests.value:
-                for item in sublist:
-                    harvests.add(item)
-            harvests = sorted(harvests)
+            harvests = sorted(self.harvests.value)
             self.process_info.update({
                 "records_processed": self.Nprocessed.value,
                 "records_failed": self.Nfailed.value,
                 "harvests": harvests,
             })
         if self.output_hbase:
-            hb = HBase(HBASE_HOST, HBASE_PORT)
-            hb.put(HBASE_PROC_TABLE, self.process_id, self.process_info)
-            hb.close()
+            hb = HBase(HBASE_HOST, HBASE_PORT, pooled=True)
+            try:
+                hb.put(HBASE_PROC_TABLE, self.process_id, self.process_info)
+            finally:
+                hb.close()
 
     def run(self) -> None:
         """Process data and save outputs."""
@@ -399,42 +588,55 @@ class ArchiveProcessor(BaseAlgorithm):
           _id: int,
           iterator: Any
           ) -> Iterator[Record]:
-        """Process one data partition, i.e. one WARC file.
+        """Process one data partition, i.e. one or more WARC chunks.
 
         Args:
             _id: Index of partition.
-            iterator: Iterator with WARC file names; contains only one item.
+            iterator: Iterator with WARC chunks, i.e. tuples (uri, start,
+                end), where start and end are byte offsets of the chunk in
+                the WARC file.
 
         Returns:
             Generator over processed records.
 
         """
-        for uri in iterator:
-            if uri.startswith('file:/'):
-                self.logger.info(f'Reading local stream {uri}')
-                uri = re.sub(r"^file\:\/+", "/", uri)
-                try:
-                    stream = open(uri, 'rb')
-                except IOError as e:
-                    self.logger.error(f'Failed to open {uri}: {e}')
-                    continue
-            else:
-                # HDFS
-                self.logger.info(f"Reading from HDFS {uri}")
-                try:
-                    stream = hdfs.open(uri)
-                except RuntimeError as e:
-                    self.logger.error(f'Failed to open {uri}: {e}')
-                    continue
+        self._configure_algorithms()
+        # only filters on metadata available in the record headers
+        header_filters = dict(
+            (name, fltr) for name, fltr in RECORD_FILTERS.items()
+            if name in [ID, URL, MIMETYPE, RESPONSECODE]
+        )
+        for uri, start, end in iterator:
             try:
+                stream, uri = self._open_uri(uri)
+            except (IOError, RuntimeError) as e:
+                self.logger.error(f'Failed to open {uri}: {e}')
+                continue
+            self.logger.info(f'Reading {uri} (bytes {start}-{end})')
+            try:
+                if start:
+                    stream.seek(start)
                 archive_iterator = ArchiveIterator(stream)
                 for rec in archive_iterator:
+                    # offset of the current record is known before reading it
+                    if end is not None and archive_iterator.offset >= end:
+                        break
                     rec_type = rec.rec_headers.get_header('WARC-Type')
                     if rec_type not in RECORD_TYPES:
                         continue
                     length = int(rec.rec_headers.get_header('Content-Length'))
                     if length > MAX_ALLOWED_WARC_CONTENT_SIZE:
                         continue
+                    # check the headers first, the payload of skipped records
+                    # is never read
+                    fields = Record.get_header_fields(rec)
+                    reason = self._get_skip_reason(fields, header_filters)
+                    if reason is not None:
+                        self.logger.debug(
+                            f'Skipping record URL {fields[URL]} and '
+                            f'ID="{fields[ID]}" ({reason})'
+                        )
+                        continue
                     record = Record(rec, uri)
                     # !!! following command (getting offset) must take place
                     # AFTER reading content_stream (inside Record init),
@@ -447,40 +649,196 @@ class ArchiveProcessor(BaseAlgorithm):
             finally:
                 stream.close()
 
-    def process_warc_files(self) -> pyspark.rdd.RDD:
-        """Set-up pySpark, initialize accumulators and process data as RDD.
+    def _open_uri(self, uri: str) -> Tuple[Any, str]:
+        """Open file from local FS or HDFS for binary reading.
+
+        Args:
+            uri: URI of the file; local FS (URI "file:///path/to/data") or
+                HDFS (URI "/path/to/data").
 
         Returns:
-            rdd: Processed data in the form of RDD.
+            Tuple with 2 values: opened stream and the path of the file (local
+            files are returned without the "file:" scheme).
+
+        Raises:
+            IOError (local FS) or RuntimeError (HDFS) if the file cannot be
+                opened.
 
         """
-        sc = self.setup_pySpark()
-        # sqlContext = pyspark.sql.SQLContext(sc)
-        self.Nprocessed = sc.accumulator(0)
-        self.Nfailed = sc.accumulator(0)
-        self.harvests = sc.accumulator([], ListAccumulatorParam())
+        if uri.startswith('file:/'):
+            path = re.sub(r"^file\:\/+", "/", uri)
+            return open(path, 'rb'), path
+        return hdfs.open(uri), uri
 
+    def _list_warc_files(self, sc: pyspark.SparkContext) -> List[Tuple]:
+        """Expand input WARC URI into the list of files and their sizes.
+
+        Args:
+            sc: Spark context.
+
+        Returns:
+            List of tuples (uri, size in bytes).
+
+        """
         if self.input_warcs.startswith('file:/'):
             # local FS
             uri = re.sub(r"^file\:\/+", "/", self.input_warcs)
-            files = glob.glob(uri)
-            files = [re.sub(r"^/", "file:///", fn) for fn in files]
-        else:
-            # HDFS; expand globs using JVM gateway
-            URI = sc._gateway.jvm.java.net.URI
-            Path = sc._gateway.jvm.org.apache.hadoop.fs.Path
-            FileSystem = sc._gateway.jvm.org.apache.hadoop.fs.FileSystem
-            Config = sc._gateway.jvm.org.apache.hadoop.conf.Configuration
+            return [
+                (re.sub(r"^/", "file:///", fn), os.path.getsize(fn))
+                for fn in glob.glob(uri)
+            ]
+        # HDFS; expand globs using JVM gateway
+        URI = sc._gateway.jvm.java.net.URI
+        Path = sc._gateway.jvm.org.apache.hadoop.fs.Path
+        FileSystem = sc._gateway.jvm.org.apache.hadoop.fs.FileSystem
+        Config = sc._gateway.jvm.org.apache.hadoop.conf.Configuration
+
+        fs = FileSystem.get(URI(self.input_warcs), Config())
+        statuses = fs.globStatus(Path(self.input_warcs))
+        return [
+            (str(status.getPath()), status.getLen()) for status in statuses
+        ]
+
+    def _split_warc(self, warc: Tuple[str, int]) -> List[Tuple]:
+        """Split WARC file into chunks aligned to WARC record offsets.
+
+        Record offsets are read from the CDX index of the WARC file, if it
+        exists, otherwise they are found by pre-scanning the WARC file.
+
+        Args:
+            warc: Tuple (uri, size in bytes) of the WARC file.
+
+        Returns:
+            List of WARC chunks, i.e. tuples (uri, start, end).
+
+        """
+        uri, size = warc
+        if not WARC_SPLIT_SIZE or size <= WARC_SPLIT_SIZE:
+            return [(uri, 0, size)]
+        offsets = self._load_cdx_offsets(uri) or self._scan_offsets(uri)
+        chunks = []
+        start = 0
+        for offset in sorted(set(offsets)):
+            if offset - start >= WARC_SPLIT_SIZE:
+                chunks.append((uri, start, offset))
+                start = offset
+        chunks.append((uri, start, size))
+        self.logger.info(f'WARC {uri} split into {len(chunks)} chunks.')
+        return chunks
+
+    def _load_cdx_offsets(self, uri: str) -> List[int]:
+        """Load WARC record offsets from the CDX index of the WARC file.
+
+        Args:
+            uri: URI of the WARC file.
+
+        Returns:
+            List of record offsets, empty if there is no usable CDX index.
+
+        """
+        cdx_uri = uri + WARC_CDX_SUFFIX
+        try:
+            stream, _ = self._open_uri(cdx_uri)
+        except (IOError, RuntimeError):
+            return []
+        offsets = []
+        try:
+            lines = iter(stream.read().decode('utf-8').splitlines())
+            # the first line is the legend, e.g. " CDX N b a m s k r M S V g",
+            # where V is the compressed offset and g is the WARC file name
+            legend = next(lines, '').split()[1:]
+            if 'V' not in legend:
+                self.logger.warning(f'No offsets in CDX index {cdx_uri}.')
+                return []
+            i_offset = legend.index('V')
+            i_name = legend.index('g') if 'g' in legend else None
+            warc_name = os.path.basename(uri)
+            for line in lines:
+                fields = line.split()
+                if len(fields) != len(legend):
+                    continue
+                if i_name is not None and fields[i_name] != warc_name:
+                    continue
+                if fields[i_offset].isdigit():
+                    offsets.append(int(fields[i_offset]))
+        except Exception as e:
+            self.logger.warning(f'Failed to read CDX index {cdx_uri}: {e}')
+            return []
+        finally:
+            stream.close()
+        return offsets
 
-            fs = FileSystem.get(URI(self.input_warcs), Config())
-            statuses = fs.globStatus(Path(self.input_warcs))
-            files = [str(status.getPath()) for status in statuses]
+    def _scan_offsets(self, uri: str) -> List[int]:
+        """Find WARC record offsets by reading through the WARC file.
 
+        Record contents are skipped without being kept in memory.
+
+        Args:
+            uri: URI of the WARC file.
+
+        Returns:
+            List of record offsets, empty if the WARC cannot be read.
+
+        """
+        offsets = []
+        try:
+            stream, _ = self._open_uri(uri)
+        except (IOError, RuntimeError) as e:
+            self.logger.error(f'Failed to open {uri}: {e}')
+            return offsets
+        try:
+            archive_iterator = ArchiveIterator(stream)
+            for _ in archive_iterator:
+                offsets.append(archive_iterator.get_record_offset())
+        except ArchiveLoadFailed as e:
+            self.logger.error(f'Invalid WARC: {uri} - {e}')
+        finally:
+            stream.close()
+        return offsets
+
+    def process_warc_files(self) -> pyspark.rdd.RDD:
+        """Set-up pySpark, initialize accumulators and process data as RDD.
+
+        Returns:
+            rdd: Processed data in the form of RDD.
+
+        """
+        sc = self.setup_pySpark()
+        # sqlContext = pyspark.sql.SQLContext(sc)
+        self._init_accumulators(sc)
+
+        files = self._list_warc_files(sc)
         self.logger.info(f'Start processing {len(files)} WARC files.')
 
-        # parallelize to N=len(files) partitions to process each WARC file by
-        # one worker
-        rdd = sc.parallelize(files, numSlices=len(files))
+        # split large WARC files into chunks; finding record offsets requires
+        # reading the files, so it is done in parallel as well
+        chunks = []
+        large = []
+        for uri, size in files:
+            if WARC_SPLIT_SIZE and size > WARC_SPLIT_SIZE:
+                large.append((uri, size))
+            else:
+                chunks.append((uri, 0, size))
+        if large:
+            chunks += sc.parallelize(large, numSlices=len(large)) \
+                .flatMap(self._split_warc) \
+                .collect()
+            self.logger.info(
+                f'{len(large)} large WARC files split, processing '
+                f'{len(chunks)} WARC chunks.'
+            )
+
+        # pack chunks into partitions balanced by size, each partition is
+        # processed by one worker
+        partitions = pack_by_size(
+            [(chunk, chunk[2] - chunk[1]) for chunk in chunks],
+            WARC_PARTITION_SIZE
+        )
+        self.logger.info(
+            f'WARC chunks packed into {len(partitions)} partitions.'
+        )
+        rdd = sc.parallelize(partitions, numSlices=len(partitions))
+        rdd = rdd.flatMap(lambda chunks: chunks)
 
         # process data
         rdd = rdd.mapPartitionsWithIndex(self.process_warc_partition)
@@ -489,15 +847,146 @@ class ArchiveProcessor(BaseAlgorithm):
         rdd = rdd.filter(lambda x: x is not None)
         return rdd
 
+    def _init_accumulators(self, sc: pyspark.SparkContext) -> None:
+        """Initialize accumulators counting processed records and harvests.
+
+        Args:
+            sc: Spark context.
+
+        """
+        self.Nprocessed = sc.accumulator(0)
+        self.Nfailed = sc.accumulator(0)
+        self.harvests = sc.accumulator(set(), SetAccumulatorParam())
+
     def process_hbase_table(self) -> pyspark.rdd.RDD:
         """Set-up pySpark, get rows from HBase and process data as RDD.
 
+        The main table is scanned in parallel, one partition per region (see
+        `_get_hbase_key_ranges`). Only the columns needed by the algorithms
+        are loaded (see `_get_input_columns`).
+
         Returns:
             rdd: Processed data in the form of RDD.
 
         """
-        raise NotImplementedError
-        # return rdd
+        sc = self.setup_pySpark()
+        self._init_accumulators(sc)
+
+        ranges = self._get_hbase_key_ranges()
+        self.logger.info(
+            f'Start processing HBase table {HBASE_MAIN_TABLE} in '
+            f'{len(ranges)} key ranges, loading columns '
+            f'{self.input_columns or "all"}.'
+        )
+        rdd = sc.parallelize(ranges, numSlices=len(ranges))
+
+        # process data
+        rdd = rdd.mapPartitionsWithIndex(self.process_hbase_partition)
+
+        # filter out empty records
+        rdd = rdd.filter(lambda x: x is not None)
+        return rdd
+
+    def _get_hbase_key_ranges(self) -> List[Tuple[bytes, bytes]]:
+        """Split the main table into key ranges to be scanned in parallel.
+
+        Each region of the table is one range. A table with single region is
+        split by the first hex digit of row keys (keys are UUIDs), so that
+        it is scanned by 16 tasks.
+
+        Returns:
+            List of pairs (start key, stop key), empty keys mean the
+            beginning and the end of the table.
+
+        """
+        hb = HBase(HBASE_HOST, HBASE_PORT, pooled=True)
+        try:
+            ranges = hb.get_regions(HBASE_MAIN_TABLE)
+        except Exception as e:
+            self.logger.warning(
+                f'Failed to get regions of HBase table {HBASE_MAIN_TABLE} '
+                f'({e}).'
+            )
+            ranges = []
+        finally:
+            hb.close()
+        if len(ranges) <= 1:
+            bounds = [b''] + [d.encode() for d in '123456789abcdef'] + [b'']
+            ranges = list(zip(bounds[:-1], bounds[1:]))
+        return ranges
+
+    def _get_input_columns(self) -> Optional[List[str]]:
+        """Get columns of the main table needed to process HBase rows.
+
+        These are the columns with fields required by the algorithms (and
+        not provided by preceding algorithms) plus the columns needed to
+        route and save the record. Columns with fields provided by the
+        algorithms are loaded too, so the new values can be compared with the
+        stored ones (see `decompose_record`). The "IF" column (the rest of
+        intermediary format) is loaded only if a required or provided field
+        is stored in it.
+
+        Returns:
+            List of column names, or None if all columns are needed.
+
+        """
+        fields = {REFERSTO}
+        if self.output_hbase:
+            fields.add(HARVESTID)
+        if len(self.algseq or []) > 1:
+            # records are routed to the sequences of algorithms by MIME type
+            fields.add(MIMETYPE)
+        for rtype, algnames in self.algseq or []:
+            provided = set()
+            for name, _ in self._plan_algseq(algnames):
+                cls = ALGORITHMS.get(name)
+                if cls is None:
+                    return None
+                fields.update(set(cls.REQUIRED_FIELDS) - provided)
+                provided.update(cls.PROVIDED_FIELDS)
+            fields.update(provided)
+        # unnecessary fields are never saved, EXTRA is saved only in files
+        fields -= set(UNNECESSARY_FIELDS) | {EXTRA, ID}
+        columns = set(
+            f if f in OUTPUT_SEPARATE_COLS else 'IF' for f in fields
+        )
+        return sorted(columns)
+
+    def process_hbase_partition(
+          self,
+          _id: int,
+          iterator: Any
+          ) -> Iterator[Record]:
+        """Process one data partition, i.e. one or more key ranges.
+
+        Args:
+            _id: Index of partition.
+            iterator: Iterator with key ranges of the main table, i.e. pairs
+                (start key, stop key).
+
+        Returns:
+            Generator over processed records.
+
+        """
+        self._configure_algorithms()
+        for start, stop in iterator:
+            self.logger.info(
+                f'Scanning HBase table {HBASE_MAIN_TABLE} (keys {start} - '
+                f'{stop}).'
+            )
+            hb = HBase(HBASE_HOST, HBASE_PORT, pooled=True)
+            try:
+                rows = hb.scan_range(
+                    HBASE_MAIN_TABLE,
+                    start,
+                    stop,
+                    columns=self.input_columns,
+                    batch_size=HBASE_SCAN_BATCH_SIZE
+                )
+                for row in rows:
+                    yield self._process_HBase_row(row)
+            finally:
+                hb.close()
 
     def save_rdd_textFile_extra(self, rdd: pyspark.rdd.RDD) -> None:
         """Save RDD with extra data as a text file.
@@ -530,14 +1019,35 @@ class ArchiveProcessor(BaseAlgorithm):
         """Process one row of HBase table.
 
         Args:
-            row: HBase row.
+            row: HBase row, i.e. pair (row key, dictionary with columns).
 
         Returns:
             Processed record as a list of column values or None if processing
             fails.
 
         """
-        record = Record(row)
+        key, cells = row
+        key = key.decode('utf-8')
+        data = {}
+        props = self.schema.get('properties', {})
+        for col, value in cells.items():
+            name = col.decode('utf-8').split(':', 1)[-1]
+            if not value:
+                # empty cells are saved for missing fields
+                continue
+            if name == 'IF':
+                data.update(HBase.from_bytes(value, 'object'))
+                continue
+            type_hint = props.get(name, {}).get('type')
+            if isinstance(type_hint, list):
+                type_hint = next((t for t in type_hint if t != 'null'), None)
+            data[name] = HBase.from_bytes(value, type_hint)
+        if ID not in data:
+            # see _build_hbase_record_key
+            is_uuid = re.match(r'^[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}$',
+                               key, re.I)
+            data[ID] = f'urn:uuid:{key}' if is_uuid else key
+        record = Record(data)
         return self._process_record_catch_errors(record)
 
     def _process_record_catch_errors(
@@ -576,28 +1086,21 @@ class ArchiveProcessor(BaseAlgorithm):
             conditions.
 
         """
-        if self.processIDs and record[ID] not in self.processIDs:
-            self.logger.debug(
-                f'Skipping record URL {record[URL]} and ID="{record[ID]}" (ID '
-                f'not listed in {self.onlyIDs})'
-            )
-            return None
-
-        try:
-            self._record_check_filters(record)
-        except ValueError as e:
+        reason = self._get_skip_reason(record)
+        if reason is not None:
             self.logger.debug(
                 f'Skipping record URL {record[URL]} and ID="{record[ID]}" '
-                f'({e})'
+                f'({reason})'
             )
             return None
 
-        # validate record against JSON schema
+        # validate record against JSON schema (only the loaded fields if
+        # the rest of intermediary format was not loaded from HBase)
         try:
-            data_to_validate = dict(
-                (k, v) for k, v in record.data.items() if k != EXTRA
-            )
-            validate(data_to_validate, self.schema)
+            if self.input_columns is None or 'IF' in self.input_columns:
+                self._validate_record(record)
+            else:
+                self._validate_record(record, list(record.data))
         except Exception as e:
             self.logger.error(
                 f'Skipping record URL {record[URL]} and ID="{record[ID]}" '
@@ -609,39 +1112,38 @@ class ArchiveProcessor(BaseAlgorithm):
             # check existence of corresponding row in HBASE_HARV_TABLE
             self._check_hbase_harvest_table(record)
 
-        mime = record[MIMETYPE] or ''
-        algseq = self._get_algseq_for_MIMEtype(mime)
-        if algseq is None:
-            # do not process MIME types out of --algseq input argument
-            return None
-
+        algseq = self._get_algseq_for_MIMEtype(record[MIMETYPE])
         if record.is_revisit:
             # this is a revisit record without any content, no processing
             # necessary
             algseq = []
 
-        algnames = [a.__class__.__name__ for a in algseq]
-        for alg, name in zip(algseq, algnames):
-            # modify only a deep copy of record for the possible case of
-            # rollback
-            new_record = alg.process(copy.deepcopy(record))
-            # ensure the returned record is valid
+        algnames = [a.__class__.__name__ for a, _ in algseq]
+        for (alg, drop), name in zip(algseq, algnames):
+            # changes made by the algorithm are kept in a transaction overlay
+            # for the possible case of rollback
+            record.begin()
+            alg.process(record)
+            # ensure the returned record is valid (only the changed fields
+            # need to be checked, the rest was validated before)
             try:
-                data_to_validate = dict(
-                    (k, v) for k, v in new_record.data.items() if k != EXTRA
-                )
-                validate(data_to_validate, self.schema)
+                self._validate_record(record, record.changed_fields())
             except Exception as e:
                 self.logger.error(
                     f'Ignoring returned data from algorithm "{name}", invalid '
                     f'JSON ({e.message}) (URL {record[URL]} and '
                     f'ID="{record[ID]}").'
                 )
+                record.rollback()
             else:
-                record = new_record
+                record.commit()
+            # release fields not needed by any further algorithm
+            for field in drop:
+                if field in record:
+                    del record[field]
 
         # record_type is e.g. response, revisit, ...
-        record_type = record[RECHEADERS].get("WARC-Type", "")
+        record_type = record.get_header(RECHEADERS, "WARC-Type", "")
         record = self._drop_unnecessary_fields(record)
         record_to_save = self.decompose_record(record)
         self.logger.info(
@@ -652,35 +1154,115 @@ class ArchiveProcessor(BaseAlgorithm):
         )
         return record_to_save
 
+    def _get_skip_reason(
+          self,
+          fields: Any,
+          filters: Dict[str, str] = RECORD_FILTERS
+          ) -> Optional[str]:
+        """Check whether the record matches processing conditions.
+
+        Args:
+            fields: The record or a dictionary with (some of) its metadata.
+                Metadata used in the given filters, ID and MIME type must be
+                accessible via `fields[key]`.
+            filters: Metadata filters to be checked.
+
+        Returns:
+            The reason why the record should be skipped, or None if it should
+            be processed.
+
+        """
+        if self.processIDs and fields[ID] not in self.processIDs:
+            return f'ID not listed in {self.onlyIDs}'
+        if self.input_hbase:
+            # rows in HBase passed the filters when saved, check only the
+            # loaded metadata
+            filters = dict(
+                (name, fltr) for name, fltr in filters.items()
+                if fields[name] is not None
+            )
+        try:
+            self._record_check_filters(fields, filters)
+        except ValueError as e:
+            return str(e)
+        mime = fields[MIMETYPE]
+        if self._get_algseq_for_MIMEtype(mime) is None:
+            # do not process MIME types out of --algseq input argument
+            return f'MIME type "{mime}" not selected by --algseq'
+        return None
+
+    def _validate_record(
+          self,
+          record: Record,
+          fields: Optional[Iterable[str]] = None
+          ) -> None:
+        """Validate the record against JSON schema.
+
+        The content is kept as raw bytes during processing and it is encoded
+        into a base64 string (which is always valid) only when saving, so it
+        is not validated here.
+
+        Args:
+            record: The record being processed.
+            fields: Validate only these fields (e.g. the fields changed by an
+                algorithm). If None, the whole record is validated.
+
+        Raises:
+            ValidationError if the record is not valid.
+
+        """
+        def skip(k, v):
+            return k == EXTRA or (k == CONTENT and isinstance(v, bytes))
+
+        if fields is None or not self.validator.field_level:
+            data_to_validate = dict(
+                (k, v) for k, v in record.as_dict().items() if not skip(k, v)
+            )
+            self.validator.validate(data_to_validate)
+        else:
+            self.validator.validate_fields(
+                record, [k for k in fields if not skip(k, record[k])]
+            )
+
     def _check_hbase_harvest_table(self, record: Record) -> None:
         """Check existence of corresponding row in HBASE_HARV_TABLE.
 
+        Each harvest is checked (and registered if necessary) only once per
+        executor process. The harvests of processed records are collected by
+        the `harvests` accumulator and saved into the process status by the
+        driver.
+
         Args:
             record: The record being processed.
 
         """
         hid = record[HARVESTID]
-        if not hid or hid in self.process_info["harvests"]:
+        if not hid:
             return
-
-        # check the HBase table
-        hb = HBase(HBASE_HOST, HBASE_PORT)
-        if not hb.has_row(HBASE_HARV_TABLE, hid):
-            hmeta = warc_name_to_harvest_info(record[WARCFILENAME])
-            data = {
-                "type": hmeta.get("type", ""),
-                "date": hmeta.get("date", ""),
-            }
-            self.logger.info(
-                f"Found record from a new harvest: ID={hid}, {data}."
-            )
-            hb.put(HBASE_HARV_TABLE, hid, data)
-        hb.close()
+        # adding into a set is cheap, the accumulator is merged at task end
         self.harvests.add(hid)
-        self._update_proc_status(
-            PROC_STATUS_RUNNING,
-            update_accumulators=False
+        registered = get_or_create(
+            ('registered_harvests', self.process_id), set
         )
+        if hid in registered:
+            return
+
+        # check the HBase table
+        hb = HBase(HBASE_HOST, HBASE_PORT, pooled=True)
+        try:
+            if not hb.has_row(HBASE_HARV_TABLE, hid):
+                hmeta = warc_name_to_harvest_info(record[WARCFILENAME])
+                data = {
+                    "type": hmeta.get("type", ""),
+                    "date": hmeta.get("date", ""),
+                }
+                self.logger.info(
+                    f"Found record from a new harvest: ID={hid}, {data}."
+                )
+                hb.put(HBASE_HARV_TABLE, hid, data)
+        finally:
+            hb.close()
+        registered.add(hid)
 
     def decompose_record(self, record: Record) -> List:
         """Convert Record object into output columns.
@@ -691,6 +1273,10 @@ class ArchiveProcessor(BaseAlgorithm):
         returned columns are:
             [key] + EXTRA
 
+        When processing rows from HBase (--input_hbase), only the columns
+        with fields changed by the algorithms are updated, the values of the
+        other columns are None, so nothing is written if no value changed.
+
         Args:
             record: The Record object.
 
@@ -699,14 +1285,32 @@ class ArchiveProcessor(BaseAlgorithm):
 
         """
         key = self._build_hbase_record_key(record)
+        if isinstance(record[CONTENT], bytes):
+            # raw content is serialized as base64 string (see JSON schema)
+            record[CONTENT] = bytes_to_base64(record[CONTENT])
         cols = [key]
         if self.outputFormat == "rdd_textFile_extra":
             cols += record[EXTRA]
         else:
+            data = record.as_dict()
+            if self.input_columns is None:
+                # new row, all columns are written
+                changed = None
+            else:
+                # updated row, None marks columns which must not be
+                # overwritten (either not loaded or not changed)
+                changed = record.modified_fields()
             for field in OUTPUT_SEPARATE_COLS:
-                val = record.data.pop(field, '')
+                val = data.pop(field, '')
+                if changed is not None and field not in changed:
+                    val = None
                 cols.append(val)
-            cols.append(record.data)  # the rest of intermediary format
+            if changed is not None:
+                changed -= set(OUTPUT_SEPARATE_COLS)
+                changed -= set(UNNECESSARY_FIELDS) | {EXTRA}
+                if not changed or 'IF' not in self.input_columns:
+                    data = None
+            cols.append(data)  # the rest of intermediary format
         return cols
 
     def _build_hbase_record_key(self, record: Record) -> str:
@@ -722,14 +1326,17 @@ class ArchiveProcessor(BaseAlgorithm):
         key = re.sub('^urn:uuid:', '', record[ID])
         return key
 
-    def _get_algseq_for_MIMEtype(self, mime: str) -> Optional[List]:
+    def _get_algseq_for_MIMEtype(self, mime: Optional[str]) -> Optional[List]:
         """Get sequence of processing algorithms for given MIME type.
 
         Args:
-            mime: MIME type (e.g. "text/html")
+            mime: MIME type (e.g. "text/html"). None means the MIME type was
+                not loaded from HBase (see `_get_input_columns`), which
+                happens only if there is just one sequence of algorithms.
 
         Returns:
-            algseq: List of processing algorithms for given MIME type. Return
+            algseq: List of pairs (processing algorithm, fields to be dropped
+                after it) for given MIME type, see `_plan_algseq`. Return
                 None if this MIME type should not be processed.
 
         """
@@ -745,8 +1352,12 @@ class ArchiveProcessor(BaseAlgorithm):
         # find sequence of algorithms for this MIME type and save it into cache
         for rtype, algnames in self.algseq:
             re_mime = RECORD_MIME_TYPES[rtype]
-            if re.match(re_mime, mime, re.I):
-                algseq = [self.algorithms[alg] for alg in algnames]
+            if (mime is None and self.input_hbase and len(self.algseq) == 1) \
+                    or re.match(re_mime, mime or '', re.I):
+                algseq = [
+                    (self._get_algorithm(alg), drop)
+                    for alg, drop in self._plan_algseq(algnames)
+                ]
                 self._CACHEALGSEQ[mime] = algseq
                 return algseq
 
@@ -771,17 +1382,23 @@ class ArchiveProcessor(BaseAlgorithm):
                 pass
         return record
 
-    def _record_check_filters(self, record: Record) -> None:
+    def _record_check_filters(
+          self,
+          record: Any,
+          filters: Dict[str, str] = RECORD_FILTERS
+          ) -> None:
         """Check whether the record passes all defined metadata filters.
 
         Args:
-            record: The record being processed.
+            record: The record being processed (or a dictionary with its
+                metadata).
+            filters: Metadata filters to be checked.
 
         Raises:
             ValueError if the record violates any metadata filter.
 
         """
-        for name, fltr in RECORD_FILTERS.items():
+        for name, fltr in filters.items():
             val = record[name] or ''
             if not re.match(fltr, val):
                 raise ValueError(
@@ -801,6 +1418,7 @@ class ArchiveProcessor(BaseAlgorithm):
         except Exception as e:
             self.terminate(f'Failed to initialize pyspark: {e}')
         self.logger.debug(f'pySpark context conf: {sc.getConf().getAll()}')
+        self._broadcast_data(sc)
         self.process_info["application_id"] = sc._jsc.sc().applicationId()
         self._update_proc_status(PROC_STATUS_RUNNING)
         return sc
@@ -809,9 +1427,9 @@ class ArchiveProcessor(BaseAlgorithm):
         """Save RDD partition into HBase using happybase.
 
         Due to PySpark's serialization, connections cannot be created at the
-        Spark driver and transferred across workers [1]. Instead, new
-        connection must be created for each worker (i.e. for each RDD
-        partition).
+        Spark driver and transferred across workers [1]. Instead, each worker
+        borrows a connection from its own connection pool, which is shared by
+        all RDD partitions processed by the worker.
 
         Args:
             iter: Iterable with rows to be saved.
@@ -820,16 +1438,63 @@ class ArchiveProcessor(BaseAlgorithm):
             [1] http://spark.apache.org/docs/latest/streaming-programming-guide.html#design-patterns-for-using-foreachrdd
 
         """
-        hb = HBase(HBASE_HOST, HBASE_PORT)
-        for row in iter:
-            row_key = row.pop(0)
-            row_data = dict(zip(self.output_col_names, row))
-            success = hb.put(HBASE_MAIN_TABLE, row_key, row_data)
-            if success:
-                self.Nprocessed += 1
-            else:
-                self.Nfailed += 1
-        hb.close()
+        # rows are sent in batches by background threads, so processing of
+        # next records (which happens while iterating) overlaps with writing
+        writer = HBaseAsyncWriter(
+            HBASE_HOST,
+            HBASE_PORT,
+            HBASE_MAIN_TABLE,
+            codecs=HBASE_COLUMN_CODECS
+        )
+        with writer:
+            for row in iter:
+                row_key = row.pop(0)
+                row_data = dict(
+                    (col, val) for col, val in zip(self.output_col_names, row)
+                    if val is not None
+                )
+                if row_data:
+                    index_rows = self._get_index_rows(row_key, row_data)
+                    writer.put(row_key, row_data, index_rows)
+                else:
+                    # nothing to update
+                    self.Nprocessed += 1
+        # accumulators are updated only from this (the task's) thread
+        self.Nprocessed += writer.n_saved
+        self.Nfailed += writer.n_failed
+
+    def _get_index_rows(
+          self,
+          row_key: str,
+          row_data: Dict[str, Any]
+          ) -> List[Tuple[str, str, Dict[str, str]]]:
+        """Get rows of secondary index tables pointing to the main row.
+
+        An index row is created only if all its indexed fields are present
+        in the written data, i.e. not for partial updates of rows from HBase
+        (which were indexed when written for the first time).
+
+        Args:
+            row_key: The key of the main row.
+            row_data: The data of the main row (columns).
+
+        Returns:
+            List of triples (index table name, index row key, data).
+
+        """
+        rest = row_data.get('IF') or {}
+        index_rows = []
+        for table_name, fields in HBASE_INDEXES.items():
+            values = [
+                row_data.get(f) if f in OUTPUT_SEPARATE_COLS else rest.get(f)
+                for f in fields
+            ]
+            if all(values):
+                values = [str(v) for v in values]
+                index_rows.append(
+                    (table_name, *HBase.index_row(values, row_key))
+                )
+        return index_rows
 
     def terminate(self, text=""):
         """Terminate the program in the case of any critical error.
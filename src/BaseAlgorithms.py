@@ -21,6 +21,9 @@ class BaseAlgorithm(object):
 
     """
 
+    # allow memory-lean child classes with `__slots__`
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         """Global initialization for all inherited algorithms."""
         logging.basicConfig(
@@ -53,8 +56,30 @@ class BaseProcessAlgorithm(BaseAlgorithm):
         _init(self, *args, **kwargs) ... optional initialization
         _process(self, record) ... the main record-processing code
 
+    Child classes should also declare which fields of the record they read
+    (REQUIRED_FIELDS) and which fields they write (PROVIDED_FIELDS). This is
+    used to compute shared prerequisites (e.g. tokens) only once and to drop
+    fields from the record as soon as they are not needed.
+
+    Runtime settings from HBase config table are passed to `configure()` by
+    the processor, if the algorithm lists their row keys in CONFIG_KEYS.
+
     """
 
+    REQUIRED_FIELDS = ()
+    PROVIDED_FIELDS = ()
+    CONFIG_KEYS = ()
+
+    def configure(self, config):
+        """Apply runtime settings (optionally implemented in child classes).
+
+        Args:
+            config: Dictionary {row key: setting} with a value (None if not
+                available) for each key from CONFIG_KEYS.
+
+        """
+        pass
+
     def _process(self, record):
         """Abstract processing method to be implemented in child classes."""
         raise NotImplementedError
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""..module:: archiveprocessor.ConfigCache.
+
+..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
+"""
+from typing import Any, Dict, Optional
+import threading
+import time
+
+from BaseAlgorithms import BaseAlgorithm
+from executor import get_or_create
+from HBase import HBase
+from config import (
+    HBASE_HOST,
+    HBASE_PORT,
+    HBASE_CONF_TABLE,
+    HBASE_CONF_TTL
+)
+
+
+def get_config(key: str, default: Any = None, column: str = 'value') -> Any:
+    """Get runtime setting from HBase config table.
+
+    The settings are read from the cache shared by all algorithms running in
+    this (executor) process, see `ConfigCache`.
+
+    Args:
+        key: The key of the row in config table (e.g. "topics").
+        default: Value returned if the setting is not available.
+        column: The name of the column (without the column family).
+
+    Returns:
+        The latest version of the setting.
+
+    """
+    cache = get_or_create(
+        ('ConfigCache', HBASE_HOST, HBASE_PORT, HBASE_CONF_TABLE),
+        lambda: ConfigCache(HBASE_HOST, HBASE_PORT, HBASE_CONF_TABLE)
+    )
+    return cache.get(key, default, column)
+
+
+class ConfigCache(BaseAlgorithm):
+    """Read-through cache of HBase config table.
+
+    The whole table (i.e. the latest version of each setting) is loaded by
+    one scan and kept for `ttl` seconds, so new versions of the settings are
+    picked up by running jobs after at most `ttl` seconds. If loading fails,
+    the previously loaded settings are used until the next attempt.
+
+    """
+
+    def _init(
+          self,
+          host: str,
+          port: int,
+          table_name: str = HBASE_CONF_TABLE,
+          ttl: float = HBASE_CONF_TTL
+          ) -> None:
+        """Class constructor.
+
+        Args:
+            host: Thrift server host.
+            port: Thrift server port.
+            table_name: The name of config table.
+            ttl: Time (in seconds) after which the settings are reloaded.
+
+        """
+        self.host = host
+        self.port = port
+        self.table_name = table_name
+        self.ttl = ttl
+        self.rows = {}
+        self.t_loaded = None
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None, column: str = 'value') -> Any:
+        """Get the setting, reload the table if the cache is expired.
+
+        Args:
+            key: The key of the row.
+            default: Value returned if the setting is not available.
+            column: The name of the column (without the column family).
+
+        Returns:
+            The latest version of the setting.
+
+        """
+        if self.t_loaded is None \
+                or time.monotonic() - self.t_loaded >= self.ttl:
+            with self._lock:
+                # other thread may have reloaded the table meanwhile
+                if self.t_loaded is None \
+                        or time.monotonic() - self.t_loaded >= self.ttl:
+                    self.refresh()
+        return self.rows.get(key, {}).get(column, default)
+
+    def refresh(self) -> None:
+        """Load all rows of config table."""
+        self.t_loaded = time.monotonic()
+        rows = self._load()
+        if rows is not None:
+            self.rows = rows
+
+    def _load(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Load all rows of config table.
+
+        Returns:
+            Dictionary {row key: {column name: value}}, or None if failed.
+
+        """
+        hb = None
+        try:
+            hb = HBase(self.host, self.port, pooled=True)
+            rows = {}
+            for key, data in hb.scan_range(self.table_name):
+                rows[key.decode('utf-8')] = dict(
+                    (col.decode('utf-8').split(':', 1)[-1],
+                     HBase.from_bytes(value))
+                    for col, value in data.items()
+                )
+        except Exception as e:
+            self.logger.warning(
+                f'Failed to load HBase table {self.table_name} ({e}), using '
+                f'previously loaded settings.'
+            )
+            return None
+        finally:
+            if hb is not None:
+                hb.close()
+        self.logger.info(
+            f'Loaded {len(rows)} settings from HBase table {self.table_name}.'
+        )
+        return rows
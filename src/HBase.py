@@ -5,20 +5,463 @@
 
 ..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
 """
-from typing import Dict, Any, Optional, Generator, List
+from typing import Dict, Any, Optional, Generator, List, Tuple, Callable
 import json
+import math
+import random
+import shutil
+import subprocess
+import time
+import queue
+import threading
+import zlib
 
 import happybase
 import bson
+import msgpack
+import zstandard
 
 from BaseAlgorithms import BaseAlgorithm
+from executor import get_or_create
 from config import (
     HBASE_MAIN_TABLE,
     HBASE_HARV_TABLE,
     HBASE_CONF_TABLE,
-    HBASE_PROC_TABLE
+    HBASE_PROC_TABLE,
+    HBASE_URL_INDEX_TABLE,
+    HBASE_HARV_INDEX_TABLE,
+    HBASE_DIGEST_INDEX_TABLE,
+    HBASE_INDEXES,
+    HBASE_BATCH_SIZE,
+    HBASE_FLUSH_INTERVAL,
+    HBASE_POOL_SIZE,
+    HBASE_POOL_TIMEOUT,
+    HBASE_WRITER_THREADS,
+    HBASE_WRITE_QUEUE_SIZE,
+    HBASE_MAIN_TABLE_REGIONS,
+    HBASE_COMPRESSION,
+    HBASE_BLOCK_ENCODING,
+    HBASE_COMPRESS_MIN_SIZE,
+    HBASE_MAX_FAILS,
+    HBASE_RETRY_DELAY,
+    HBASE_RETRY_MAX_DELAY,
+    HBASE_BREAKER_THRESHOLD,
+    HBASE_BREAKER_TIMEOUT,
+    HBASE_BREAKER_MAX_WAIT
 )
 
+# encoded cell values (see `HBase.to_bytes`) start with this marker followed
+# by one byte of serializer and one byte of compressor; the marker cannot
+# start UTF-8 text nor JSON, and a BSON document starting with it would be
+# either longer than 1.6 GB or followed by unknown serializer byte; legacy
+# values followed by unknown codec bytes are decoded as legacy values, so
+# only raw bytes starting with the marker and known codec bytes (which are
+# assumed not to be stored) would be misread
+CODEC_MARKER = b'\xffAP'
+_SERIALIZERS = {
+    'str': b's',
+    'json': b'j',
+    'bson': b'b',
+    'msgpack': b'm',
+}
+_COMPRESSORS = {
+    '': b'-',
+    'zlib': b'z',
+    'zstd': b'Z',
+}
+# zstandard (de)compressors must not be shared by threads
+_LOCAL = threading.local()
+
+
+def get_connection_pool(host: str, port: int) -> 'HBaseConnectionPool':
+    """Return the connection pool for given Thrift server.
+
+    The pool is shared by all tasks running in this (executor) process.
+
+    Args:
+        host: Thrift server host.
+        port: Thrift server port.
+
+    Returns:
+        The connection pool.
+
+    """
+    return get_or_create(
+        ('HBaseConnectionPool', host, port),
+        lambda: HBaseConnectionPool(host, port)
+    )
+
+
+def get_circuit_breaker(host: str, port: int) -> 'CircuitBreaker':
+    """Return the circuit breaker for given Thrift server.
+
+    The breaker is shared by all tasks of the job running in this (executor)
+    process.
+
+    Args:
+        host: Thrift server host.
+        port: Thrift server port.
+
+    Returns:
+        The circuit breaker.
+
+    """
+    return get_or_create(
+        ('CircuitBreaker', host, port),
+        lambda: CircuitBreaker(f'{host}:{port}')
+    )
+
+
+def parse_codec(codec: str) -> Tuple[Optional[str], str]:
+    """Parse codec specification.
+
+    Args:
+        codec: Serializer and/or compressor joined by '+', e.g. 'zstd',
+            'msgpack' or 'msgpack+zlib'.
+
+    Returns:
+        Pair (serializer or None for the default one, compressor or '').
+
+    Raises:
+        ValueError if the specification is not valid.
+
+    """
+    serializer, compressor = None, ''
+    for name in filter(None, codec.split('+')):
+        if name in _SERIALIZERS and name != 'str' and serializer is None:
+            serializer = name
+        elif name in _COMPRESSORS and not compressor:
+            compressor = name
+        else:
+            raise ValueError(f'Unsupported HBase codec "{codec}".')
+    return serializer, compressor
+
+
+def _compress(data: bytes, compressor: str) -> bytes:
+    """Compress the data by given compressor."""
+    if compressor == 'zlib':
+        return zlib.compress(data)
+    if not hasattr(_LOCAL, 'zstd_compressor'):
+        _LOCAL.zstd_compressor = zstandard.ZstdCompressor()
+    return _LOCAL.zstd_compressor.compress(data)
+
+
+def _decompress(data: bytes, compressor: bytes) -> bytes:
+    """Decompress the data compressed by given compressor (code)."""
+    if compressor == _COMPRESSORS['zlib']:
+        return zlib.decompress(data)
+    if not hasattr(_LOCAL, 'zstd_decompressor'):
+        _LOCAL.zstd_decompressor = zstandard.ZstdDecompressor()
+    return _LOCAL.zstd_decompressor.decompress(data)
+
+
+def get_split_keys(regions: int) -> List[bytes]:
+    """Get keys splitting the space of hexadecimal row keys into regions.
+
+    The split keys are hexadecimal prefixes evenly spread over the key space,
+    e.g. b'1', b'2', ..., b'f' for 16 regions.
+
+    Args:
+        regions: Number of regions.
+
+    Returns:
+        List of `regions - 1` split keys.
+
+    """
+    if regions <= 1:
+        return []
+    digits = max(1, math.ceil(math.log(regions, 16)))
+    space = 16 ** digits
+    return [
+        format(i * space // regions, f'0{digits}x').encode()
+        for i in range(1, regions)
+    ]
+
+
+class RetryPolicy(BaseAlgorithm):
+    """Policy of repeating failed HBase operations.
+
+    The delay before next attempt grows exponentially with the number of
+    failed attempts and it is randomized ("full jitter"), so the tasks which
+    failed at the same time do not retry at the same time again.
+
+    """
+
+    def _init(
+          self,
+          max_fails: int = HBASE_MAX_FAILS,
+          base_delay: float = HBASE_RETRY_DELAY,
+          max_delay: float = HBASE_RETRY_MAX_DELAY
+          ) -> None:
+        """Class constructor.
+
+        Args:
+            max_fails: Maximum number of failed attempts before giving up.
+            base_delay: Maximum delay (in seconds) after the first failure.
+            max_delay: Upper limit of the delay (in seconds).
+
+        """
+        self.max_fails = max_fails
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, n_fails: int) -> float:
+        """Get the delay before next attempt.
+
+        Args:
+            n_fails: Number of failed attempts so far.
+
+        Returns:
+            Delay in seconds.
+
+        """
+        limit = self.base_delay * 2 ** max(0, n_fails - 1)
+        return random.uniform(0, min(self.max_delay, limit))
+
+
+class CircuitBreaker(BaseAlgorithm):
+    """Circuit breaker stopping HBase operations while HBase is failing.
+
+    After `threshold` consecutive failed attempts, the breaker opens and the
+    callers of `wait` sleep until `reset_timeout` seconds pass, so writing is
+    paused instead of failing. Then the breaker is half-open: only one caller
+    is let through as a probe, the others wait for its result. The breaker
+    is closed by successful probe, or opened again by failed one. A caller
+    gives up after waiting `max_wait` seconds in total.
+
+    """
+
+    def _init(
+          self,
+          name: str,
+          threshold: int = HBASE_BREAKER_THRESHOLD,
+          reset_timeout: float = HBASE_BREAKER_TIMEOUT,
+          max_wait: float = HBASE_BREAKER_MAX_WAIT
+          ) -> None:
+        """Class constructor.
+
+        Args:
+            name: Name of the guarded service (used in logs).
+            threshold: Number of consecutive failures opening the breaker.
+            reset_timeout: Time (in seconds) the breaker stays open.
+            max_wait: Maximum time (in seconds) a caller waits for the
+                breaker to let it through.
+
+        """
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_wait = max_wait
+        self.n_failures = 0
+        self.t_opened = None
+        # start time of the probe in half-open state (None = no probe)
+        self.t_probe = None
+        self._cond = threading.Condition(threading.Lock())
+
+    def allow(self) -> bool:
+        """Return True if an operation may be attempted now."""
+        with self._cond:
+            return self._state(time.monotonic()) != 'open'
+
+    def wait(self) -> bool:
+        """Wait until an operation may be attempted.
+
+        Returns:
+            True if the operation may be attempted (the breaker is closed or
+            the caller is the probe of half-open breaker), False if waiting
+            took longer than `max_wait`.
+
+        """
+        t_end = time.monotonic() + self.max_wait
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                state = self._state(now)
+                if state == 'closed':
+                    return True
+                if state == 'half-open':
+                    self.t_probe = now
+                    return True
+                if now >= t_end:
+                    return False
+                if self.t_probe is not None:
+                    # wait for the result of the probe
+                    t_next = self.t_probe + self.reset_timeout
+                else:
+                    t_next = self.t_opened + self.reset_timeout
+                self._cond.wait(max(0, min(t_next, t_end) - now))
+
+    def _state(self, now: float) -> str:
+        """Get the state of the breaker (the lock must be held).
+
+        Args:
+            now: Current monotonic time.
+
+        Returns:
+            "closed", "open" or "half-open" (i.e. a probe may be started).
+
+        """
+        if self.t_opened is None:
+            return 'closed'
+        if self.t_probe is not None:
+            # the probe is running (unless it is lost for too long)
+            if now - self.t_probe < self.reset_timeout:
+                return 'open'
+        elif now - self.t_opened < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def record_success(self) -> None:
+        """Record successful operation (close the breaker)."""
+        with self._cond:
+            if self.t_opened is not None:
+                self.logger.info(f'{self.name} is available again.')
+            self.n_failures = 0
+            self.t_opened = None
+            self.t_probe = None
+            self._cond.notify_all()
+
+    def record_failure(self) -> None:
+        """Record failed attempt (open the breaker if necessary)."""
+        with self._cond:
+            self.n_failures += 1
+            if self.n_failures >= self.threshold:
+                if self.t_opened is None:
+                    self.logger.error(
+                        f'{self.name} failed {self.n_failures} times in a '
+                        f'row, operations are suspended for '
+                        f'{self.reset_timeout} s.'
+                    )
+                self.t_opened = time.monotonic()
+            self.t_probe = None
+            self._cond.notify_all()
+
+
+class HBaseConnectionPool(BaseAlgorithm):
+    """Thread-safe pool of happybase connections to one Thrift server.
+
+    At most `size` connections are open at once. Idle connections are
+    checked before they are lent (connections with closed transport are
+    replaced by new ones) and broken connections returned by the borrower
+    are closed.
+
+    """
+
+    def _init(
+          self,
+          host: str,
+          port: int,
+          size: int = HBASE_POOL_SIZE,
+          timeout: float = HBASE_POOL_TIMEOUT
+          ) -> None:
+        """Class constructor.
+
+        Args:
+            host: Thrift server host.
+            port: Thrift server port.
+            size: Maximum number of open connections.
+            timeout: Maximum time (in seconds) to wait for a free connection.
+
+        """
+        self.host = host
+        self.port = port
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.idle = []
+        self.n_open = 0
+        self.cond = threading.Condition()
+
+    @staticmethod
+    def is_healthy(conn: happybase.Connection) -> bool:
+        """Check (without a round trip to the server) if connection is open.
+
+        Args:
+            conn: The connection.
+
+        Returns:
+            False if the connection's transport is closed, True otherwise.
+
+        """
+        transport = getattr(conn, 'transport', None)
+        try:
+            return transport is None or bool(transport.is_open())
+        except Exception:
+            return False
+
+    def acquire(self) -> happybase.Connection:
+        """Borrow a connection from the pool.
+
+        Returns:
+            Open connection.
+
+        Raises:
+            happybase.NoConnectionsAvailable if no connection is released
+            within the timeout.
+
+        """
+        with self.cond:
+            deadline = time.monotonic() + self.timeout
+            while True:
+                while self.idle:
+                    conn = self.idle.pop()
+                    if self.is_healthy(conn):
+                        return conn
+                    self.logger.debug('Replacing closed HBase connection.')
+                    self._close(conn)
+                if self.n_open < self.size:
+                    self.n_open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    raise happybase.NoConnectionsAvailable(
+                        f'No HBase connection released within '
+                        f'{self.timeout} seconds.'
+                    )
+        try:
+            return happybase.Connection(self.host, port=self.port)
+        except Exception:
+            with self.cond:
+                self.n_open -= 1
+                self.cond.notify()
+            raise
+
+    def release(
+          self,
+          conn: happybase.Connection,
+          broken: bool = False
+          ) -> None:
+        """Return the connection into the pool.
+
+        Args:
+            conn: The borrowed connection.
+            broken: Whether the connection failed and should be closed.
+
+        """
+        with self.cond:
+            if broken or not self.is_healthy(conn):
+                self._close(conn)
+            else:
+                self.idle.append(conn)
+            self.cond.notify()
+
+    def close(self) -> None:
+        """Close all idle connections."""
+        with self.cond:
+            while self.idle:
+                self._close(self.idle.pop())
+
+    def _close(self, conn: happybase.Connection) -> None:
+        """Close the connection and remove it from the pool.
+
+        Must be called with `self.cond` acquired.
+
+        """
+        self.n_open -= 1
+        try:
+            conn.close()
+        except Exception as e:
+            self.logger.debug(f'Failed to close HBase connection: {e}')
+
 
 class HBase(BaseAlgorithm):
     """Module for handling HBase operations using happybase package.
@@ -31,22 +474,61 @@ class HBase(BaseAlgorithm):
 
     """
 
-    def _init(self, host: str, port: int) -> None:
-        """Class constructor."""
+    def _init(
+          self,
+          host: str,
+          port: int,
+          pooled: bool = False,
+          retry_policy: Optional[RetryPolicy] = None
+          ) -> None:
+        """Class constructor.
+
+        Args:
+            host: Thrift server host.
+            port: Thrift server port.
+            pooled: If True, the connection is borrowed from the connection
+                pool shared within the process (see `get_connection_pool`)
+                and `close` returns it back into the pool.
+            retry_policy: Policy of repeating failed writes (default policy
+                is created if None). Writes are also guarded by the circuit
+                breaker shared within the process (see
+                `get_circuit_breaker`).
+
+        """
         self.host = host
         self.port = port
-        self.conn = happybase.Connection(host, port=port)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = get_circuit_breaker(host, port)
+        self.pool = get_connection_pool(host, port) if pooled else None
+        self.conn = self._connect()
         self.CACHE = {}
 
+    def _connect(self) -> happybase.Connection:
+        """Open new connection or borrow one from the pool."""
+        if self.pool is not None:
+            return self.pool.acquire()
+        return happybase.Connection(self.host, port=self.port)
+
     def close(self) -> None:
-        """Close the connection with HBase."""
-        self.conn.close()
+        """Close the connection with HBase (or return it into the pool)."""
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        if self.pool is not None:
+            self.pool.release(conn)
+        else:
+            conn.close()
 
     def restart_connection(self) -> None:
         """Restart the connection with HBase."""
-        self.conn.close()
-        self.conn = happybase.Connection(self.host, port=self.port)
+        conn, self.conn = self.conn, None
         self.CACHE = {}
+        if conn is not None:
+            if self.pool is not None:
+                self.pool.release(conn, broken=True)
+            else:
+                conn.close()
+        self.conn = self._connect()
 
     def get_tables(self) -> set:
         """Return set of all HBase table names."""
@@ -65,28 +547,120 @@ class HBase(BaseAlgorithm):
         table = self.to_bytes(table)
         return table in self.get_tables()
 
-    def create_table(self, name: str, max_versions: int = 1) -> None:
+    def create_table(
+          self,
+          name: str,
+          max_versions: int = 1,
+          regions: int = 1,
+          compression: str = '',
+          block_encoding: str = ''
+          ) -> None:
         """Create HBase table with single column family.
 
+        Thrift API does not support pre-split tables and block encoding, so
+        if any of them is required, the table is created using `hbase shell`.
+        If the shell is not available (or fails), the table is created via
+        Thrift without them.
+
         Args:
             name: The name of the table.
             max_versions: Maximum number of historical versions to keep in
                 HBase.
+            regions: Number of initial regions, the table is pre-split by
+                hexadecimal prefixes of row keys (see `get_split_keys`).
+            compression: Compression of the column family (e.g. 'GZ',
+                'SNAPPY'), empty string for HBase default.
+            block_encoding: Data block encoding of the column family (e.g.
+                'FAST_DIFF', 'PREFIX'), empty string for HBase default.
 
         """
         name = self.to_bytes(name)
+        splits = get_split_keys(regions)
+        if (splits or block_encoding) and self._create_table_shell(
+              name, max_versions, splits, compression, block_encoding):
+            return
+        if splits or block_encoding:
+            self.logger.warning(
+                f'HBase table {name} is created without pre-splitting and '
+                f'block encoding (hbase shell is not available).'
+            )
+        options = dict(max_versions=max_versions)
+        if compression:
+            options['compression'] = compression
         families = {
-            'cf1': dict(max_versions=max_versions),
+            'cf1': options,
             }
         self.conn.create_table(name, families)
 
-    def check_table(self, name: str, max_versions: int = 1) -> None:
+    def _create_table_shell(
+          self,
+          name: bytes,
+          max_versions: int,
+          splits: List[bytes],
+          compression: str,
+          block_encoding: str
+          ) -> bool:
+        """Create HBase table using `hbase shell` command.
+
+        Args:
+            name: The name of the table.
+            max_versions: Maximum number of historical versions to keep.
+            splits: Split keys of initial regions.
+            compression: Compression of the column family.
+            block_encoding: Data block encoding of the column family.
+
+        Returns:
+            True if the table was successfully created, False otherwise.
+
+        """
+        hbase = shutil.which('hbase')
+        if hbase is None:
+            return False
+        family = f"NAME => 'cf1', VERSIONS => {max_versions}"
+        if compression:
+            family += f", COMPRESSION => '{compression}'"
+        if block_encoding:
+            family += f", DATA_BLOCK_ENCODING => '{block_encoding}'"
+        cmd = f"create '{name.decode()}', {{{family}}}"
+        if splits:
+            keys = ', '.join(f"'{key.decode()}'" for key in splits)
+            cmd += f", {{SPLITS => [{keys}]}}"
+        try:
+            subprocess.run(
+                [hbase, 'shell', '-n'],
+                input=cmd + '\n',
+                universal_newlines=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=600,
+                check=True,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            self.logger.error(
+                f'Failed to create HBase table {name} using hbase shell: {e}.'
+            )
+            return False
+        # the shell may be configured for another cluster than Thrift server
+        return self.has_table(name)
+
+    def check_table(
+          self,
+          name: str,
+          max_versions: int = 1,
+          regions: int = 1,
+          compression: str = '',
+          block_encoding: str = ''
+          ) -> None:
         """Create and/or enable table if necessary.
 
         Args:
             name: The name of the table.
             max_versions: Maximum number of historical versions to keep in
                 HBase.
+            regions: Number of initial regions of a new table.
+            compression: Compression of the column family of a new table.
+            block_encoding: Data block encoding of the column family of a new
+                table.
 
         """
         name = self.to_bytes(name)
@@ -94,7 +668,9 @@ class HBase(BaseAlgorithm):
             self.logger.info(f'Checking HBase table {name} ... OK.')
             return
         if not self.has_table(name):
-            self.create_table(name, max_versions)
+            self.create_table(
+                name, max_versions, regions, compression, block_encoding
+            )
             self.logger.info(f'HBase table {name} successfully created.')
         if not self.conn.is_table_enabled(name):
             self.conn.enable_table(name)
@@ -110,13 +686,32 @@ class HBase(BaseAlgorithm):
         name = self.to_bytes(name)
         self.conn.disable_table(name)
 
-    def check_tables(self) -> None:
-        """Check all tables. Create and/or enable if necessary."""
+    def check_tables(
+          self,
+          regions: int = HBASE_MAIN_TABLE_REGIONS,
+          compression: str = HBASE_COMPRESSION,
+          block_encoding: str = HBASE_BLOCK_ENCODING
+          ) -> None:
+        """Check all tables. Create and/or enable if necessary.
+
+        The other tables are small, so they are created via Thrift without
+        any of the options of the main table.
+
+        Args:
+            regions: Number of initial regions of new main table.
+            compression: Compression of new main table.
+            block_encoding: Data block encoding of new main table.
+
+        """
         self.logger.info(f'Checking HBase tables:')
-        self.check_table(HBASE_MAIN_TABLE, 1)
+        self.check_table(
+            HBASE_MAIN_TABLE, 1, regions, compression, block_encoding
+        )
         self.check_table(HBASE_HARV_TABLE, 1)
         self.check_table(HBASE_CONF_TABLE, 100)
         self.check_table(HBASE_PROC_TABLE, 1)
+        for table in HBASE_INDEXES:
+            self.check_table(table, 1)
 
     def delete_table(self, name: str) -> None:
         """Delete table with given name.
@@ -153,8 +748,9 @@ class HBase(BaseAlgorithm):
           table_name: str,
           key: str,
           data: Dict[str, Any],
-          max_fails: int = 3,
+          max_fails: Optional[int] = None,
           dict2bson: bool = True,
+          codecs: Optional[Dict[str, str]] = None,
           **kwargs
           ) -> bool:
         """Save row into given table.
@@ -166,44 +762,128 @@ class HBase(BaseAlgorithm):
             table_name: The name of the table.
             key: The key of the row.
             data: Dictionary with the row data.
-            max_fails: Maximum number of failed attempts before giving up.
+            max_fails: Maximum number of failed attempts before giving up
+                (None = use the retry policy).
             dict2bson: Whether to convert possible dictionaries in the data
                 values into BSON format.
+            codecs: Codecs of the columns, see `row_to_bytes`.
 
         Returns:
             True if the row was successfully saved, False otherwise.
 
         """
-        table = self.get_table(table_name)
         key = self.to_bytes(key)
-        data_bytes = {}
-        for k, v in data.items():
-            k = self.to_bytes(k)
-            if not k.startswith(b'cf1:'):
-                k = b'cf1:' + k
-            v = self.to_bytes(v, dict2bson=dict2bson)
-            data_bytes[k] = v
+        data_bytes = self.row_to_bytes(data, dict2bson, codecs)
+
+        def _put():
+            table = self.get_table(table_name)
+            table.put(key, data_bytes, **kwargs)
+
+        return self._retry(
+            _put, f'HBase row with key {key}', 'Record has', max_fails
+        )
+
+    def put_batch(
+          self,
+          table_name: str,
+          rows: List[Tuple[str, Dict[str, Any]]],
+          max_fails: Optional[int] = None,
+          dict2bson: bool = True,
+          codecs: Optional[Dict[str, str]] = None,
+          **kwargs
+          ) -> bool:
+        """Save several rows into given table in one batch.
+
+        All rows are sent to Thrift server at once. If sending fails, only
+        this batch is repeated (with restarted connection) according to the
+        retry policy.
+
+        Args:
+            table_name: The name of the table.
+            rows: List of pairs (row key, dictionary with the row data).
+            max_fails: Maximum number of failed attempts before giving up
+                (None = use the retry policy).
+            dict2bson: Whether to convert possible dictionaries in the data
+                values into BSON format.
+            codecs: Codecs of the columns, see `row_to_bytes`.
+            kwargs: Additional arguments for happybase.Table.batch.
+
+        Returns:
+            True if the rows were successfully saved, False otherwise.
+
+        """
+        rows_bytes = [
+            (self.to_bytes(key), self.row_to_bytes(data, dict2bson, codecs))
+            for key, data in rows
+        ]
+
+        def _put_batch():
+            table = self.get_table(table_name)
+            batch = table.batch(**kwargs)
+            for key, data_bytes in rows_bytes:
+                batch.put(key, data_bytes)
+            batch.send()
+
+        return self._retry(
+            _put_batch, f'batch of {len(rows)} HBase rows', 'Records have',
+            max_fails
+        )
+
+    def _retry(
+          self,
+          operation: Callable[[], Any],
+          what: str,
+          subject: str,
+          max_fails: Optional[int] = None
+          ) -> bool:
+        """Run the write operation, repeat it if it fails.
+
+        After each failure, the operation is repeated with restarted
+        connection after the delay given by the retry policy. While the
+        circuit breaker is open, the operation waits (see
+        `CircuitBreaker.wait`).
+
+        Args:
+            operation: Function without arguments doing the write.
+            what: Description of written data (used in logs).
+            subject: Subject of the final error message (used in logs).
+            max_fails: Maximum number of failed attempts before giving up
+                (None = use the retry policy).
 
+        Returns:
+            True if the operation succeeded, False otherwise.
+
+        """
+        if max_fails is None:
+            max_fails = self.retry_policy.max_fails
         N_fails = 0
         while True:
+            if not self.breaker.wait():
+                self.logger.error(
+                    f'Failed to save {what}, HBase is not available for '
+                    f'{self.breaker.max_wait} s. {subject} not been saved!'
+                )
+                return False
             try:
-                table = self.get_table(table_name)
-                table.put(key, data_bytes, **kwargs)
+                if N_fails or self.conn is None:
+                    self.restart_connection()
+                operation()
+                self.breaker.record_success()
                 return True
             except Exception as e:
                 N_fails += 1
-                err = (
-                    f'{N_fails}. fail to save HBase row with key {key} ({e}).'
-                )
+                self.breaker.record_failure()
+                err = f'{N_fails}. fail to save {what} ({e}).'
                 if N_fails < max_fails:
-                    self.restart_connection()
+                    delay = self.retry_policy.get_delay(N_fails)
                     self.logger.warning(
                         f"{err} Trying to repeat the operation with restarted"
-                        f" connection."
+                        f" connection in {delay:.1f} s."
                     )
+                    time.sleep(delay)
                 else:
                     self.logger.error(
-                        f"{err} Reached maximum number of fails. Record has "
+                        f"{err} Reached maximum number of fails. {subject} "
                         f"not been saved!"
                     )
                     return False
@@ -276,6 +956,137 @@ class HBase(BaseAlgorithm):
                 f'Failed to scan HBase rows with prefix {prefix}: {e}'
             )
 
+    @staticmethod
+    def index_row(
+          values: List[str],
+          key: str
+          ) -> Tuple[str, Dict[str, str]]:
+        """Build a row of secondary index table.
+
+        The index row key consists of indexed values and the main row key
+        (so that it is unique) separated by spaces.
+
+        Args:
+            values: Indexed values (e.g. URL key and timestamp).
+            key: The key of the row in the main table.
+
+        Returns:
+            Pair (index row key, index row data).
+
+        """
+        return ' '.join(list(values) + [key]), {'id': key}
+
+    def lookup_index(self, table_name: str, prefix: str) -> List[str]:
+        """Find main row keys in secondary index table.
+
+        Args:
+            table_name: The name of the index table.
+            prefix: Prefix of the index row keys, see `index_row`.
+
+        Returns:
+            List of main row keys sorted by index row keys.
+
+        """
+        rows = self.get_rows_by_prefix(
+            table_name, prefix, columns=[b'cf1:id']
+        )
+        return [data[b'cf1:id'].decode('utf-8') for _, data in rows or []]
+
+    def get_keys_by_urlkey(
+          self,
+          urlkey: str,
+          timestamp: str = ''
+          ) -> List[str]:
+        """Find main row keys of all captures of given URL key.
+
+        Args:
+            urlkey: The URL key (SURT).
+            timestamp: Capture timestamp or its prefix (e.g. '2020' for all
+                captures from year 2020).
+
+        Returns:
+            List of main row keys sorted by capture timestamp.
+
+        """
+        prefix = f'{urlkey} {timestamp}'
+        return self.lookup_index(HBASE_URL_INDEX_TABLE, prefix)
+
+    def get_keys_by_harvest(self, harvest_id: str) -> List[str]:
+        """Find main row keys of all records from given harvest.
+
+        Args:
+            harvest_id: The ID of the harvest.
+
+        Returns:
+            List of main row keys.
+
+        """
+        return self.lookup_index(HBASE_HARV_INDEX_TABLE, f'{harvest_id} ')
+
+    def get_keys_by_digest(self, digest: str) -> List[str]:
+        """Find main row keys of all records with given payload digest.
+
+        Args:
+            digest: The payload digest (e.g. 'sha1:...').
+
+        Returns:
+            List of main row keys.
+
+        """
+        return self.lookup_index(HBASE_DIGEST_INDEX_TABLE, f'{digest} ')
+
+    def scan_range(
+          self,
+          table_name: str,
+          start: Optional[bytes] = None,
+          stop: Optional[bytes] = None,
+          columns: Optional[List[str]] = None,
+          **kwargs
+          ) -> Generator:
+        """Scan HBase rows with keys in given range.
+
+        Args:
+            table_name: The name of the table.
+            start: The first row key of the range (inclusive), None for the
+                beginning of the table.
+            stop: The last row key of the range (exclusive), None for the end
+                of the table.
+            columns: Names of the columns to be fetched (with or without the
+                column family prefix), None for all columns.
+            kwargs: Additional arguments for happybase's scan function (e.g.
+                batch_size).
+
+        Returns:
+            Generator yielding pairs (row key, row dict).
+
+        """
+        table = self.get_table(table_name)
+        if columns is not None:
+            columns = [
+                c if c.startswith(b'cf1:') else b'cf1:' + c
+                for c in map(self.to_bytes, columns)
+            ]
+        return table.scan(
+            row_start=start or None,
+            row_stop=stop or None,
+            columns=columns,
+            **kwargs
+        )
+
+    def get_regions(self, table_name: str) -> List[Tuple[bytes, bytes]]:
+        """Return key ranges of the table regions.
+
+        Args:
+            table_name: The name of the table.
+
+        Returns:
+            List of pairs (start key, end key); empty keys mean the beginning
+            and the end of the table.
+
+        """
+        table = self.get_table(table_name)
+        return [(r['start_key'], r['end_key']) for r in table.regions()]
+
     def get_cell_versions(
           self,
           table_name: str,
@@ -333,7 +1144,86 @@ class HBase(BaseAlgorithm):
                 f'table {table_name}.'
             )
 
-    def to_bytes(self, obj: Any, dict2bson: bool = True) -> bytes:
+    def row_to_bytes(
+          self,
+          data: Dict[str, Any],
+          dict2bson: bool = True,
+          codecs: Optional[Dict[str, str]] = None
+          ) -> Dict[bytes, bytes]:
+        """Serialize row data into bytes.
+
+        Do not rely on Thrift server to convert data into bytes, do it
+        explicitly here.
+
+        Args:
+            data: Dictionary with the row data.
+            dict2bson: Whether to convert possible dictionaries in the data
+                values into BSON format.
+            codecs: Codecs of the columns (column name without the column
+                family -> codec, see `to_bytes`). Columns not listed are
+                serialized without codec.
+
+        Returns:
+            Dictionary with column names (prefixed by the column family) and
+            values serialized into bytes.
+
+        """
+        codecs = codecs or {}
+        data_bytes = {}
+        for k, v in data.items():
+            codec = codecs.get(k)
+            k = self.to_bytes(k)
+            if not k.startswith(b'cf1:'):
+                k = b'cf1:' + k
+            v = self.to_bytes(v, dict2bson=dict2bson, codec=codec)
+            data_bytes[k] = v
+        return data_bytes
+
+    @staticmethod
+    def from_bytes(value: bytes, type_hint: Optional[str] = None) -> Any:
+        """Deserialize bytes created by `to_bytes`.
+
+        Args:
+            value: Serialized value.
+            type_hint: JSON schema type of the value ("string", "object",
+                ...). Strings are stored as raw bytes, so they cannot be
+                distinguished from JSON without the hint. Values encoded by
+                a codec are recognized by the marker followed by known
+                codec bytes (see CODEC_MARKER), so the hint is ignored.
+
+        Returns:
+            Deserialized object.
+
+        """
+        n = len(CODEC_MARKER)
+        serializer, compressor = value[n:n + 1], value[n + 1:n + 2]
+        if value.startswith(CODEC_MARKER) \
+                and serializer in _SERIALIZERS.values() \
+                and compressor in _COMPRESSORS.values():
+            value = value[n + 2:]
+            if compressor != _COMPRESSORS['']:
+                value = _decompress(value, compressor)
+            if serializer == _SERIALIZERS['msgpack']:
+                return msgpack.unpackb(value, raw=False)
+            if serializer == _SERIALIZERS['json']:
+                return json.loads(value)
+            type_hint = 'string' if serializer == _SERIALIZERS['str'] \
+                else 'object'
+        if type_hint == 'string':
+            return value.decode('utf-8', errors='replace')
+        if type_hint == 'object':
+            return bson.loads(value)
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value.decode('utf-8', errors='replace')
+
+    def to_bytes(
+          self,
+          obj: Any,
+          dict2bson: bool = True,
+          codec: Optional[str] = None
+          ) -> bytes:
         """Serialize object into bytes.
 
         Based on the type of the object, suitable converting method is
@@ -342,10 +1232,17 @@ class HBase(BaseAlgorithm):
         - BSON for dictionaries,
         - JSON followed by byte conversion for other types.
 
+        If a codec is given (e.g. 'zstd', 'msgpack+zlib', see `parse_codec`),
+        non-string objects are serialized by the codec's serializer (if any)
+        and the result is compressed by its compressor (unless it is shorter
+        than HBASE_COMPRESS_MIN_SIZE). The value is prefixed by CODEC_MARKER
+        and the codec, so `from_bytes` can detect the format.
+
         Args:
             obj: Object to be serialized.
             dict2bson: Whether to convert possible dictionaries in the data
                 values into BSON format.
+            codec: Codec specification, None for plain serialization.
 
         Returns:
             Object serialized into bytes.
@@ -377,7 +1274,30 @@ class HBase(BaseAlgorithm):
 
         if isinstance(obj, bytes):
             return obj
-        elif isinstance(obj, str):
+        if codec and obj != '':
+            # (empty string is kept empty, it marks missing field)
+            serializer, compressor = parse_codec(codec)
+            if isinstance(obj, str):
+                serializer = 'str'
+            elif serializer is None or serializer == 'bson':
+                serializer = 'bson' if isinstance(obj, dict) and dict2bson \
+                    else 'json'
+            if serializer == 'msgpack':
+                data = _dumps(msgpack, obj)
+            else:
+                data = self.to_bytes(obj, dict2bson=serializer == 'bson')
+            if not data:
+                # serialization failed, mark missing field
+                return b''
+            if len(data) < HBASE_COMPRESS_MIN_SIZE:
+                compressor = ''
+            if compressor:
+                data = _compress(data, compressor)
+            return (
+                CODEC_MARKER + _SERIALIZERS[serializer]
+                + _COMPRESSORS[compressor] + data
+            )
+        if isinstance(obj, str):
             return _str_to_bytes(obj)
         elif isinstance(obj, dict) and dict2bson:
             # BSON is more effective for dictionaries
@@ -387,3 +1307,331 @@ class HBase(BaseAlgorithm):
             # -> bytes
             obj_str = _dumps(json, obj)
             return _str_to_bytes(obj_str)
+
+
+class HBaseBatchWriter(BaseAlgorithm):
+    """Buffered writer saving rows into HBase table in batches.
+
+    Rows are buffered and sent by `HBase.put_batch` when the buffer is full
+    or when the oldest buffered row waits longer than flush interval. The
+    number of saved and failed rows is counted per row.
+
+    Usage:
+        with HBaseBatchWriter(hb, table_name) as writer:
+            for key, data in rows:
+                writer.put(key, data)
+
+    """
+
+    def _init(
+          self,
+          hbase: HBase,
+          table_name: str,
+          batch_size: int = HBASE_BATCH_SIZE,
+          flush_interval: float = HBASE_FLUSH_INTERVAL,
+          **kwargs
+          ) -> None:
+        """Class constructor.
+
+        Args:
+            hbase: HBase object with open connection.
+            table_name: The name of the table.
+            batch_size: Maximum number of rows in one batch.
+            flush_interval: Maximum time (in seconds) a row waits in the
+                buffer before the batch is sent.
+            kwargs: Additional arguments for `HBase.put_batch`.
+
+        """
+        self.hbase = hbase
+        self.table_name = table_name
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.kwargs = kwargs
+        self.buffer = []
+        self.index_buffer = {}
+        self.t_first = None
+        self.n_saved = 0
+        self.n_failed = 0
+
+    def put(
+          self,
+          key: str,
+          data: Dict[str, Any],
+          index_rows: Optional[List[Tuple[str, str, Dict]]] = None
+          ) -> None:
+        """Add row into the buffer, send the batch if necessary.
+
+        Args:
+            key: The key of the row.
+            data: Dictionary with the row data.
+            index_rows: Rows of secondary index tables pointing to this row,
+                i.e. triples (index table name, index row key, data). They
+                are sent in the same batch right after the main rows.
+
+        """
+        index_rows = [
+            (table_name, (index_key, index_data))
+            for table_name, index_key, index_data in index_rows or []
+        ]
+        if not self.buffer:
+            self.t_first = time.monotonic()
+        self.buffer.append((key, data))
+        for table_name, index_row in index_rows:
+            self.index_buffer.setdefault(table_name, []).append(index_row)
+        if (
+            len(self.buffer) >= self.batch_size
+            or time.monotonic() - self.t_first >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Send all buffered rows."""
+        if not self.buffer:
+            return
+        rows, self.buffer = self.buffer, []
+        index, self.index_buffer = self.index_buffer, {}
+        if not self._put_batch(self.table_name, rows, **self.kwargs):
+            # the index must not point to missing rows
+            self.n_failed += len(rows)
+            return
+        self.n_saved += len(rows)
+        for table_name, index_rows in index.items():
+            if not self._put_batch(table_name, index_rows):
+                self.logger.error(
+                    f'Failed to save {len(index_rows)} rows of index table '
+                    f'{table_name}.'
+                )
+
+    def _put_batch(self, table_name: str, rows: List, **kwargs) -> bool:
+        """Send the batch, count unexpected errors as failed batch.
+
+        Args:
+            table_name: The name of the table.
+            rows: List of tuples (key, data).
+            kwargs: Additional arguments for `HBase.put_batch`.
+
+        Returns:
+            Whether the batch was saved.
+
+        """
+        try:
+            return self.hbase.put_batch(table_name, rows, **kwargs)
+        except Exception as e:
+            self.logger.error(
+                f'Failed to save {len(rows)} rows into HBase table '
+                f'{table_name} ({e}).'
+            )
+            return False
+
+    def __enter__(self) -> 'HBaseBatchWriter':
+        """Enter the context."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Send the rest of buffered rows when leaving the context."""
+        self.flush()
+
+
+class HBaseAsyncWriter(BaseAlgorithm):
+    """Writer saving rows into HBase table in background threads.
+
+    Rows are put into a bounded queue, which is drained by writer threads.
+    Each thread borrows a pooled connection and writes rows in batches (see
+    `HBaseBatchWriter`). If the queue is full, `put` blocks until there is a
+    free space, so the producer is slowed down to the speed of HBase. The
+    numbers of saved and failed rows are available after `close`.
+
+    Usage:
+        with HBaseAsyncWriter(host, port, table_name) as writer:
+            for key, data in rows:
+                writer.put(key, data)
+        print(writer.n_saved, writer.n_failed)
+
+    """
+
+    # marker telling the writer thread to finish
+    _STOP = object()
+    # period (in seconds) of checking whether writer threads are alive while
+    # waiting for free space in the queue
+    _PUT_TIMEOUT = 1.0
+
+    def _init(
+          self,
+          host: str,
+          port: int,
+          table_name: str,
+          n_threads: int = HBASE_WRITER_THREADS,
+          queue_size: int = HBASE_WRITE_QUEUE_SIZE,
+          batch_size: int = HBASE_BATCH_SIZE,
+          flush_interval: float = HBASE_FLUSH_INTERVAL,
+          codecs: Optional[Dict[str, str]] = None,
+          ) -> None:
+        """Class constructor, start writer threads.
+
+        Args:
+            host: Thrift server host.
+            port: Thrift server port.
+            table_name: The name of the table.
+            n_threads: Number of writer threads.
+            queue_size: Maximum number of rows waiting to be written.
+            batch_size: Maximum number of rows in one batch.
+            flush_interval: Maximum time (in seconds) a row waits in the
+                buffer of writer thread before the batch is sent.
+            codecs: Codecs of the columns, see `HBase.row_to_bytes`.
+
+        """
+        self.host = host
+        self.port = port
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.codecs = codecs
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.n_saved = 0
+        self.n_failed = 0
+        self._counts = []
+        self._error = None
+        self._lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, daemon=True)
+            for _ in range(max(1, n_threads))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def put(
+          self,
+          key: str,
+          data: Dict[str, Any],
+          index_rows: Optional[List[Tuple[str, str, Dict]]] = None
+          ) -> None:
+        """Put the row into the queue (block while the queue is full).
+
+        Args:
+            key: The key of the row.
+            data: Dictionary with the row data.
+            index_rows: Rows of secondary index tables pointing to this row,
+                see `HBaseBatchWriter.put`.
+
+        Raises:
+            RuntimeError if all writer threads died.
+
+        """
+        self._put((key, data, index_rows))
+
+    def close(self) -> None:
+        """Write all queued rows, stop writer threads and count results.
+
+        Raises:
+            RuntimeError if a writer thread died (the rows it did not save
+            are counted as failed).
+
+        """
+        try:
+            for _ in self.threads:
+                self._put(self._STOP)
+        except RuntimeError:
+            pass
+        for thread in self.threads:
+            thread.join()
+        # rows left in the queue by died threads were not saved
+        n_lost = 0
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                n_lost += 1
+        self.n_saved = sum(saved for saved, _ in self._counts)
+        self.n_failed = sum(failed for _, failed in self._counts) + n_lost
+        if self._error is not None:
+            raise RuntimeError(
+                f'HBase writer thread failed ({self._error}).'
+            ) from self._error
+
+    def _put(self, item: Any) -> None:
+        """Put the item into the queue, fail if no thread is draining it.
+
+        Args:
+            item: The item.
+
+        Raises:
+            RuntimeError if all writer threads died.
+
+        """
+        while True:
+            try:
+                self.queue.put(item, timeout=self._PUT_TIMEOUT)
+                return
+            except queue.Full:
+                if not any(thread.is_alive() for thread in self.threads):
+                    raise RuntimeError(
+                        f'All HBase writer threads died ({self._error}).'
+                    ) from self._error
+
+    def _run(self) -> None:
+        """Drain the queue into HBase (the body of writer thread)."""
+        n_failed = 0
+        hb = None
+        writer = None
+        try:
+            try:
+                hb = HBase(self.host, self.port, pooled=True)
+                writer = HBaseBatchWriter(
+                    hb,
+                    self.table_name,
+                    batch_size=self.batch_size,
+                    flush_interval=self.flush_interval,
+                    codecs=self.codecs
+                )
+            except Exception as e:
+                self.logger.error(
+                    f'HBase writer thread failed to connect ({e}). Rows will '
+                    f'not be saved!'
+                )
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    # send rows waiting in the buffer for too long
+                    if writer is not None:
+                        writer.flush()
+                    continue
+                if item is self._STOP:
+                    break
+                if writer is None:
+                    # keep draining the queue so that the producer is not
+                    # blocked
+                    n_failed += 1
+                    continue
+                try:
+                    writer.put(*item)
+                except Exception as e:
+                    self.logger.error(f'Failed to save row {item[0]} ({e}).')
+                    n_failed += 1
+            if writer is not None:
+                writer.flush()
+        except Exception as e:
+            self.logger.error(f'HBase writer thread failed ({e}).')
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+        finally:
+            if writer is not None:
+                # rows still in the buffer were not sent
+                n_failed += writer.n_failed + len(writer.buffer)
+            with self._lock:
+                self._counts.append(
+                    (0 if writer is None else writer.n_saved, n_failed)
+                )
+            if hb is not None:
+                hb.close()
+
+    def __enter__(self) -> 'HBaseAsyncWriter':
+        """Enter the context."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Write all queued rows when leaving the context."""
+        self.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""..module:: archiveprocessor.HostMemory.
+
+..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
+"""
+from typing import Any, Optional
+from collections import OrderedDict
+import threading
+import re
+
+from BaseAlgorithms import BaseAlgorithm
+from executor import get_or_create
+from config import HOST_MEMORY_SIZE
+
+
+def get_host_memory() -> 'HostMemory':
+    """Return the memory of host decisions shared by this process.
+
+    Returns:
+        The memory of host decisions.
+
+    """
+    return get_or_create(
+        ('HostMemory', HOST_MEMORY_SIZE),
+        lambda: HostMemory(HOST_MEMORY_SIZE)
+    )
+
+
+def get_host_key(urlkey: Optional[str]) -> Optional[str]:
+    """Get the host and SURT prefix of canonicalized (SURT) URL.
+
+    The prefix is the first directory of the path, so that sections of one
+    host (e.g. a forum or an old archive) are remembered separately.
+
+    Args:
+        urlkey: SURT form of URL, e.g. "cz,webarchiv)/forum/topic?id=1".
+
+    Returns:
+        The host and SURT prefix (e.g. "cz,webarchiv)/forum/") or None if
+        there is no host.
+
+    """
+    if not urlkey:
+        return None
+    host, _, path = urlkey.partition(')')
+    if not host:
+        return None
+    segments = re.split(r'[?#]', path, 1)[0].split('/')
+    # e.g. "/forum/topic" -> ['', 'forum', 'topic']
+    if len(segments) > 2 and segments[1]:
+        return f'{host})/{segments[1]}/'
+    return f'{host})/'
+
+
+class HostMemory(BaseAlgorithm):
+    """Bounded memory of decisions made for web hosts.
+
+    Pages from one host almost always share e.g. their charset and language,
+    so the decision made for the last page can be checked cheaply for the
+    next page instead of analysing it from scratch. The memory keeps the
+    decisions for at most `size` least recently used hosts (keys of host and
+    SURT prefix, see `get_host_key`).
+
+    """
+
+    def _init(self, size: int = HOST_MEMORY_SIZE) -> None:
+        """Class constructor.
+
+        Args:
+            size: Maximum number of remembered hosts.
+
+        """
+        self.size = size
+        self.hosts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, host: Optional[str], name: str) -> Any:
+        """Get the decision remembered for the host.
+
+        Args:
+            host: Host key (see `get_host_key`).
+            name: Name of the decision (e.g. "charset").
+
+        Returns:
+            The remembered value or None if there is no such decision.
+
+        """
+        if host is None:
+            return None
+        with self._lock:
+            decisions = self.hosts.get(host)
+            if decisions is None:
+                return None
+            self.hosts.move_to_end(host)
+            return decisions.get(name)
+
+    def set(self, host: Optional[str], name: str, value: Any) -> None:
+        """Remember the decision for the host.
+
+        Args:
+            host: Host key (see `get_host_key`).
+            name: Name of the decision (e.g. "charset").
+            value: The decision.
+
+        """
+        if host is None or self.size <= 0:
+            return
+        with self._lock:
+            decisions = self.hosts.get(host)
+            if decisions is None:
+                decisions = self.hosts[host] = {}
+                while len(self.hosts) > self.size:
+                    self.hosts.popitem(last=False)
+            else:
+                self.hosts.move_to_end(host)
+            decisions[name] = value
@@ -6,6 +6,7 @@
 ..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
 """
 from typing import List, Optional, Dict
+from collections import Counter
 import os
 
 from BaseAlgorithms import BaseAlgorithm
@@ -19,6 +20,16 @@ class LanguageIdentifier(BaseAlgorithm):
     def _init(self) -> None:
         """Class constructor."""
         self.stoplists = self._load_stoplists()
+        # stoplists as sets for fast checking of expected language
+        self.stopsets = dict(
+            (lang, set(stoplist)) for lang, stoplist in self.stoplists.items()
+        )
+        # languages of each stopword, so that all languages are scored by
+        # one lookup per word
+        self.stopword_langs = {}
+        for lang, stopset in self.stopsets.items():
+            for word in stopset:
+                self.stopword_langs.setdefault(word, []).append(lang)
 
     def guess_lang(
           self,
@@ -65,6 +76,53 @@ class LanguageIdentifier(BaseAlgorithm):
         )
         return maxlang
 
+    def check_lang(
+          self,
+          text: str,
+          lang: str,
+          min_sw_ratio: float = 0.05,
+          min_sw_count: int = 3,
+          min_margin: float = 1.0
+          ) -> bool:
+        """Check quickly whether the text is in given language.
+
+        Unlike `guess_lang`, the stoplists are not searched one by one. The
+        languages of each word are looked up once in the precomputed index
+        of all stopwords, so the cost does not grow with the number of
+        languages. It is meant to confirm a language expected from other
+        sources (e.g. the language of other pages from the same host).
+
+        Args:
+            text: Analyzed text.
+            lang: The 2-char ISO 639-1 code of expected language.
+            min_sw_ratio: Minimum ratio of stopwords in the text.
+            min_sw_count: Minimum number of stopwords in the text.
+            min_margin: The count of stopwords of given language must be
+                more than `min_margin` times the count of any other
+                language.
+
+        Returns:
+            Whether the text contains enough stopwords of given language and
+            given language scores highest.
+
+        """
+        if lang not in self.stopsets:
+            return False
+        words = text.split()
+        words = [strip_non_word_chars(w) for w in words]
+        words = [w.lower() for w in words if w]
+        if not words:
+            return False
+
+        # at least this many stopwords must be present in the text
+        min_count = max(min_sw_count, min_sw_ratio * len(words))
+        counts = Counter(
+            lg for w in words for lg in self.stopword_langs.get(w, ())
+        )
+        N = counts.pop(lang, 0)
+        runner_up = max(counts.values(), default=0)
+        return N >= min_count and N > min_margin * runner_up
+
     def _load_stoplists(self) -> Dict[str, List]:
         """Load all stoplists.
 
@@ -5,7 +5,8 @@
 
 ..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
 """
-from typing import Union, Dict, Any
+from typing import Union, Dict, Any, Optional, Set, Iterator
+from collections.abc import MutableMapping
 from cgi import parse_header
 import pprint
 import uuid
@@ -13,9 +14,10 @@ import re
 
 from surt import surt
 from warcio.recordloader import ArcWarcRecord
+from warcio.statusandheaders import StatusAndHeaders
 
 from BaseAlgorithms import BaseAlgorithm
-from utils import bytes_to_base64, base64_to_bytes, warc_name_to_harvest_info
+from utils import base64_to_bytes, warc_name_to_harvest_info
 from metadata import (
     ID,
     CONTENT,
@@ -31,9 +33,42 @@ from metadata import (
     HARVESTID,
     EXTRA,
     WRH_META_MAP,
-    INT_FIELDS
+    INT_FIELDS,
+    FIELDS
 )
 
+# position of each known field in the Record value array
+_FIELD_INDEX = dict((f, i) for i, f in enumerate(FIELDS))
+# marker of a field without value
+_MISSING = object()
+
+
+def get_header(
+      headers: Optional[StatusAndHeaders],
+      name: str,
+      default: Any = None
+      ) -> Any:
+    """Get the value of a header from warcio headers.
+
+    The lookup is consistent with converting headers into a dictionary, i.e.
+    header names are case-sensitive and the last occurrence wins.
+
+    Args:
+        headers: Headers parsed by warcio (or None).
+        name: The name of the header.
+        default: Value returned if the header is not present.
+
+    Returns:
+        The value of the header.
+
+    """
+    if headers is None:
+        return default
+    for key, value in reversed(headers.headers):
+        if key == name:
+            return value
+    return default
+
 
 class Record(BaseAlgorithm):
     """Representation of one WARC record.
@@ -41,11 +76,34 @@ class Record(BaseAlgorithm):
     This module deals with all necessary metadata extraction and content
     decoding.
 
-    Data and metadata are stored in dictionary `self.data`, but are also
-    accessible via `self[key]`.
+    Data and metadata are accessible via `self[key]`. To keep the memory
+    footprint low, the fields from `metadata.FIELDS` are stored in a
+    fixed-size array (other fields in an auxiliary dictionary) and WARC and
+    HTTP headers are kept in the form parsed by warcio until they are read.
+    `self.data` is a dictionary-like view of the stored data.
+
+    Changes made by one algorithm can be grouped into a transaction (see
+    `begin`, `commit` and `rollback`). During a transaction, the changes are
+    kept in a separate overlay and the stored data stay untouched until
+    commit, so the record can be rolled back without copying its data in
+    advance. The data should be accessed only via `self[key]` (or `update`,
+    `in`, `as_dict`) while a transaction is open. The fields changed by all
+    committed transactions are collected (see `modified_fields`), so only
+    these fields need to be saved when updating already stored records.
 
     """
 
+    __slots__ = (
+        'logger',
+        'is_revisit',
+        '_values',
+        '_other',
+        '_delta',
+        '_copies',
+        '_deleted',
+        '_modified',
+    )
+
     def _init(
           self,
           obj: Union[
@@ -65,7 +123,15 @@ class Record(BaseAlgorithm):
                 initializing from ArcWarcRecord).
 
         """
-        self.data = {}
+        self._values = [_MISSING] * len(FIELDS)
+        self._other = None
+        # transaction overlay: new values, shallow copies of mutable values
+        # read during transaction, and deleted keys (None = no transaction)
+        self._delta = None
+        self._copies = None
+        self._deleted = None
+        # fields changed by committed transactions (None = no change yet)
+        self._modified = None
         if isinstance(obj, dict):
             self.init_from_dict(obj)
         # TODO: init from HBase main table row (is it type dict too?)
@@ -74,8 +140,8 @@ class Record(BaseAlgorithm):
         else:
             self.logger.error(f'Unsupported data type: {type(obj)}')
         self.is_revisit = self[REFERSTO] not in ["", None]
-        if EXTRA not in self.data:
-            self.data[EXTRA] = []
+        if EXTRA not in self:
+            self[EXTRA] = []
 
     def init_from_dict(self, data: Dict[str, Any]) -> None:
         """Initialize record from a dictionary.
@@ -84,7 +150,34 @@ class Record(BaseAlgorithm):
             data: Key-value pairs with data.
 
         """
-        self.data = data
+        for key, value in data.items():
+            self._set(key, value)
+
+    @staticmethod
+    def get_header_fields(AWRec: ArcWarcRecord) -> Dict[str, Any]:
+        """Get metadata available in the headers of an ArcWarcRecord.
+
+        The payload is not read, so this can be used to decide whether the
+        record should be loaded at all. Values are refined in the same way as
+        when initializing the record.
+
+        Args:
+            AWRec: ArcWarcRecord object.
+
+        Returns:
+            Dictionary with record ID, URL, MIME type and response code.
+
+        """
+        rh = AWRec.rec_headers
+        hh = AWRec.http_headers
+        rid = get_header(rh, 'WARC-Record-ID')
+        mime, _ = parse_header(get_header(hh, 'Content-Type', ''))
+        return {
+            ID: rid.strip('<>') if rid else None,
+            URL: get_header(rh, 'WARC-Target-URI'),
+            MIMETYPE: mime,
+            RESPONSECODE: "" if hh is None else hh.get_statuscode(),
+        }
 
     def init_from_ArcWarcRecord(
           self,
@@ -98,20 +191,21 @@ class Record(BaseAlgorithm):
             warc_file_name: The name of the source WARC file.
 
         """
+        # headers are converted into dictionaries only when read
         if AWRec.http_headers is None:
             self[HTTPHEADERS] = {}
             self[RESPONSECODE] = ""
         else:
-            self[HTTPHEADERS] = dict(AWRec.http_headers.headers)
+            self[HTTPHEADERS] = AWRec.http_headers
             self[RESPONSECODE] = AWRec.http_headers.get_statuscode()
         if AWRec.rec_headers is None:
             self[RECHEADERS] = {}
         else:
-            self[RECHEADERS] = dict(AWRec.rec_headers.headers)
+            self[RECHEADERS] = AWRec.rec_headers
 
-        ctype = self[HTTPHEADERS].get("Content-Type", "")
+        ctype = self.get_header(HTTPHEADERS, "Content-Type", "")
         self[MIMETYPE], params = parse_header(ctype)
-        self[CONTENT] = bytes_to_base64(AWRec.content_stream().read())
+        self[CONTENT] = AWRec.content_stream().read()
         self[WARCFILENAME] = warc_file_name
         self.map_rec_headers()
         self.refine_id()
@@ -124,9 +218,8 @@ class Record(BaseAlgorithm):
 
     def map_rec_headers(self) -> None:
         """Map metadata from WARC record headers."""
-        rh = self[RECHEADERS] or {}
         for wrhkey, field in WRH_META_MAP.items():
-            val = rh.get(wrhkey, None)
+            val = self.get_header(RECHEADERS, wrhkey)
             if val is not None:
                 self[field] = val
 
@@ -167,7 +260,7 @@ class Record(BaseAlgorithm):
 
     def find_redirect(self) -> None:
         """Find target URI of redirection and check correct status code."""
-        redirect = (self[HTTPHEADERS] or {}).get('Location')
+        redirect = self.get_header(HTTPHEADERS, 'Location')
         if redirect:
             status = self[RESPONSECODE] or ''
             if re.match(r'^(3\d\d|201|202)$', status):
@@ -202,15 +295,21 @@ class Record(BaseAlgorithm):
     def get_content_bytes(self) -> bytes:
         """Return record content as a sequence of bytes.
 
-        The content is stored as base64 unicode string.
+        The content is kept as raw bytes during processing. It is converted
+        into base64 unicode string only when the record is serialized, so
+        records initialized from serialized data are decoded here.
 
         Returns:
             content: The byte content (payload) of the record.
 
         """
-        content_base64 = self[CONTENT] or ''
+        content = self[CONTENT] or b''
+        if isinstance(content, bytes):
+            return content
+        if isinstance(content, (bytearray, memoryview)):
+            return bytes(content)
         try:
-            content = base64_to_bytes(content_base64)
+            content = base64_to_bytes(content)
         except Exception as e:
             self.logger.error(
                 f'Error while decoding content: ({e}) (record with URL '
@@ -219,20 +318,260 @@ class Record(BaseAlgorithm):
             return b''
         return content
 
+    def begin(self) -> None:
+        """Start a transaction.
+
+        All subsequent changes are kept in an overlay until `commit` or
+        `rollback` is called.
+
+        """
+        self._delta = {}
+        self._copies = {}
+        self._deleted = set()
+
+    def in_transaction(self) -> bool:
+        """Return True if a transaction is open."""
+        return self._delta is not None
+
+    def changed_fields(self) -> Set[str]:
+        """Return keys changed (set, modified or deleted) in the transaction.
+
+        Mutable values (lists, dicts) read during the transaction are
+        shallow-copied, so also their in-place modifications (e.g. `+=`) are
+        detected here. Keys set to the value equal to the stored one are not
+        considered changed.
+
+        """
+        if self._delta is None:
+            return set()
+        changed = set(k for k in self._deleted if self._has(k))
+        changed.update(
+            k for k, v in self._delta.items()
+            if not self._has(k) or v != self._get(k)
+        )
+        changed.update(
+            k for k, v in self._copies.items() if v != self._get(k)
+        )
+        return changed
+
+    def modified_fields(self) -> Set[str]:
+        """Return keys changed by all transactions committed so far."""
+        return set(self._modified or ())
+
+    def commit(self) -> None:
+        """Apply changes from the open transaction and close it."""
+        if self._delta is None:
+            return
+        changed = self.changed_fields()
+        if changed:
+            if self._modified is None:
+                self._modified = set()
+            self._modified.update(changed)
+        for key in changed:
+            if key in self._deleted:
+                if self._has(key):
+                    self._del(key)
+            elif key in self._delta:
+                self._set(key, self._delta[key])
+            else:
+                self._set(key, self._copies[key])
+        self.rollback()
+
+    def rollback(self) -> None:
+        """Discard changes from the open transaction and close it."""
+        self._delta = None
+        self._copies = None
+        self._deleted = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return record data including changes from the open transaction.
+
+        Returns:
+            Dictionary with (a shallow copy of) record data.
+
+        """
+        data = dict((k, self._get(k)) for k in self._keys())
+        if self._delta is not None:
+            for key in self._deleted:
+                data.pop(key, None)
+            data.update(self._copies)
+            data.update(self._delta)
+        return data
+
+    def update(self, other: Dict[str, Any]) -> None:
+        """Set values for all keys from given dictionary."""
+        for key, value in other.items():
+            self[key] = value
+
+    def get_header(self, field: str, name: str, default: Any = None) -> Any:
+        """Get the value of a WARC or HTTP header.
+
+        Unlike `self[field].get(name)`, this does not convert headers kept in
+        the warcio form into a dictionary.
+
+        Args:
+            field: The field with headers (RECHEADERS or HTTPHEADERS).
+            name: The name of the header.
+            default: Value returned if the header is not present.
+
+        Returns:
+            The value of the header.
+
+        """
+        if self._delta is None or field not in self._delta:
+            i = _FIELD_INDEX.get(field)
+            headers = None if i is None else self._values[i]
+            if isinstance(headers, StatusAndHeaders):
+                return get_header(headers, name, default)
+        return (self[field] or {}).get(name, default)
+
+    @property
+    def data(self) -> 'RecordData':
+        """Dictionary-like view of the stored record data."""
+        return RecordData(self)
+
+    def _get(self, key: str, default: Any = None) -> Any:
+        """Get stored value for given key (ignoring the transaction)."""
+        i = _FIELD_INDEX.get(key)
+        if i is None:
+            if self._other is None:
+                return default
+            return self._other.get(key, default)
+        value = self._values[i]
+        if value is _MISSING:
+            return default
+        if isinstance(value, StatusAndHeaders):
+            value = self._values[i] = dict(value.headers)
+        return value
+
+    def _set(self, key: str, value: Any) -> None:
+        """Store value for given key (ignoring the transaction)."""
+        i = _FIELD_INDEX.get(key)
+        if i is not None:
+            self._values[i] = value
+        elif self._other is None:
+            self._other = {key: value}
+        else:
+            self._other[key] = value
+
+    def _del(self, key: str) -> None:
+        """Delete stored value for given key (ignoring the transaction)."""
+        i = _FIELD_INDEX.get(key)
+        if i is None:
+            if self._other is None:
+                raise KeyError(key)
+            del self._other[key]
+        elif self._values[i] is _MISSING:
+            raise KeyError(key)
+        else:
+            self._values[i] = _MISSING
+
+    def _has(self, key: str) -> bool:
+        """Check whether a value is stored for given key."""
+        i = _FIELD_INDEX.get(key)
+        if i is None:
+            return self._other is not None and key in self._other
+        return self._values[i] is not _MISSING
+
+    def _keys(self) -> Iterator[str]:
+        """Iterate over keys with stored values."""
+        for key, value in zip(FIELDS, self._values):
+            if value is not _MISSING:
+                yield key
+        if self._other is not None:
+            yield from self._other
+
     def __getitem__(self, key: str) -> Any:
         """Get value for given key."""
-        return self.data.get(key, None)
+        if self._delta is None:
+            return self._get(key)
+        if key in self._delta:
+            return self._delta[key]
+        if key in self._copies:
+            return self._copies[key]
+        if key in self._deleted:
+            return None
+        value = self._get(key)
+        if isinstance(value, (list, dict)):
+            # keep the stored value intact even if modified in place
+            value = self._copies[key] = value.copy()
+        return value
 
     def __setitem__(self, key: str, value: Any) -> None:
         """Set value for given key."""
-        self.data[key] = value
+        if self._delta is None:
+            self._set(key, value)
+            return
+        self._delta[key] = value
+        self._copies.pop(key, None)
+        self._deleted.discard(key)
 
     def __delitem__(self, key: str) -> None:
         """Delete key-value pair."""
-        del self.data[key]
+        if self._delta is None:
+            self._del(key)
+            return
+        if key not in self:
+            raise KeyError(key)
+        self._delta.pop(key, None)
+        self._copies.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        """Check whether the record contains given key."""
+        if self._delta is None:
+            return self._has(key)
+        if key in self._delta or key in self._copies:
+            return True
+        return key not in self._deleted and self._has(key)
 
     def __str__(self) -> str:
         """Pretty-print of record data except for base64-encoded content."""
         return pprint.pformat(
-            dict((k, v) for k, v in self.data.items() if k != CONTENT),
+            dict((k, v) for k, v in self.as_dict().items() if k != CONTENT),
         )
+
+
+class RecordData(MutableMapping):
+    """Dictionary-like view of the data stored in `Record`.
+
+    The view ignores changes from an open transaction of the record.
+
+    """
+
+    __slots__ = ('record',)
+
+    def __init__(self, record: Record) -> None:
+        """Class constructor.
+
+        Args:
+            record: The viewed record.
+
+        """
+        self.record = record
+
+    def __getitem__(self, key: str) -> Any:
+        """Get value for given key."""
+        if not self.record._has(key):
+            raise KeyError(key)
+        return self.record._get(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        """Set value for given key."""
+        self.record._set(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        """Delete key-value pair."""
+        self.record._del(key)
+
+    def __contains__(self, key: object) -> bool:
+        """Check whether the record contains given key."""
+        return self.record._has(key)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over keys."""
+        return self.record._keys()
+
+    def __len__(self) -> int:
+        """Return number of stored fields."""
+        return sum(1 for _ in self.record._keys())
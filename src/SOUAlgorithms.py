@@ -28,6 +28,9 @@ class FleschReadingEase(BaseProcessAlgorithm):
 
     """
 
+    REQUIRED_FIELDS = (PLAINTEXT, LANGUAGE, TOKENS, SENTENCES)
+    PROVIDED_FIELDS = (EXTRA,)
+
     def _init(self) -> None:
         """Class constructor."""
         self.hyphenators = {
@@ -130,9 +133,9 @@ class FleschReadingEase(BaseProcessAlgorithm):
 
         lang = self.check_lang_dict(record)
 
-        if TOKENS not in record.data:
+        if TOKENS not in record:
             record = self.word_tokenizer.process(record)
-        if SENTENCES not in record.data:
+        if SENTENCES not in record:
             record = self.sentence_tokenizer.process(record)
 
         # count only valid word tokens
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""..module:: archiveprocessor.SchemaValidation.
+
+..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
+"""
+from typing import Dict, Any, Iterable, Mapping
+import json
+
+from jsonschema.exceptions import ValidationError
+from jsonschema.validators import validator_for
+
+from BaseAlgorithms import BaseAlgorithm
+from executor import get_or_create
+
+# schema keywords which constrain the record as a whole (i.e. relations
+# between fields), so they cannot be validated field by field
+_OBJECT_LEVEL_KEYWORDS = [
+    'patternProperties',
+    'dependencies',
+    'dependentRequired',
+    'dependentSchemas',
+    'propertyNames',
+    'minProperties',
+    'maxProperties',
+    'if',
+    'allOf',
+    'anyOf',
+    'oneOf',
+    'not',
+]
+
+
+def get_schema_validator(schema: Dict[str, Any]) -> 'SchemaValidator':
+    """Return a validator for given schema, built once per process.
+
+    Args:
+        schema: JSON schema of intermediary format.
+
+    Returns:
+        Precompiled validator of the schema.
+
+    """
+    key = ('SchemaValidator', json.dumps(schema, sort_keys=True))
+    return get_or_create(key, lambda: SchemaValidator(schema))
+
+
+class SchemaValidator(BaseAlgorithm):
+    """Precompiled validator of intermediary format.
+
+    The validator class matching the `$schema` draft is created only once
+    together with a sub-validator for each property, so a record can be
+    validated either as a whole or only in the fields which were changed.
+
+    """
+
+    def _init(self, schema: Dict[str, Any]) -> None:
+        """Class constructor.
+
+        Args:
+            schema: JSON schema of intermediary format.
+
+        """
+        cls = validator_for(schema)
+        self.validator = cls(schema)
+        resolver = self.validator.resolver
+        self.required = set(schema.get('required', []))
+        self.field_validators = dict(
+            (k, cls(s, resolver=resolver))
+            for k, s in schema.get('properties', {}).items()
+        )
+        additional = schema.get('additionalProperties', True)
+        self.additional_validator = (
+            cls(additional, resolver=resolver)
+            if isinstance(additional, dict) else None
+        )
+        self.allow_additional = additional is not False
+        self.field_level = not any(
+            k in schema for k in _OBJECT_LEVEL_KEYWORDS
+        )
+
+    def validate(self, data: Mapping[str, Any]) -> None:
+        """Validate the whole record data.
+
+        Args:
+            data: Record data.
+
+        Raises:
+            ValidationError if the data are not valid.
+
+        """
+        self.validator.validate(data)
+
+    def validate_fields(
+          self,
+          data: Mapping[str, Any],
+          fields: Iterable[str]
+          ) -> None:
+        """Validate only given fields of the record data.
+
+        Fields missing in `data` are checked against the list of required
+        fields (i.e. a required field must not be deleted). This is
+        equivalent to validating the whole data only if `self.field_level`
+        is True, i.e. the schema contains no keywords relating several fields
+        to each other.
+
+        Args:
+            data: Record data (dictionary or `Record`).
+            fields: Names of the fields to be validated.
+
+        Raises:
+            ValidationError if the data are not valid.
+
+        """
+        for field in fields:
+            if field not in data:
+                if field in self.required:
+                    raise ValidationError(
+                        f'{field!r} is a required property'
+                    )
+                continue
+            validator = self.field_validators.get(field)
+            if validator is None:
+                if not self.allow_additional:
+                    raise ValidationError(
+                        f'Additional properties are not allowed ({field!r} '
+                        f'was unexpected)'
+                    )
+                validator = self.additional_validator
+            if validator is not None:
+                validator.validate(data[field])
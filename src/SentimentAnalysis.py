@@ -19,6 +19,9 @@ class SentimentAnalyzer(BaseProcessAlgorithm):
     1 the most positive and 0 is neutral).
     
     """
+
+    REQUIRED_FIELDS = (LANGUAGE, PLAINTEXT, TOKENS)
+    PROVIDED_FIELDS = (SENTIMENT,)
     
     def _init(self):
         self.tokenizer = None
@@ -34,7 +37,7 @@ class SentimentAnalyzer(BaseProcessAlgorithm):
         if record[LANGUAGE] != 'cs':
             return record
         
-        if not record[TOKENS] and record[PLAINTEXT]:
+        if TOKENS not in record and record[PLAINTEXT]:
             if self.tokenizer is None:
                 self.tokenizer = WordTokenizer()
             record = self.tokenizer.process(record)
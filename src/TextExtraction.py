@@ -1,20 +1,32 @@
 # coding: utf-8
 from html.parser import HTMLParser
-from lxml.html.clean import Cleaner
 from cgi import parse_header
 import urllib.parse
+import codecs
 import lxml.etree
 import lxml.html
 import justext
+import justext.core
+import inspect
 import sys
 import re
 
 from utils import guess_charset, get_charset_from_BOM, known_encoding
 from LanguageIdentification import LanguageIdentifier
+from HostMemory import get_host_memory, get_host_key
 from BaseAlgorithms import BaseProcessAlgorithm
 from metadata import *
 from config import *
 
+HEADLINE_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# elements whose text is not visible on the web page (the same elements are
+# killed by lxml Cleaner with scripts, styles, frames and forms removal)
+INVISIBLE_TAGS = (
+    'script', 'style', 'applet', 'frameset', 'frame', 'noframes', 'button',
+    'input', 'select', 'textarea'
+)
+
 class HTMLTextExtractor(BaseProcessAlgorithm):
     """ Get plain text from the HTML.
     
@@ -24,9 +36,16 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
     title, headlines, language). 
     
     """
+
+    REQUIRED_FIELDS = (CONTENT, HTTPHEADERS, URL, URLKEY, LANGUAGE)
+    PROVIDED_FIELDS = (PLAINTEXT, LANGUAGE, TITLE, HEADLINES, LINKS)
     
     def _init(self):
-        self.guess_lang = LanguageIdentifier().guess_lang
+        lang_identifier = LanguageIdentifier()
+        self.guess_lang = lang_identifier.guess_lang
+        self.check_lang = lang_identifier.check_lang
+        # charsets and languages of last pages from web hosts
+        self.host_memory = get_host_memory()
         self.unescape = HTMLParser().unescape
 
         jv = justext.__version__
@@ -42,13 +61,13 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
             'ru': justext.get_stoplist('Russian'),
             'fr': justext.get_stoplist('French'),
             }
-
-        # base HTML cleaner to get all text from the web page
-        self.cleaner = Cleaner()
-        # activate tag filters (True means elements will be removed)
-        self.cleaner.javascript = True
-        self.cleaner.scripts = True
-        self.cleaner.style = True
+        # jusText settings are split between the context-free classification
+        # and the context-sensitive revision of paragraphs
+        params = inspect.signature(justext.core.classify_paragraphs).parameters
+        self.jclassify_defaults = dict(
+            (k, p.default) for k, p in params.items()
+            if k not in ('paragraphs', 'stoplist')
+        )
 
     def _process(self, data):
         
@@ -64,7 +83,8 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
             return data
 
         # decode HTML
-        charset, chtype = self._get_charset(data, html)
+        host = get_host_key(data[URLKEY])
+        charset, chtype = self._get_charset(data, html, host)
         uhtml = html.decode(charset, errors='replace')
         n_errors = uhtml.count(u"\uFFFD") # count replacement characters
         if n_errors > 0:
@@ -86,18 +106,21 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
             else:
                 raise e
 
+        # collect texts and links from HTML
+        page = self._walk_tree(tree)
+
         # extract metadata from HTML
         try:
-            metadata = self._get_metadata(tree)
+            metadata = self._get_metadata(page, host)
         except Exception as e:
             self.logger.warning(f'Error while getting metadata: {e} (URL '
                 f'{data[URL]} and ID="{data[ID]}").')
         else:
-            data.data.update(metadata)
+            data.update(metadata)
 
         # extract links from HTML
         try:
-            data[LINKS] = self._get_abs_links(tree, data[URL])
+            data[LINKS] = self._get_abs_links(page['links'], data[URL])
         except Exception as e:
             self.logger.warning(f'Error while getting links: {e} (URL '
                 f'{data[URL]} and ID="{data[ID]}").')
@@ -110,15 +133,19 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
             return data
         stoplist = self.jstoplists[lang]
 
-        # extract plain text
-        paragraphs = self._justext(html, stoplist, charset, JUSTEXT_BASE_SETTING)
+        # extract plain text (the parsed tree is modified by jusText
+        # preprocessing, so it must not be used after this point)
+        all_paragraphs = self._get_paragraphs(tree)
+        paragraphs = self._justext(
+            all_paragraphs, stoplist, JUSTEXT_BASE_SETTING
+        )
         if not paragraphs:
             for upd in JUSTEXT_FALLBACK_SETTING:
                 self.logger.debug(f'JusText did not find any text, trying '
                     f'again with {upd} (URL {data[URL]} and ID="{data[ID]}")')
                 setting = JUSTEXT_BASE_SETTING.copy()
                 setting.update(upd)
-                paragraphs = self._justext(html, stoplist, charset, setting)
+                paragraphs = self._justext(all_paragraphs, stoplist, setting)
                 if paragraphs:
                     break
         text = '\n'.join(p['text'] for p in paragraphs)
@@ -133,20 +160,139 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
         data[PLAINTEXT] = text
         return data
 
-    def _justext(self, html, stoplist, charset, jsetting):
-        """ Get list of paragraphs with positive classification. """
-        paragraphs = justext.justext(
-            html,
-            stoplist = stoplist,
-            encoding = charset,
-            **jsetting
+    def _get_paragraphs(self, tree):
+        """ Split parsed HTML into jusText paragraphs.
+
+        This is the preprocessing of `justext.justext` applied in place to the
+        tree which was already parsed (so the HTML is not decoded and parsed
+        again by jusText).
+        """
+        # add <kw> tags (protect text nodes) and remove comments
+        justext.core.add_kw_tags(tree)
+        justext.core.remove_comments(tree)
+        # remove head, script and style
+        to_be_removed = [
+            node for node in tree.iter()
+            if node.tag in ('head', 'script', 'style')
+        ]
+        for node in to_be_removed:
+            parent = node.getparent()
+            if parent is not None:
+                parent.remove(node)
+        return justext.core.make_paragraphs(tree)
+
+    def _justext(self, paragraphs, stoplist, jsetting):
+        """ Get list of paragraphs with positive classification.
+
+        Stopword counts and link densities are computed only by the first
+        call, next calls (fall-back settings) reuse them and repeat only the
+        classification.
+        """
+        csetting = dict(self.jclassify_defaults)
+        csetting.update(
+            (k, v) for k, v in jsetting.items()
+            if k in self.jclassify_defaults
         )
+        rsetting = {
+            k: v for k, v in jsetting.items()
+            if k not in self.jclassify_defaults
+        }
+        if paragraphs and 'stopword_density' in paragraphs[0]:
+            self._reclassify(paragraphs, **csetting)
+        else:
+            justext.core.classify_paragraphs(paragraphs, stoplist, **csetting)
+        justext.core.revise_paragraph_classification(paragraphs, **rsetting)
         # select only paragraphs classified as "good"
         paragraphs = [p for p in paragraphs if p['class'] == 'good']
         return paragraphs
 
-    def _get_metadata(self, tree):
-        """ Extract metadata (title, headlines etc.) from parsed HTML. """
+    def _reclassify(
+            self, paragraphs, length_low, length_high, stopwords_low,
+            stopwords_high, max_link_density, no_headings):
+        """ Context-free classification of already classified paragraphs.
+
+        The rules are the same as in `justext.core.classify_paragraphs`, but
+        the statistics of paragraphs are not computed again.
+        """
+        for paragraph in paragraphs:
+            text = paragraph['text']
+            length = len(text)
+            paragraph['heading'] = bool(
+                not no_headings
+                and re.search(r'(^h\d|\.h\d)', paragraph['dom_path'])
+            )
+            if paragraph['link_density'] > max_link_density:
+                cfclass = 'bad'
+            elif u'\xa9' in text or '&copy' in text:
+                cfclass = 'bad'
+            elif re.search(r'(^select|\.select)', paragraph['dom_path']):
+                cfclass = 'bad'
+            elif length < length_low:
+                if paragraph['linked_char_count'] > 0:
+                    cfclass = 'bad'
+                else:
+                    cfclass = 'short'
+            elif paragraph['stopword_density'] >= stopwords_high:
+                if length > length_high:
+                    cfclass = 'good'
+                else:
+                    cfclass = 'neargood'
+            elif paragraph['stopword_density'] >= stopwords_low:
+                cfclass = 'neargood'
+            else:
+                cfclass = 'bad'
+            paragraph['cfclass'] = cfclass
+
+    def _walk_tree(self, tree):
+        """ Collect texts and links from parsed HTML in one pass.
+
+        Returns a dictionary with text nodes of title and headline (h1-h6)
+        elements, href attributes of links (all in document order) and the
+        text visible on the web page (the text of the tree without
+        INVISIBLE_TAGS). The tree is not modified.
+        """
+        titles, headlines, links, texts = [], [], [], []
+        owners = []  # tags of elements on the path to the current node
+        invisible = 0  # number of invisible elements on the path
+
+        def add_text(text, owner):
+            if owner == 'title':
+                titles.append(text)
+            elif owner in HEADLINE_TAGS:
+                headlines.append(text)
+            if not invisible:
+                texts.append(text)
+
+        events = ('start', 'end', 'comment', 'pi')
+        for event, node in lxml.etree.iterwalk(tree, events=events):
+            if event == 'start':
+                tag = node.tag
+                owners.append(tag)
+                if tag in INVISIBLE_TAGS:
+                    invisible += 1
+                if tag == 'a':
+                    href = node.get('href')
+                    if href is not None:
+                        links.append(href)
+                if node.text:
+                    add_text(node.text, tag)
+                continue
+            if event == 'end':
+                if owners.pop() in INVISIBLE_TAGS:
+                    invisible -= 1
+            # tail of an element or comment belongs to its parent
+            if node.tail and owners:
+                add_text(node.tail, owners[-1])
+
+        return {
+            'titles': titles,
+            'headlines': headlines,
+            'links': links,
+            'text': ''.join(texts),
+            }
+
+    def _get_metadata(self, page, host=None):
+        """ Extract metadata (title, headlines etc.) from walked HTML. """
         metadata = {}
 
         def norm_text(text):
@@ -155,25 +301,20 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
             text = re.sub('\s+', ' ', text).strip()
             return text
 
-        lang = self._guess_lang_html(tree)
+        lang = self._guess_lang_host(page['text'], host)
         if lang:
             metadata[LANGUAGE] = lang
 
-        title = tree.xpath('//title/text()')
-        if title:
-            metadata[TITLE] = norm_text(title[0])
+        if page['titles']:
+            metadata[TITLE] = norm_text(page['titles'][0])
 
-        headlines = []
-        for level in range(1,7):
-            headlines += tree.xpath('//h%d/text()' % level)
-        headlines = list(map(norm_text, headlines))
+        headlines = list(map(norm_text, page['headlines']))
         metadata[HEADLINES] = [h for h in headlines if h]
 
         return metadata
 
-    def _get_abs_links(self, tree, base_url=''):
-        """ Get all links (as absolute URLs) from parsed HTML. """
-        links = tree.xpath('//a/@href')
+    def _get_abs_links(self, links, base_url=''):
+        """ Get all links as absolute URLs. """
         links = [l for l in links if l]
         if base_url:
             links = [urllib.parse.urljoin(base_url, l) for l in links]
@@ -189,14 +330,16 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
         except ValueError:
             return False
 
-    def _guess_lang_html(self, tree):
-        """ Guess the language of parsed web page based on stopword counts. """
-        # get all words visible on the web page
-        ctree = self.cleaner.clean_html(tree)
-        text = ctree.text_content()
-        return self.guess_lang(text)
+    def _guess_lang_host(self, text, host=None):
+        """ Guess the language of the text, try the host's language first. """
+        lang = self.host_memory.get(host, 'lang')
+        if lang is None or not self.check_lang(text, lang):
+            lang = self.guess_lang(text)
+        if lang:
+            self.host_memory.set(host, 'lang', lang)
+        return lang
 
-    def _get_charset(self, data, html):
+    def _get_charset(self, data, html, host=None):
         """ Decide about character set used in the HTML. """ 
         charsets = set()
 
@@ -206,7 +349,7 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
             return charset, 'BOM-based'
 
         # look into the header
-        ct = (data[HTTPHEADERS] or {}).get('Content-Type', '')
+        ct = data.get_header(HTTPHEADERS, 'Content-Type', '')
         mimetype, params = parse_header(ct)
         charset = params.get('charset', None)
         if charset is not None and known_encoding(charset):
@@ -217,24 +360,59 @@ class HTMLTextExtractor(BaseProcessAlgorithm):
             """<meta\s+[^>]*?charset\s*=[\s"']*([^\s"'/>]+)""", # HTML
             """^\s*<\?xml\s+[^>]*?encoding\s*=[\s"']*([^\s"'/>]+)""", # XHTML
             ]
+        head = html[:CHARSET_DECLARATION_SIZE]
         for pattern in patterns:
-            if sys.version_info > (3,) and type(html) == bytes:
+            if sys.version_info > (3,) and type(head) == bytes:
                 pattern = bytes(pattern, 'utf-8')
-            m = re.search(pattern, html, flags=re.I)
+            m = re.search(pattern, head, flags=re.I)
             charset = None if not m else m.group(1).decode("utf-8")
             if charset is not None and known_encoding(charset):
                 charsets.add(charset.lower())
 
-        if len(charsets) == 0:
-            # no charset declared
-            return guess_charset(html), 'guessed'
         if len(charsets) == 1:
-            return charsets.pop(), 'declared'
-        if len(charsets) > 1:
-            # resolve conflict in charset declaration
-            return guess_charset(html, charsets), 'resolved'
+            charset, chtype = charsets.pop(), 'declared'
+        else:
+            # no charset declared or conflict in charset declaration, try
+            # the charset of the last page from the same host first
+            charset = self.host_memory.get(host, 'charset')
+            if charset is not None and (not charsets or charset in charsets) \
+                    and self._check_charset(html, charset):
+                return charset, 'remembered'
+            if len(charsets) == 0:
+                # no charset declared
+                charset, chtype = guess_charset(html), 'guessed'
+            else:
+                # resolve conflict in charset declaration
+                charset, chtype = guess_charset(html, charsets), 'resolved'
+        self.host_memory.set(host, 'charset', charset)
+        return charset, chtype
+
+    def _check_charset(self, html, charset):
+        """ Check whether the whole HTML is encoded in the charset.
+
+        The HTML must be decoded without errors and (unless the charset is
+        UTF-8) must not be valid UTF-8, as single byte charsets decode almost
+        anything. Pure ASCII HTML is inconclusive (it is decoded by almost
+        any charset), so the check fails.
+        """
+        if html.isascii():
+            return False
+        try:
+            html.decode(charset)
+        except (UnicodeDecodeError, LookupError):
+            return False
+        if codecs.lookup(charset).name == 'utf-8':
+            return True
+        try:
+            html.decode('utf-8')
+        except UnicodeDecodeError:
+            return True
+        return False
 
 class PDFTextExtractor(BaseProcessAlgorithm):
     """ Get plain text from the PDF. """
+
+    REQUIRED_FIELDS = (CONTENT,)
+
     def _process(self, data):
         return data
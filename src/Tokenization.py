@@ -28,6 +28,9 @@ class WordTokenizer(BaseProcessAlgorithm):
 
     """
 
+    REQUIRED_FIELDS = (PLAINTEXT, LANGUAGE)
+    PROVIDED_FIELDS = (TOKENS,)
+
     def _init(self) -> None:
         """Class constructor."""
         self.lang_iso2punkt = {
@@ -96,6 +99,8 @@ class SentenceTokenizer(WordTokenizer):
 
     """
 
+    PROVIDED_FIELDS = (SENTENCES,)
+
     def _process(self, record: Record) -> Record:
         """Process the record.
 
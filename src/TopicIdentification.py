@@ -16,6 +16,9 @@ class TopicIdentifier(BaseProcessAlgorithm):
     A trained model must be present in path defined by TOPICS_CLF_MODEL.
     
     """
+
+    REQUIRED_FIELDS = (LANGUAGE, PLAINTEXT, TOKENS)
+    PROVIDED_FIELDS = (TOPICS,)
     
     def _init(self):
         self.tokenizer = None
@@ -33,7 +36,7 @@ class TopicIdentifier(BaseProcessAlgorithm):
         if record[LANGUAGE] != 'cs':
             return record
         
-        if not record[TOKENS] and record[PLAINTEXT]:
+        if TOKENS not in record and record[PLAINTEXT]:
             if self.tokenizer is None:
                 self.tokenizer = WordTokenizer()
             record = self.tokenizer.process(record)
@@ -5,6 +5,7 @@
 
 ..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
 """
+from typing import Any, Dict
 import json
 
 from BaseAlgorithms import BaseProcessAlgorithm
@@ -15,9 +16,17 @@ from Record import Record
 class WebPageTypeIdentifier(BaseProcessAlgorithm):
     """Predict the type of the web page."""
 
+    REQUIRED_FIELDS = (URL,)
+    PROVIDED_FIELDS = (WEBPAGETYPE,)
+    CONFIG_KEYS = ("webtypes",)
+    # default web page types and their IDs, overridden by "webtypes" row in
+    # HBase config table
+    WEBTYPES = {"eshop": 0, "news": 1, "forum": 2, "others": 3}
+
     # TODO: replace this dummy method by more sophisticated classifier
     def _init(self) -> None:
         """Class constructor."""
+        self.webtypes = self.WEBTYPES
         self.NEWS_STRINGS = [
             "www.novinky.cz",
             "www.seznamzpravy.cz",
@@ -49,6 +58,15 @@ class WebPageTypeIdentifier(BaseProcessAlgorithm):
             "diskuze",
         ]
 
+    def configure(self, config: Dict[str, Any]) -> None:
+        """Apply runtime settings from HBase config table.
+
+        Args:
+            config: Dictionary {row key: setting}, see `CONFIG_KEYS`.
+
+        """
+        self.webtypes = config.get("webtypes") or self.WEBTYPES
+
     def _process(self, record: Record) -> Record:
         """Process the record.
 
@@ -72,7 +90,8 @@ class WebPageTypeIdentifier(BaseProcessAlgorithm):
             for string in self.FORUM_STRINGS:
                 if string in url:
                     wpt = "forum"
-        if wpt is None:
+        # web types missing in the actual config are not used
+        if wpt is None or wpt not in self.webtypes:
             wpt = "others"
         record[WEBPAGETYPE] = wpt
         self.logger.debug(
@@ -90,5 +109,5 @@ class WebPageTypeIdentifier(BaseProcessAlgorithm):
             path: The path where to save the JSON file.
 
         """
-        data = {"webtypes": {"value": {"eshop": 0, "news": 1, "forum": 2, "others": 3}}}
+        data = {"webtypes": {"value": self.WEBTYPES}}
         json.dump(data, open(path, "w"), indent=2, ensure_ascii=False)
@@ -10,6 +10,8 @@ from metadata import (
     TOKENS,
     SENTENCES,
     URLKEY,
+    TIMESTAMP,
+    DIGEST,
     REFERSTO,
     HARVESTID,
     TITLE,
@@ -38,6 +40,86 @@ HBASE_HARV_TABLE = "harvest"
 HBASE_CONF_TABLE = "config"
 HBASE_PROC_TABLE = "processes"
 
+# codecs of the main table columns: serializer (json, bson, msgpack) and/or
+# compressor (zlib, zstd) joined by '+', e.g. 'msgpack+zstd'; strings are
+# always stored as UTF-8 text (compressed if a compressor is given). Encoded
+# values are prefixed by a marker, so they are detected when reading. Columns
+# not listed here are stored without codec (UTF-8 text, BSON dictionaries and
+# JSON for other values). Values shorter than HBASE_COMPRESS_MIN_SIZE bytes
+# are not compressed.
+HBASE_COLUMN_CODECS = {
+    PLAINTEXT: 'zstd',
+    HEADLINES: 'msgpack+zstd',
+    LINKS: 'msgpack+zstd',
+    'IF': 'msgpack+zstd',
+}
+HBASE_COMPRESS_MIN_SIZE = 200
+
+# secondary index tables written together with the main table; each index row
+# maps the values of listed fields (and the main row key) to the main row key,
+# so the records can be found by prefix scan instead of full table scan
+HBASE_URL_INDEX_TABLE = "index_urlkey"
+HBASE_HARV_INDEX_TABLE = "index_harvest"
+HBASE_DIGEST_INDEX_TABLE = "index_digest"
+HBASE_INDEXES = {
+    HBASE_URL_INDEX_TABLE: [URLKEY, TIMESTAMP],
+    HBASE_HARV_INDEX_TABLE: [HARVESTID],
+    HBASE_DIGEST_INDEX_TABLE: [DIGEST],
+}
+
+# settings from HBASE_CONF_TABLE are cached by each process (Spark executor)
+# and reloaded after HBASE_CONF_TTL seconds (see ConfigCache.get_config)
+HBASE_CONF_TTL = 300
+
+# rows are written into HBase in batches of this size (one Thrift round trip
+# per batch); a batch is sent earlier if the oldest buffered row waits longer
+# than HBASE_FLUSH_INTERVAL seconds
+HBASE_BATCH_SIZE = 100
+HBASE_FLUSH_INTERVAL = 10
+
+# processed rows are written into HBase by HBASE_WRITER_THREADS background
+# threads, so writing overlaps with processing; rows wait in a queue of
+# maximum size HBASE_WRITE_QUEUE_SIZE (processing is blocked when the queue is
+# full, i.e. when HBase cannot keep up)
+HBASE_WRITER_THREADS = 2
+HBASE_WRITE_QUEUE_SIZE = 500
+
+# rows of the main table are fetched from Thrift server in batches of this
+# size when reading HBase (--input_hbase)
+HBASE_SCAN_BATCH_SIZE = 100
+
+# each process (Spark executor) keeps a pool of at most HBASE_POOL_SIZE open
+# connections to HBase Thrift server, which are reused by all its tasks;
+# borrowing a connection fails after HBASE_POOL_TIMEOUT seconds of waiting
+# for a free one
+HBASE_POOL_SIZE = 4
+HBASE_POOL_TIMEOUT = 60
+
+# new main table is pre-split into HBASE_MAIN_TABLE_REGIONS regions by
+# hexadecimal prefixes of row keys (which are random UUIDs), so writing into
+# an empty table is spread over all region servers from the start; this
+# requires `hbase shell` on the driver, as Thrift API cannot pre-split tables
+HBASE_MAIN_TABLE_REGIONS = 32
+
+# compression and data block encoding of the column family in new main table
+# (empty string = HBase default); block encoding requires `hbase shell` too
+HBASE_COMPRESSION = 'GZ'
+HBASE_BLOCK_ENCODING = 'FAST_DIFF'
+
+# failed HBase writes are repeated (at most HBASE_MAX_FAILS attempts in total)
+# after a random delay from 0 to HBASE_RETRY_DELAY * 2^(attempt - 1) seconds
+# (but at most HBASE_RETRY_MAX_DELAY), so the tasks do not reconnect all at
+# once; after HBASE_BREAKER_THRESHOLD consecutive failed attempts in one
+# process, all writes wait for HBASE_BREAKER_TIMEOUT seconds, then one write
+# probes whether HBase is available again; a write fails after waiting
+# HBASE_BREAKER_MAX_WAIT seconds in total
+HBASE_MAX_FAILS = 3
+HBASE_RETRY_DELAY = 0.5
+HBASE_RETRY_MAX_DELAY = 30
+HBASE_BREAKER_THRESHOLD = 10
+HBASE_BREAKER_TIMEOUT = 60
+HBASE_BREAKER_MAX_WAIT = 600
+
 PROC_STATUS_RUNNING = "running"
 PROC_STATUS_FINISHED = "finished"
 PROC_STATUS_FAILED = "failed"
@@ -66,6 +148,16 @@ RECORD_FILTERS = {
 #    (warning: your browser could be stucked for a while as well)
 MAX_ALLOWED_HTML_CONTENT_SIZE = 20000000
 
+# charset declared in HTML (meta tag or XML declaration) is searched for only
+# in this number of first bytes of the document (i.e. in its head)
+CHARSET_DECLARATION_SIZE = 65536
+
+# charset and language of a web page are remembered for its host and SURT
+# prefix (the first directory of the path) and tried first for the next page
+# with the same key; each process (Spark executor) remembers at most
+# HOST_MEMORY_SIZE least recently seen keys (set to 0 to disable)
+HOST_MEMORY_SIZE = 10000
+
 # Skip WARC records with content length longer than this size (in bytes).
 # This prevents memory problems with processing too long records with wrong
 # MIME types (e.g. video saved as a text).
@@ -73,6 +165,21 @@ MAX_ALLOWED_HTML_CONTENT_SIZE = 20000000
 # (HTML, PDF, text, images, ...)
 MAX_ALLOWED_WARC_CONTENT_SIZE = 100000000  # ~100 MB
 
+# WARC files larger than this size (in bytes) are split into several chunks,
+# each processed in its own Spark partition. Chunks are aligned to WARC record
+# (i.e. gzip member) offsets, which are read from a CDX index stored next to
+# the WARC file (file name = WARC file name + WARC_CDX_SUFFIX) or, if there is
+# no such index, found by a quick pre-scan of the WARC file.
+# Set to 0 to process each WARC file as a whole in one task.
+WARC_SPLIT_SIZE = 500000000  # ~500 MB
+WARC_CDX_SUFFIX = '.cdx'
+
+# WARC files (or chunks of large WARC files) are packed into Spark partitions
+# with approximately this total size (in bytes). The largest files are
+# distributed first and small files fill the remaining space, so the
+# partitions are balanced and small files do not pay the per-task overhead.
+WARC_PARTITION_SIZE = 500000000  # ~500 MB
+
 
 JUSTEXT_BASE_SETTING = dict(
     length_low=70,
@@ -106,12 +213,21 @@ STOPLISTS = {
 }
 
 # metadata which will be dropped from the intermediary JSON before saving
+# (each of them is dropped as soon as no further algorithm requires it)
 UNNECESSARY_FIELDS = [
     CONTENT,
     TOKENS,
     SENTENCES
 ]
 
+# algorithms computing fields shared by several other algorithms; if an
+# algorithm in --algseq requires such a field, the provider is inserted into
+# the sequence (once) before the first algorithm requiring it
+FIELD_PROVIDERS = {
+    TOKENS: 'WordTokenizer',
+    SENTENCES: 'SentenceTokenizer',
+}
+
 # metadata which will have separate column in output database.
 # The output row for each record will have following columns:
 #  key:         globally unique ID of the record
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# coding: utf-8
+
+"""..module:: archiveprocessor.executor.
+
+Registry of objects shared by all tasks running in one Python worker process
+(Spark executor), e.g. processing algorithms with loaded models. The objects
+are created lazily on first use and kept for the whole life of the process,
+so they do not need to be shipped from the driver with every task.
+
+..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
+"""
+from typing import Any, Callable, Hashable
+import threading
+
+_REGISTRY = {}
+_LOCK = threading.RLock()
+
+
+def get_or_create(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Return the object registered under given key, create it if necessary.
+
+    Args:
+        key: Key of the object.
+        factory: Function without arguments creating the object. It is
+            called at most once per process for each key (unless it fails).
+
+    Returns:
+        The registered object.
+
+    """
+    try:
+        return _REGISTRY[key]
+    except KeyError:
+        pass
+    with _LOCK:
+        if key not in _REGISTRY:
+            _REGISTRY[key] = factory()
+        return _REGISTRY[key]
+
+
+def clear() -> None:
+    """Remove all registered objects."""
+    with _LOCK:
+        _REGISTRY.clear()
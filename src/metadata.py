@@ -49,3 +49,12 @@ WRH_META_MAP = {
 }
 
 INT_FIELDS = [WARCOFFSET, WARCSIZE]
+
+# all fields known in advance; Record stores them in a fixed-size array (in
+# this order), other fields are stored in an auxiliary dictionary
+FIELDS = (
+    ID, CONTENT, PLAINTEXT, TOKENS, SENTENCES, URLKEY, TIMESTAMP, URL,
+    MIMETYPE, RESPONSECODE, DIGEST, REDIRECT, ROBOTFLAGS, WARCOFFSET,
+    WARCSIZE, WARCFILENAME, RECHEADERS, HTTPHEADERS, TITLE, HEADLINES, LINKS,
+    LANGUAGE, WEBPAGETYPE, TOPICS, SENTIMENT, REFERSTO, HARVESTID, EXTRA,
+)
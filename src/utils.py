@@ -5,9 +5,12 @@
 
 ..moduleauthor:: Jan Lehecka <jlehecka@ntis.zcu.cz>
 """
-from typing import Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
+import functools
 import codecs
 import base64
+import heapq
+import math
 import re
 import os
 
@@ -44,6 +47,41 @@ def warc_name_to_harvest_info(warc: str) -> Dict[str, str]:
     return harvest_info
 
 
+def pack_by_size(
+      items: List[Tuple[Any, int]],
+      target_size: int
+      ) -> List[List[Any]]:
+    """Pack items into balanced bins with given target size.
+
+    The number of bins is given by the total size of items and the target
+    size. Items are sorted by size (the largest first) and each item is put
+    into the bin with the smallest total size (LPT scheduling). Items larger
+    than the target size thus end up in their own bins, while small items
+    are packed together.
+
+    Args:
+        items: List of tuples (item, size).
+        target_size: Target total size of one bin.
+
+    Returns:
+        bins: List of non-empty bins, each bin is a list of items.
+
+    """
+    if not items:
+        return []
+    total = sum(size for _, size in items)
+    n_bins = max(1, math.ceil(total / max(target_size, 1)))
+    n_bins = min(n_bins, len(items))
+    bins = [[] for _ in range(n_bins)]
+    # heap of (total size, bin index)
+    heap = [(0, i) for i in range(n_bins)]
+    for item, size in sorted(items, key=lambda x: -x[1]):
+        total, i = heapq.heappop(heap)
+        bins[i].append(item)
+        heapq.heappush(heap, (total + size, i))
+    return bins
+
+
 def bytes_to_base64(byte_string: bytes) -> str:
     """Convert sequence of bytes into unicode string using base64.
 
@@ -89,7 +127,126 @@ def base64_to_bytes(string: str) -> bytes:
     return byte_string
 
 
-def guess_charset(content: str, encodings: Optional[List[str]] = None) -> str:
+CZECH_CHARS = u"aábcčdďeéěfghiíjklmnňoópqrřsštťuúůvwxyýzž" \
+              u"AÁBCČDĎEÉĚFGHIÍJKLMNŇOÓPQRŘSŠTŤUÚŮVWXYÝZŽ"
+
+
+@functools.lru_cache(maxsize=None)
+def get_byte_classes(encoding: str) -> Optional[Tuple[bytes, bytes]]:
+    """Find bytes decoded as Czech characters and bytes not decoded at all.
+
+    This is possible only for single-byte encodings, i.e. encodings decoding
+    each byte into exactly one character, no matter what the surrounding
+    bytes are (checked by decoding all pairs of bytes).
+
+    Args:
+        encoding: Analyzed encoding.
+
+    Returns:
+        Tuple (Czech bytes, error bytes) or `None` for other encodings.
+
+    Raises:
+        LookupError if the encoding does not exist.
+
+    """
+    chars = [bytes([i]).decode(encoding, errors='replace')
+             for i in range(256)]
+    if any(len(c) != 1 for c in chars):
+        return None
+    pairs = bytes(i for j in range(256) for k in range(256) for i in (j, k))
+    if pairs.decode(encoding, errors='replace') != \
+            ''.join(a + b for a in chars for b in chars):
+        return None
+    czech = bytes(i for i, c in enumerate(chars) if c in CZECH_CHARS)
+    errors = bytes(i for i, c in enumerate(chars) if c == u"\uFFFD")
+    return czech, errors
+
+
+def _count_bytes(content: bytes, selected: bytes) -> int:
+    """Count occurrences of selected bytes in the content.
+
+    Args:
+        content: Analyzed byte string.
+        selected: Bytes to be counted.
+
+    Returns:
+        Number of selected bytes in the content.
+
+    """
+    return len(content) - len(content.translate(None, selected))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_newline(encoding: str) -> bytes:
+    """Encode the newline character without possible BOM.
+
+    The length of the result is the width of the code unit of the encoding
+    (e.g. 1 for ASCII-compatible encodings, 2 for UTF-16).
+
+    Args:
+        encoding: The encoding.
+
+    Returns:
+        The encoded newline character.
+
+    Raises:
+        LookupError if the encoding does not exist.
+
+    """
+    encoder = codecs.getincrementalencoder(encoding)()
+    # the first call may emit BOM
+    encoder.encode('a')
+    return encoder.encode('\n')
+
+
+def _sample_content(
+      content: bytes,
+      max_size: int,
+      n_windows: int,
+      newline: bytes = b'\n'
+      ) -> bytes:
+    """Take a bounded sample of the content.
+
+    Content longer than `max_size` is represented by its head (a half of
+    `max_size`) and `n_windows` windows spread evenly over the rest. All
+    parts are aligned to the code unit (the length of `newline`) and the
+    windows start at the beginning of a line if possible, so they do not
+    split multi-byte characters.
+
+    Args:
+        content: Analyzed byte string.
+        max_size: Maximum size of the sample.
+        n_windows: Number of windows sampled from the rest of the content.
+        newline: The newline character in the encoding of the content.
+
+    Returns:
+        The sample.
+
+    """
+    if len(content) <= max_size:
+        return content
+    unit = len(newline)
+    head_size = max_size // 2 // unit * unit
+    window_size = (max_size - head_size) // n_windows // unit * unit
+    parts = [content[:head_size]]
+    step = (len(content) - head_size) // n_windows // unit * unit
+    for i in range(n_windows):
+        start = head_size + i * step
+        line = content.find(newline, start, start + window_size)
+        while line >= 0 and (line - start) % unit:
+            line = content.find(newline, line + 1, start + window_size)
+        if line >= 0:
+            start = line + unit
+        parts.append(content[start:start + window_size])
+    return b''.join(parts)
+
+
+def guess_charset(
+      content: bytes,
+      encodings: Optional[List[str]] = None,
+      max_size: int = 262144,
+      n_windows: int = 8
+      ) -> str:
     """Guess the charset of the content.
 
     The guess is based on selecting charset, which decodes the content
@@ -97,11 +254,22 @@ def guess_charset(content: str, encodings: Optional[List[str]] = None) -> str:
     This method should be called when there is no declaration about
     the encoding or to resolve encoding conflicts.
 
+    Only a sample of at most `max_size` bytes is analyzed (the whole content
+    if it is not longer), aligned to the code unit of each tested encoding.
+    For single-byte encodings, the ratios are computed from byte counts
+    without decoding. Other encodings are decoded and the Czech characters
+    are counted after encoding the text back to cp1250 (which contains all
+    of them).
+
     Args:
         content: The content with unknown encoding.
         encodings: List of possible encodings to decide among.
             If `None` (default), several encodings typical for Czech
             documents will be used.
+        max_size: Maximum number of analyzed bytes.
+        n_windows: Number of windows sampled from content longer than
+            `max_size` (besides its head).
+
     Returns:
         charset: Guessed charset.
 
@@ -120,26 +288,44 @@ def guess_charset(content: str, encodings: Optional[List[str]] = None) -> str:
             'ascii', 'utf-8', 'cp1250', 'iso-8859-2', 'cp1251', 'cp1252',
             'cp852', 'utf-16'
         ]
-    czech_chars = u"aábcčdďeéěfghiíjklmnňoópqrřsštťuúůvwxyýzž" \
-                  u"AÁBCČDĎEÉĚFGHIÍJKLMNŇOÓPQRŘSŠTŤUÚŮVWXYÝZŽ"
 
-    content = content[:1000000]  # analyze only reasonable amount of text
+    cp1250_czech, _ = get_byte_classes('cp1250')
     results = []
+    # samples by the newline character of the encodings
+    samples = {}
 
     for e in encodings:
         try:
-            ucontent = content.decode(e, errors="replace")
+            # analyze only reasonable amount of text, the sample must be
+            # aligned to the code unit of the encoding (e.g. UTF-16)
+            newline = _get_newline(e)
+            if newline not in samples:
+                samples[newline] = _sample_content(
+                    content, max_size, n_windows, newline
+                )
+            sample = samples[newline]
+            byte_classes = get_byte_classes(e)
+            if byte_classes is not None:
+                czech, errors = byte_classes
+                length = len(sample)
+                n_cz = _count_bytes(sample, czech)
+                n_er = _count_bytes(sample, errors)
+            else:
+                ucontent = sample.decode(e, errors="replace")
+                length = len(ucontent)
+                n_cz = _count_bytes(
+                    ucontent.encode('cp1250', errors='ignore'), cp1250_czech
+                )
+                # count of replacement characters
+                n_er = ucontent.count(u"\uFFFD")
         except (UnicodeEncodeError, UnicodeDecodeError, LookupError):
             pass
         else:
-            if len(ucontent) == 0:
+            if length == 0:
                 continue
 
-            n_cz = sum(char in czech_chars for char in ucontent)
-            cz_ratio = float(n_cz) / len(ucontent)
-
-            n_er = ucontent.count(u"\uFFFD")  # count of replacement characters
-            er_ratio = float(n_er) / len(ucontent)
+            cz_ratio = float(n_cz) / length
+            er_ratio = float(n_er) / length
 
             results.append((e, cz_ratio, er_ratio))
 
@@ -7,7 +7,29 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
 
-from ArchiveProcessor import ArchiveProcessor
+from ArchiveProcessor import ArchiveProcessor, SetAccumulatorParam
+from metadata import (
+    ID, MIMETYPE, RESPONSECODE, CONTENT, TOKENS, SENTENCES, HARVESTID,
+    WARCFILENAME, PLAINTEXT, LANGUAGE, TITLE, TOPICS, SENTIMENT, URL,
+    WEBPAGETYPE, URLKEY, TIMESTAMP, DIGEST
+)
+from config import OUTPUT_SEPARATE_COLS
+from Record import Record
+
+EXAMPLE_WARC = os.path.join(
+    os.path.dirname(__file__), "../example-20200623-crawler0.warc.gz"
+)
+
+def create_processor(**kwargs):
+    _kwargs = dict(
+        input_warcs="foo.warc",
+        input_hbase=False,
+        output_textfile="bar.txt",
+        output_textfile_extra=None,
+        output_hbase=False
+    )
+    _kwargs.update(kwargs)
+    return ArchiveProcessor(**_kwargs)
 
 class TestArchiveProcessor():
     class TestArchiveProcessor():
@@ -21,3 +43,244 @@ class TestArchiveProcessor():
                 output_hbase=False
             )
             assert_that(ap).is_instance_of(ArchiveProcessor)
+
+        @mock.patch('ArchiveProcessor.WARC_SPLIT_SIZE', 100000)
+        def test_split_warc(self):
+            ap = create_processor(algseq=[("HTML", [])])
+            uri = "file://" + os.path.abspath(EXAMPLE_WARC)
+            size = os.path.getsize(EXAMPLE_WARC)
+            chunks = ap._split_warc((uri, size))
+            assert_that(len(chunks)).is_greater_than(1)
+            assert_that(chunks[0][1]).is_equal_to(0)
+            assert_that(chunks[-1][2]).is_equal_to(size)
+            for prev, chunk in zip(chunks, chunks[1:]):
+                assert_that(chunk[1]).is_equal_to(prev[2])
+
+            # each chunk starts at a record offset, so reading all chunks must
+            # give the same records as reading the whole WARC
+            ap.process_record = lambda record: record[ID]
+            whole = list(ap.process_warc_partition(0, [(uri, 0, size)]))
+            parts = []
+            for chunk in chunks:
+                parts += list(ap.process_warc_partition(0, [chunk]))
+            assert_that(whole).is_not_empty()
+            assert_that(parts).is_equal_to(whole)
+
+        def test_split_warc_small(self):
+            ap = create_processor()
+            ret = ap._split_warc(("file:///small.warc.gz", 100))
+            assert_that(ret).is_equal_to([("file:///small.warc.gz", 0, 100)])
+
+        def test_get_skip_reason(self):
+            ap = create_processor(algseq=[("HTML", [])])
+            fields = {ID: "urn:uuid:1", MIMETYPE: "text/html", RESPONSECODE: "200"}
+            assert_that(ap._get_skip_reason(fields)).is_none()
+            ret = ap._get_skip_reason(dict(fields, **{RESPONSECODE: "404"}))
+            assert_that(ret).contains("did not pass filter")
+            ret = ap._get_skip_reason(dict(fields, **{MIMETYPE: "image/png"}))
+            assert_that(ret).contains("image/png")
+            ap.processIDs = {"urn:uuid:2"}
+            assert_that(ap._get_skip_reason(fields)).contains("ID not listed")
+
+        def test_decompose_record_content(self):
+            ap = create_processor()
+            record = Record({ID: "urn:uuid:1", CONTENT: b'some\ntext'})
+            ret = ap.decompose_record(record)
+            assert_that(ret[0]).is_equal_to("1")
+            # raw content is serialized as base64 only in the output
+            assert_that(ret[-1][CONTENT]).is_equal_to("c29tZQp0ZXh0")
+
+        def test_algorithms_shared(self):
+            ap1 = create_processor(algseq=[("HTML", ["WordTokenizer"])])
+            ap2 = create_processor(algseq=[("HTML", ["WordTokenizer"])])
+            alg, drop = ap1._get_algseq_for_MIMEtype("text/html")[0]
+            assert_that(alg.__class__.__name__).is_equal_to("WordTokenizer")
+            assert_that(ap2._get_algorithm("WordTokenizer")).is_same_as(alg)
+
+        def test_plan_algseq(self):
+            ap = create_processor()
+            plan = ap._plan_algseq([
+                "HTMLTextExtractor", "TopicIdentifier", "SentimentAnalyzer",
+                "FleschReadingEase", "WebPageTypeIdentifier"
+            ])
+            assert_that(plan).is_equal_to([
+                ("HTMLTextExtractor", [CONTENT]),
+                ("WordTokenizer", []),
+                ("TopicIdentifier", []),
+                ("SentimentAnalyzer", []),
+                ("SentenceTokenizer", []),
+                ("FleschReadingEase", [TOKENS, SENTENCES]),
+                ("WebPageTypeIdentifier", []),
+            ])
+
+            # explicitly listed provider is not run twice
+            plan = ap._plan_algseq([
+                "HTMLTextExtractor", "WordTokenizer", "TopicIdentifier"
+            ])
+            assert_that([name for name, _ in plan]).is_equal_to(
+                ["HTMLTextExtractor", "WordTokenizer", "TopicIdentifier"]
+            )
+            assert_that(plan[-1][1]).is_equal_to([TOKENS])
+
+        def test_algorithms_without_module(self):
+            # on executors, the processor may be unpickled in a process where
+            # its module (e.g. __main__) does not define the algorithms
+            ap = create_processor()
+            with mock.patch.dict(sys.modules,
+                                 {"ArchiveProcessor": mock.Mock(spec=[])}):
+                plan = ap._plan_algseq(["TopicIdentifier"])
+                assert_that([name for name, _ in plan]).is_equal_to(
+                    ["WordTokenizer", "TopicIdentifier"]
+                )
+                assert_that(ap._get_algorithm("WordTokenizer").__class__
+                            .__name__).is_equal_to("WordTokenizer")
+            assert_that(ap._init_alg_or_terminate).raises(SystemExit) \
+                .when_called_with("NoSuchAlgorithm")
+
+        @mock.patch('ArchiveProcessor.get_config')
+        def test_configure_algorithms(self, mock_config):
+            mock_config.return_value = {"news": 1, "others": 3}
+            # without HBase, the config table is not read
+            ap = create_processor(algseq=[("HTML", ["WebPageTypeIdentifier"])])
+            alg = ap._get_algorithm("WebPageTypeIdentifier")
+            ap._configure_algorithms()
+            mock_config.assert_not_called()
+            assert_that(alg.webtypes).is_equal_to(alg.WEBTYPES)
+
+            ap.output_hbase = True
+            ap._configure_algorithms()
+            mock_config.assert_called_once_with("webtypes")
+            assert_that(alg.webtypes).is_equal_to({"news": 1, "others": 3})
+            alg.configure({})
+
+        def test_getstate(self):
+            ap = create_processor(algseq=[("HTML", ["WordTokenizer"])])
+            ap.processIDs = {"urn:uuid:1"}
+            ap._get_algseq_for_MIMEtype("text/html")
+            ap._bc_schema = mock.Mock(value=ap.schema)
+            ap._bc_processIDs = mock.Mock(value=ap.processIDs)
+            state = ap.__getstate__()
+            assert_that(state).does_not_contain_key("_CACHEALGSEQ")
+            assert_that(state).contains_entry(
+                {"_schema": None}, {"_processIDs": None}, {"_validator": None}
+            )
+
+            ap2 = ArchiveProcessor.__new__(ArchiveProcessor)
+            ap2.__dict__.update(state)
+            assert_that(ap2.processIDs).is_equal_to({"urn:uuid:1"})
+            assert_that(ap2.schema).is_equal_to(ap.schema)
+
+        @mock.patch('ArchiveProcessor.HBase')
+        def test_check_hbase_harvest_table(self, mock_hbase):
+            mock_hbase.return_value.has_row.return_value = False
+            ap = create_processor()
+            ap.harvests = mock.Mock()
+            for hid in ["harvest1", "harvest2", "harvest1", "harvest1"]:
+                record = Record({
+                    HARVESTID: hid,
+                    WARCFILENAME: f"{hid}-20200623-crawler0.warc.gz",
+                })
+                ap._check_hbase_harvest_table(record)
+            # each harvest is registered only once
+            assert_that(mock_hbase.return_value.put.call_count).is_equal_to(2)
+            assert_that(ap.harvests.add.call_count).is_equal_to(4)
+
+            # the connection is returned into the pool even if HBase fails
+            mock_hbase.return_value.has_row.side_effect = IOError("failed")
+            mock_hbase.return_value.close.reset_mock()
+            record = Record({HARVESTID: "harvest3", WARCFILENAME: "x.warc.gz"})
+            assert_that(ap._check_hbase_harvest_table).raises(IOError) \
+                .when_called_with(record)
+            mock_hbase.return_value.close.assert_called_once()
+
+        def test_set_accumulator(self):
+            param = SetAccumulatorParam()
+            acc = param.zero(None)
+            acc = param.addInPlace(acc, "harvest1")
+            acc = param.addInPlace(acc, "harvest1")
+            acc = param.addInPlace(acc, {"harvest2", "harvest3"})
+            assert_that(acc).is_equal_to({"harvest1", "harvest2", "harvest3"})
+
+        def test_get_input_columns(self):
+            ap = create_processor(input_hbase=True)
+            ap.algseq = [("HTML", ["TopicIdentifier", "SentimentAnalyzer"])]
+            # provided fields are loaded to be compared with the new values
+            assert_that(ap._get_input_columns()).is_equal_to(
+                [LANGUAGE, PLAINTEXT, "refers-to", SENTIMENT, TOPICS]
+            )
+            # URL and MIME type are stored in the rest of IF
+            ap.algseq = [("HTML", ["WebPageTypeIdentifier"]), ("PDF", [])]
+            assert_that(ap._get_input_columns()).is_equal_to(
+                ["IF", "refers-to", WEBPAGETYPE]
+            )
+
+        @mock.patch('ArchiveProcessor.HBase')
+        def test_get_hbase_key_ranges(self, mock_hbase):
+            ap = create_processor(input_hbase=True)
+            mock_hbase.return_value.get_regions.return_value = [(b'', b'')]
+            ranges = ap._get_hbase_key_ranges()
+            assert_that(ranges).is_length(16)
+            assert_that(ranges[0]).is_equal_to((b'', b'1'))
+            assert_that(ranges[-1]).is_equal_to((b'f', b''))
+            regions = [(b'', b'8'), (b'8', b'')]
+            mock_hbase.return_value.get_regions.return_value = regions
+            assert_that(ap._get_hbase_key_ranges()).is_equal_to(regions)
+
+        def test_process_HBase_row(self):
+            ap = create_processor(
+                input_hbase=True, algseq=[("HTML", ["WordTokenizer"])]
+            )
+            key = b'f81d4fae-7dec-11d0-a765-00a0c91e6bf6'
+            ret = ap._process_HBase_row((key, {
+                b'cf1:plain-text': 'Nějaký text.'.encode('utf-8'),
+                b'cf1:language': b'cs',
+                b'cf1:refers-to': b'',
+            }))
+            assert_that(ret[0]).is_equal_to(key.decode())
+            # tokens are not saved, so no column is changed (and none of
+            # them, loaded or not, is overwritten)
+            assert_that(ret[1:]).is_equal_to(
+                [None] * (len(OUTPUT_SEPARATE_COLS) + 1)
+            )
+
+        def test_decompose_record_partial(self):
+            ap = create_processor(input_hbase=True)
+            ap.input_columns = ["IF", "refers-to", TOPICS, WEBPAGETYPE]
+            record = Record({
+                ID: "urn:uuid:1", URL: "http://a.cz/", TOPICS: ["sport"],
+                WEBPAGETYPE: "article",
+            })
+            record.begin()
+            record[TOPICS] = ["sport"]
+            record[WEBPAGETYPE] = "home"
+            record.commit()
+            ret = ap.decompose_record(record)
+            cols = dict(zip(OUTPUT_SEPARATE_COLS, ret[1:]))
+            # only the changed column is written
+            assert_that(cols[WEBPAGETYPE]).is_equal_to("home")
+            assert_that(cols[TOPICS]).is_none()
+            assert_that(ret[-1]).is_none()
+
+            record.begin()
+            record[URL] = "http://b.cz/"
+            del record[WEBPAGETYPE]
+            record.commit()
+            ret = ap.decompose_record(record)
+            cols = dict(zip(OUTPUT_SEPARATE_COLS, ret[1:]))
+            # deleted field is written as empty cell
+            assert_that(cols[WEBPAGETYPE]).is_equal_to("")
+            assert_that(ret[-1]).contains_entry({URL: "http://b.cz/"})
+
+        def test_get_index_rows(self):
+            ap = create_processor()
+            row_data = {
+                URLKEY: "cz,a)/", HARVESTID: "h1",
+                "IF": {TIMESTAMP: "20200623", DIGEST: "sha1:A"},
+            }
+            assert_that(ap._get_index_rows("id1", row_data)).contains_only(
+                ("index_urlkey", "cz,a)/ 20200623 id1", {"id": "id1"}),
+                ("index_harvest", "h1 id1", {"id": "id1"}),
+                ("index_digest", "sha1:A id1", {"id": "id1"}),
+            )
+            # partial updates are not indexed
+            assert_that(ap._get_index_rows("id1", {TOPICS: []})).is_empty()
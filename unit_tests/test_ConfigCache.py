@@ -0,0 +1,44 @@
+# coding: utf-8
+from unittest import mock
+from assertpy import assert_that
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+from ConfigCache import ConfigCache
+from HBase import HBase
+import happybase_mock
+
+
+class TestConfigCache():
+    @mock.patch('HBase.happybase.Connection')
+    def test_get(self, mock_hb):
+        mock_hb.side_effect = happybase_mock.Connection
+        hb = HBase("100.100.100.105", 1234)
+        hb.check_table('config')
+        hb.put('config', 'webtypes', {'value': {'eshop': 0, 'news': 1}},
+               dict2bson=False)
+        cache = ConfigCache("100.100.100.105", 1234, 'config', ttl=60)
+        with mock.patch.object(cache, '_load', wraps=cache._load) as load:
+            assert_that(cache.get('webtypes')).is_equal_to(
+                {'eshop': 0, 'news': 1}
+            )
+            assert_that(cache.get('topics', {})).is_equal_to({})
+            # the table is loaded once per TTL
+            assert_that(load.call_count).is_equal_to(1)
+
+            hb.put('config', 'webtypes', {'value': {'eshop': 0}},
+                   dict2bson=False)
+            cache.t_loaded -= 60
+            assert_that(cache.get('webtypes')).is_equal_to({'eshop': 0})
+            assert_that(load.call_count).is_equal_to(2)
+        hb.delete_table('config')
+
+    def test_load_fail(self):
+        cache = ConfigCache("100.100.100.105", 1234, 'config', ttl=60)
+        cache.rows = {'webtypes': {'value': {'eshop': 0}}}
+        cache.t_loaded = 0
+        with mock.patch('ConfigCache.HBase', side_effect=IOError('no HBase')):
+            # previously loaded settings are kept
+            assert_that(cache.get('webtypes')).is_equal_to({'eshop': 0})
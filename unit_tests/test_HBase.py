@@ -3,11 +3,17 @@ from unittest import mock
 from assertpy import assert_that
 import pyphen
 
+import threading
+import time
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
 
-from HBase import HBase
+from HBase import (
+    HBase, HBaseBatchWriter, HBaseConnectionPool, HBaseAsyncWriter,
+    get_split_keys, parse_codec, CODEC_MARKER, RetryPolicy, CircuitBreaker
+)
+from config import HBASE_MAIN_TABLE, HBASE_HARV_TABLE, HBASE_CONF_TABLE
 import happybase_mock
 
 class TestHBase():
@@ -52,3 +58,371 @@ class TestHBase():
             b'8\x00\x00\x00\x02key1\x00\x05\x00\x00\x00val1\x00\x04key2\x00\x10\x00\x00\x00\x020\x00\x04\x00\x00\x00adf\x00\x00\x01key3\x00\xcd\xcc\xcc\xcc\xcc\xcc/@\x00'
         )
         
+
+    @mock.patch('HBase.happybase.Connection')
+    def test_put_batch(self, mock_hb):
+        mock_hb.side_effect = happybase_mock.Connection
+        hb = HBase("100.100.100.100", 1234)
+        hb.check_table('my_table')
+        rows = [('row1', {'datakey': 'value1'}), ('row2', {'datakey': 2})]
+        assert_that(hb.put_batch('my_table', rows)).is_true()
+        assert_that(hb.get_row('my_table', 'row1')).is_equal_to(
+            {b'cf1:datakey': b'value1'}
+        )
+        assert_that(hb.get_row('my_table', 'row2')).is_equal_to(
+            {b'cf1:datakey': b'2'}
+        )
+        hb.delete_table('my_table')
+
+    @mock.patch('HBase.happybase.Connection')
+    def test_batch_writer(self, mock_hb):
+        mock_hb.side_effect = happybase_mock.Connection
+        hb = HBase("100.100.100.100", 1234)
+        hb.check_table('my_table')
+        with mock.patch.object(hb, 'put_batch', wraps=hb.put_batch) as pb:
+            with HBaseBatchWriter(hb, 'my_table', batch_size=2) as writer:
+                for i in range(5):
+                    writer.put(f'row{i}', {'datakey': i})
+            assert_that(pb.call_count).is_equal_to(3)
+        assert_that(writer.n_saved).is_equal_to(5)
+        assert_that(writer.n_failed).is_equal_to(0)
+        assert_that(hb.has_row('my_table', 'row4')).is_true()
+        hb.delete_table('my_table')
+
+    @mock.patch('HBase.time.sleep')
+    @mock.patch('HBase.happybase')
+    def test_batch_writer_fail(self, mock_hb, mock_sleep):
+        hb = HBase("100.100.100.100", 1234)
+        hb.get_table = mock.Mock(side_effect=IOError("no connection"))
+        with HBaseBatchWriter(hb, 'my_table', batch_size=2) as writer:
+            for i in range(3):
+                writer.put(f'row{i}', {'datakey': i})
+        # the whole batch is retried, failed rows are counted one by one
+        assert_that(hb.get_table.call_count).is_equal_to(6)
+        assert_that(writer.n_saved).is_equal_to(0)
+        assert_that(writer.n_failed).is_equal_to(3)
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(max_fails=5, base_delay=1, max_delay=3)
+        for n_fails, limit in [(1, 1), (2, 2), (3, 3), (10, 3)]:
+            for _ in range(20):
+                assert_that(policy.get_delay(n_fails)).is_between(0, limit)
+
+    @mock.patch('HBase.time.sleep')
+    @mock.patch('HBase.happybase')
+    def test_circuit_breaker(self, mock_hb, mock_sleep):
+        hb = HBase("100.100.100.104", 1234)
+        hb.breaker = CircuitBreaker('test', threshold=4, reset_timeout=60,
+                                    max_wait=0)
+        hb.get_table = mock.Mock(side_effect=IOError("region busy"))
+        assert_that(hb.put('my_table', 'row1', {'a': 1})).is_false()
+        assert_that(hb.get_table.call_count).is_equal_to(3)
+        assert_that(mock_sleep.call_count).is_equal_to(2)
+        # only one more attempt until the breaker opens
+        assert_that(hb.put_batch('my_table', [('row1', {'a': 1})])).is_false()
+        assert_that(hb.get_table.call_count).is_equal_to(4)
+        assert_that(hb.breaker.allow()).is_false()
+        assert_that(hb.put('my_table', 'row1', {'a': 1})).is_false()
+        assert_that(hb.get_table.call_count).is_equal_to(4)
+
+        # after the timeout, operations are attempted again
+        hb.breaker.t_opened -= 60
+        hb.get_table = mock.Mock()
+        assert_that(hb.put('my_table', 'row1', {'a': 1})).is_true()
+        assert_that(hb.breaker.n_failures).is_equal_to(0)
+        assert_that(hb.breaker.allow()).is_true()
+
+    def test_circuit_breaker_half_open(self):
+        breaker = CircuitBreaker('test', threshold=1, reset_timeout=0.2,
+                                 max_wait=0.05)
+        breaker.record_failure()
+        # callers wait while the breaker is open, then give up
+        t_start = time.monotonic()
+        assert_that(breaker.wait()).is_false()
+        assert_that(time.monotonic() - t_start).is_greater_than_or_equal_to(0.04)
+
+        # after the timeout, exactly one probe is let through
+        breaker.t_opened -= 0.2
+        assert_that(breaker.wait()).is_true()
+        assert_that(breaker.allow()).is_false()
+        assert_that(breaker.wait()).is_false()
+
+        # failed probe opens the breaker again
+        breaker.record_failure()
+        assert_that(breaker.allow()).is_false()
+
+        # waiting callers are let through by successful probe
+        breaker.t_opened -= 0.2
+        breaker.max_wait = 5
+        assert_that(breaker.wait()).is_true()
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(breaker.wait()))
+        waiter.start()
+        time.sleep(0.05)
+        assert_that(results).is_empty()
+        breaker.record_success()
+        waiter.join(5)
+        assert_that(results).is_equal_to([True])
+        assert_that(breaker.allow()).is_true()
+
+    @mock.patch('HBase.happybase.Connection')
+    def test_connection_pool(self, mock_conn):
+        mock_conn.side_effect = lambda *args, **kwargs: mock.MagicMock()
+        pool = HBaseConnectionPool("100.100.100.100", 1234, size=2, timeout=0)
+        conn1 = pool.acquire()
+        conn2 = pool.acquire()
+        assert_that(mock_conn.call_count).is_equal_to(2)
+        # the pool is exhausted
+        assert_that(pool.acquire).raises(Exception).when_called_with()
+
+        # released connection is reused
+        pool.release(conn1)
+        assert_that(pool.acquire()).is_same_as(conn1)
+        assert_that(mock_conn.call_count).is_equal_to(2)
+
+        # broken or closed connections are replaced
+        pool.release(conn1, broken=True)
+        conn1.close.assert_called_once()
+        conn2.transport.is_open.return_value = False
+        pool.release(conn2)
+        assert_that(pool.n_open).is_equal_to(0)
+        pool.acquire()
+        assert_that(mock_conn.call_count).is_equal_to(3)
+
+    @mock.patch('HBase.happybase.Connection')
+    def test_pooled(self, mock_conn):
+        mock_conn.side_effect = lambda *args, **kwargs: mock.MagicMock()
+        hb = HBase("100.100.100.101", 1234, pooled=True)
+        conn = hb.conn
+        hb.close()
+        # closing again does not release the connection twice
+        hb.close()
+        assert_that(hb.conn).is_none()
+        assert_that(hb.pool.idle).is_length(1)
+        hb = HBase("100.100.100.101", 1234, pooled=True)
+        assert_that(hb.conn).is_same_as(conn)
+        hb.restart_connection()
+        assert_that(hb.conn).is_not_same_as(conn)
+        assert_that(mock_conn.call_count).is_equal_to(2)
+        hb.close()
+
+    @mock.patch('HBase.happybase.Connection')
+    def test_async_writer(self, mock_hb):
+        mock_hb.side_effect = happybase_mock.Connection
+        hb = HBase("100.100.100.102", 1234)
+        hb.check_table('my_table')
+        writer = HBaseAsyncWriter(
+            "100.100.100.102", 1234, 'my_table', n_threads=2, queue_size=2,
+            batch_size=3
+        )
+        with writer:
+            for i in range(10):
+                writer.put(f'row{i}', {'datakey': i})
+        assert_that(writer.n_saved).is_equal_to(10)
+        assert_that(writer.n_failed).is_equal_to(0)
+        for i in range(10):
+            assert_that(hb.has_row('my_table', f'row{i}')).is_true()
+        hb.delete_table('my_table')
+
+    @mock.patch('HBase.happybase.Connection')
+    def test_async_writer_fail(self, mock_hb):
+        mock_hb.side_effect = IOError("no connection")
+        with HBaseAsyncWriter(
+              "100.100.100.103", 1234, 'my_table', queue_size=1) as writer:
+            for i in range(5):
+                writer.put(f'row{i}', {'datakey': i})
+        assert_that(writer.n_saved).is_equal_to(0)
+        assert_that(writer.n_failed).is_equal_to(5)
+
+    @mock.patch('HBase.HBaseBatchWriter')
+    @mock.patch('HBase.happybase.Connection')
+    def test_async_writer_error(self, mock_hb, mock_writer):
+        # failed rows are counted, the thread keeps running
+        mock_writer.return_value.put.side_effect = ValueError("bad row")
+        mock_writer.return_value.buffer = []
+        mock_writer.return_value.n_saved = 0
+        mock_writer.return_value.n_failed = 0
+        with HBaseAsyncWriter(
+              "100.100.100.103", 1234, 'my_table', n_threads=1,
+              queue_size=1) as writer:
+            for i in range(5):
+                writer.put(f'row{i}', {'datakey': i})
+        assert_that(writer.n_failed).is_equal_to(5)
+
+        # died thread does not block the producer
+        mock_writer.return_value.flush.side_effect = ValueError("broken")
+        writer = HBaseAsyncWriter(
+            "100.100.100.103", 1234, 'my_table', n_threads=1, queue_size=1,
+            flush_interval=0.01
+        )
+        writer.threads[0].join(5)
+        with mock.patch.object(HBaseAsyncWriter, '_PUT_TIMEOUT', 0.01):
+            writer.put('row0', {'datakey': 0})
+            assert_that(writer.put).raises(RuntimeError) \
+                .when_called_with('row1', {'datakey': 1})
+            assert_that(writer.close).raises(RuntimeError) \
+                .when_called_with()
+        assert_that(writer.n_saved).is_equal_to(0)
+        assert_that(writer.n_failed).is_equal_to(1)
+
+    @mock.patch('HBase.happybase')
+    def test_from_bytes(self, mock_hb):
+        hb = HBase("100.100.100.100", 1234)
+        for val, type_hint in [
+              ("kulaťoučký kůň", "string"),
+              ({"key1": "val1", "key2": ["adf"]}, "object"),
+              (["jedna", "dvě"], "array"),
+              (1.5, "number"),
+              ]:
+            assert_that(
+                HBase.from_bytes(hb.to_bytes(val), type_hint)
+            ).is_equal_to(val)
+
+    @mock.patch('HBase.happybase')
+    def test_codecs(self, mock_hb):
+        hb = HBase("100.100.100.100", 1234)
+        text = "kulaťoučký kůň " * 100
+        links = [{"url": f"http://a.cz/{i}", "text": "odkaz"} for i in range(50)]
+        for val, codec in [
+              (text, "zstd"),
+              (text, "zlib"),
+              (links, "msgpack+zstd"),
+              ({"key1": "val1", "key2": links}, "zlib"),
+              ({"key1": "val1", "key2": links}, "msgpack+zlib"),
+              ([1, 2], "bson+zstd"),
+              ("short", "zstd"),
+              (1.5, "msgpack"),
+              ]:
+            data = hb.to_bytes(val, codec=codec)
+            assert_that(data[:len(CODEC_MARKER)]).is_equal_to(CODEC_MARKER)
+            # the codec is detected regardless of type hint
+            assert_that(HBase.from_bytes(data, "string")).is_equal_to(val)
+        assert_that(
+            len(hb.to_bytes(text, codec="zstd"))
+        ).is_less_than(len(hb.to_bytes(text)))
+        # short values are not compressed
+        assert_that(hb.to_bytes("short", codec="zstd")).is_equal_to(
+            CODEC_MARKER + b"s-short"
+        )
+        # empty string marks missing field
+        assert_that(hb.to_bytes("", codec="zstd")).is_equal_to(b"")
+        # so does an object which cannot be serialized
+        for codec in ["msgpack", "msgpack+zstd", "zlib"]:
+            assert_that(hb.to_bytes([object()], codec=codec)).is_equal_to(b"")
+        assert_that(hb.row_to_bytes(
+            {"a": text, "b": text}, codecs={"a": "zlib"}
+        )[b"cf1:b"]).is_equal_to(text.encode("utf-8"))
+
+    @mock.patch('HBase.happybase')
+    def test_legacy_value_with_marker(self, mock_hb):
+        hb = HBase("100.100.100.100", 1234)
+        # raw bytes followed by unknown codec bytes
+        value = CODEC_MARKER + b"\x00\x01data"
+        assert_that(HBase.from_bytes(value)).is_equal_to(
+            value.decode("utf-8", errors="replace")
+        )
+        # BSON document with length 0x005041ff starts with the marker
+        doc = {"a": "x" * (0x5041ff - 13)}
+        value = hb.to_bytes(doc)
+        assert_that(value[:4]).is_equal_to(CODEC_MARKER + b"\x00")
+        assert_that(HBase.from_bytes(value, "object")).is_equal_to(doc)
+
+    def test_parse_codec(self):
+        assert_that(parse_codec("zstd")).is_equal_to((None, "zstd"))
+        assert_that(parse_codec("msgpack+zlib")).is_equal_to(
+            ("msgpack", "zlib")
+        )
+        assert_that(parse_codec).raises(ValueError).when_called_with("lz4")
+
+    @mock.patch('HBase.happybase.Connection')
+    def test_scan_range(self, mock_hb):
+        mock_hb.side_effect = happybase_mock.Connection
+        hb = HBase("100.100.100.100", 1234)
+        hb.check_table('my_table')
+        for key in ['a1', 'b1', 'b2', 'c1']:
+            hb.put('my_table', key, {'col1': key, 'col2': 'x'})
+        rows = list(hb.scan_range('my_table', b'b', b'c', columns=['col1']))
+        assert_that(rows).is_equal_to([
+            (b'b1', {b'cf1:col1': b'b1'}),
+            (b'b2', {b'cf1:col1': b'b2'}),
+        ])
+        assert_that(list(hb.scan_range('my_table'))).is_length(4)
+        hb.delete_table('my_table')
+
+    def test_split_keys(self):
+        assert_that(get_split_keys(1)).is_empty()
+        assert_that(get_split_keys(4)).is_equal_to([b'4', b'8', b'c'])
+        keys = get_split_keys(256)
+        assert_that(keys).is_length(255)
+        assert_that(keys[0]).is_equal_to(b'01')
+        assert_that(keys[-1]).is_equal_to(b'ff')
+        assert_that(keys).is_equal_to(sorted(set(keys)))
+
+    @mock.patch('HBase.subprocess.run')
+    @mock.patch('HBase.shutil.which')
+    @mock.patch('HBase.happybase')
+    def test_create_table_presplit(self, mock_hb, mock_which, mock_run):
+        hb = HBase("100.100.100.100", 1234)
+        hb.has_table = mock.Mock(return_value=True)
+        mock_which.return_value = '/usr/bin/hbase'
+        hb.create_table('main', 1, 4, 'GZ', 'FAST_DIFF')
+        cmd = mock_run.call_args[1]['input']
+        assert_that(cmd).contains("create 'main'")
+        assert_that(cmd).contains("COMPRESSION => 'GZ'")
+        assert_that(cmd).contains("DATA_BLOCK_ENCODING => 'FAST_DIFF'")
+        assert_that(cmd).contains("SPLITS => ['4', '8', 'c']")
+        hb.conn.create_table.assert_not_called()
+
+        # without hbase shell, the table is created via Thrift
+        mock_which.return_value = None
+        hb.create_table('main', 1, 4, 'GZ', 'FAST_DIFF')
+        hb.conn.create_table.assert_called_once_with(
+            b'main', {'cf1': {'max_versions': 1, 'compression': 'GZ'}}
+        )
+
+    @mock.patch('HBase.happybase')
+    def test_check_tables(self, mock_hb):
+        hb = HBase("100.100.100.100", 1234)
+        hb.check_table = mock.Mock()
+        hb.check_tables(4, 'GZ', 'FAST_DIFF')
+        calls = hb.check_table.call_args_list
+        # only the main table is pre-split, compressed and block encoded
+        assert_that(calls[0]).is_equal_to(
+            mock.call(HBASE_MAIN_TABLE, 1, 4, 'GZ', 'FAST_DIFF')
+        )
+        assert_that(calls[1:]).contains(
+            mock.call(HBASE_HARV_TABLE, 1), mock.call(HBASE_CONF_TABLE, 100)
+        )
+        for call in calls[1:]:
+            assert_that(call[0]).is_length(2)
+            assert_that(call[1]).is_empty()
+
+    @mock.patch('HBase.happybase.Connection')
+    def test_index(self, mock_hb):
+        mock_hb.side_effect = happybase_mock.Connection
+        hb = HBase("100.100.100.100", 1234)
+        for table in ['my_table', 'index_urlkey', 'index_digest']:
+            hb.check_table(table)
+        with HBaseBatchWriter(hb, 'my_table', batch_size=10) as writer:
+            for key, ts, digest in [
+                  ('id3', '20200101', 'sha1:B'),
+                  ('id1', '20210101', 'sha1:A'),
+                  ('id2', '20200623', 'sha1:A'),
+                  ]:
+                writer.put(key, {'urlkey': 'cz,a)/'}, [
+                    ('index_urlkey',
+                     *HBase.index_row(['cz,a)/', ts], key)),
+                    ('index_digest', *HBase.index_row([digest], key)),
+                ])
+        assert_that(hb.get_keys_by_urlkey('cz,a)/')).is_equal_to(
+            ['id3', 'id2', 'id1']
+        )
+        assert_that(hb.get_keys_by_urlkey('cz,a)/', '2020')).is_equal_to(
+            ['id3', 'id2']
+        )
+        assert_that(hb.get_keys_by_urlkey('cz,a)/x')).is_empty()
+        assert_that(hb.get_keys_by_digest('sha1:A')).is_equal_to(
+            ['id1', 'id2']
+        )
+        for table in ['my_table', 'index_urlkey', 'index_digest']:
+            hb.delete_table(table)
@@ -0,0 +1,46 @@
+# coding: utf-8
+from assertpy import assert_that
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+from HostMemory import HostMemory, get_host_key, get_host_memory
+
+
+class TestHostMemory():
+    def test_get_host_key(self):
+        assert_that(get_host_key("cz,webarchiv)/about")).is_equal_to("cz,webarchiv)/")
+        assert_that(get_host_key("cz,webarchiv)")).is_equal_to("cz,webarchiv)/")
+        assert_that(get_host_key("cz,webarchiv)/forum/topic?id=1")).is_equal_to("cz,webarchiv)/forum/")
+        assert_that(get_host_key("cz,webarchiv)/forum/")).is_equal_to("cz,webarchiv)/forum/")
+        assert_that(get_host_key("cz,webarchiv)/search?q=a/b")).is_equal_to("cz,webarchiv)/")
+        assert_that(get_host_key("")).is_none()
+        assert_that(get_host_key(None)).is_none()
+        assert_that(get_host_key(")/about")).is_none()
+
+    def test_get_set(self):
+        memory = HostMemory(2)
+        memory.set("cz,a", "charset", "utf-8")
+        memory.set("cz,a", "lang", "cs")
+        assert_that(memory.get("cz,a", "charset")).is_equal_to("utf-8")
+        assert_that(memory.get("cz,a", "lang")).is_equal_to("cs")
+        assert_that(memory.get("cz,b", "charset")).is_none()
+        memory.set(None, "charset", "utf-8")
+        assert_that(memory.get(None, "charset")).is_none()
+
+    def test_lru(self):
+        memory = HostMemory(2)
+        memory.set("cz,a", "charset", "utf-8")
+        memory.set("cz,b", "charset", "cp1250")
+        # "cz,a" is used, so "cz,b" is the least recently used host
+        memory.get("cz,a", "charset")
+        memory.set("cz,c", "charset", "ascii")
+        assert_that(memory.hosts).contains_only("cz,a", "cz,c")
+
+        memory = HostMemory(0)
+        memory.set("cz,a", "charset", "utf-8")
+        assert_that(memory.hosts).is_empty()
+
+    def test_get_host_memory(self):
+        assert_that(get_host_memory()).is_same_as(get_host_memory())
@@ -128,3 +128,54 @@ class TestLanguageIdentification():
             ret = li.guess_lang(text, min_sw_ratio=0, min_sw_count=3)
             assert_that(ret).is_none()
            
+
+        def test_check_lang(self):
+            li = LanguageIdentifier()
+            li.stopsets = {"cs": {"a", "b"}, "sk": {"c"}}
+            li.stopword_langs = {"a": ["cs"], "b": ["cs"], "c": ["sk"]}
+            text = "Foo bar a b." # sw_count is 2, sw_ratio is 0.5
+            assert_that(li.check_lang(text, "cs", min_sw_ratio=0.5, min_sw_count=2)).is_true()
+            assert_that(li.check_lang(text, "cs", min_sw_ratio=0.51, min_sw_count=0)).is_false()
+            assert_that(li.check_lang(text, "cs", min_sw_ratio=0, min_sw_count=3)).is_false()
+            assert_that(li.check_lang(text, "sk", min_sw_ratio=0, min_sw_count=0)).is_false()
+            assert_that(li.check_lang(text, "en", min_sw_ratio=0, min_sw_count=0)).is_false()
+            assert_that(li.check_lang("", "cs", min_sw_ratio=0, min_sw_count=0)).is_false()
+            # the language must score highest (by given margin)
+            text = "Foo a b c c."
+            assert_that(li.check_lang(text, "cs", min_sw_ratio=0, min_sw_count=0)).is_false()
+            assert_that(li.check_lang(text, "cs", min_sw_ratio=0, min_sw_count=0, min_margin=0.5)).is_true()
+
+        def test_check_lang_stoplists(self):
+            li = LanguageIdentifier()
+            en = ("The language is a structured system of communication used "
+                  "by humans and it is the primary means of expression.")
+            sk = ("Jazyk je systém znakov, ktorý slúži na komunikáciu, a preto "
+                  "sa o ňom hovorí aj ako o prostriedku dorozumievania sa.")
+            for lang in ["cs", "sk", "de", "pl", "fr"]:
+                assert_that(li.check_lang(en, lang)).is_false()
+            assert_that(li.check_lang(en, "en")).is_true()
+            assert_that(li.guess_lang(sk)).is_equal_to("sk")
+            assert_that(li.check_lang(sk, "cs")).is_false()
+            assert_that(li.check_lang(sk, "sk")).is_true()
+
+        def test_check_lang_guess_lang(self):
+            li = LanguageIdentifier()
+            assert_that(li.stopword_langs["je"]).contains("cs", "sk")
+            texts = [
+                "Jazyk je abstraktní struktura schopná nést informaci, a tak "
+                "ji uchovávat a přenášet. Při aplikaci musí být "
+                "materializována vhodně strukturovanou hmotou či energií.",
+                "Jazyk je historicky konštruovaný systém zvukových, "
+                "lexikálnych a gramatických prostriedkov, objektivizujúci "
+                "prácu myslenia, komunikácie a vzájomného chápania sa jej "
+                "účastníkov. Jeho skúmaním sa zaoberá špecifická oblasť "
+                "kognitívnej aktivity človeka. Jeho praktickou realizáciou je "
+                "reč.",
+                "Unter Sprache versteht man im allgemeinen Sinn alle "
+                "komplexen Systeme der Kommunikation.",
+            ]
+            # only the language guessed by the full analysis is confirmed
+            for text in texts:
+                guessed = li.guess_lang(text)
+                for lang in li.stopsets:
+                    assert_that(li.check_lang(text, lang)).is_equal_to(lang == guessed)
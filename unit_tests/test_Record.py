@@ -53,8 +53,8 @@ class TestRecord():
     def test_initialize_empty(self):
         rec = Record({})
         assert_that(rec).is_instance_of(Record)
-        assert_that(rec.data).is_instance_of(dict)
-        assert_that(rec.data).contains_key(EXTRA)
+        assert_that(rec.as_dict()).is_instance_of(dict)
+        assert_that(rec.as_dict()).contains_key(EXTRA)
         assert_that(rec[EXTRA]).is_equal_to([])
     
     def test_initialize_dict(self):
@@ -64,8 +64,8 @@ class TestRecord():
             ID: "0",
         })
         assert_that(rec).is_instance_of(Record)
-        assert_that(rec.data).is_instance_of(dict)
-        assert_that(rec.data).contains_key(LANGUAGE, URL, ID, EXTRA)
+        assert_that(rec.as_dict()).is_instance_of(dict)
+        assert_that(rec.as_dict()).contains_key(LANGUAGE, URL, ID, EXTRA)
 
     def test_initialize_warcio(self):
         warcio_rec = create_ArcWarcRecord(b'some\ntext')
@@ -75,12 +75,32 @@ class TestRecord():
         warcio_rec = create_ArcWarcRecord(b'some\ntext')
         rec = Record(warcio_rec, warc_file_name="test-20200623-crawler0.warc.gz")
         assert_that(rec).is_instance_of(Record)
-        assert_that(rec.data).is_instance_of(dict)
-        assert_that(rec.data).contains_key(
+        assert_that(rec.as_dict()).is_instance_of(dict)
+        assert_that(rec.as_dict()).contains_key(
             CONTENT, ID, URLKEY, TIMESTAMP, URL, MIMETYPE, RESPONSECODE,
             DIGEST, RECHEADERS, HTTPHEADERS, HARVESTID, EXTRA
         )
 
+    def test_get_header_fields(self):
+        warcio_rec = create_ArcWarcRecord(
+            b'some\ntext',
+            http_headers=[('Content-Type', 'text/html; charset=utf-8')],
+            warc_headers_dict={
+                'WARC-Record-ID': "<urn:uuid:fbd6cf0a-6160-4550-b343-12188dc05234>",
+            },
+            status='404 Not Found'
+        )
+        fields = Record.get_header_fields(warcio_rec)
+        assert_that(fields[ID]).is_equal_to("urn:uuid:fbd6cf0a-6160-4550-b343-12188dc05234")
+        assert_that(fields[URL]).is_equal_to("http://example.com/")
+        # the last Content-Type header wins as when converted into dict
+        assert_that(fields[MIMETYPE]).is_equal_to("text/html")
+        assert_that(fields[RESPONSECODE]).is_equal_to("404")
+
+        rec = Record(warcio_rec, warc_file_name="test-20200623-crawler0.warc.gz")
+        for key, value in fields.items():
+            assert_that(rec[key]).is_equal_to(value)
+
     def test_ID(self):
         warcio_rec = create_ArcWarcRecord(
             b'some\ntext', 
@@ -105,7 +125,14 @@ class TestRecord():
 
     def test_content(self):
         rec = create_record(b'some\ntext')
-        assert_that(rec[CONTENT]).is_equal_to("c29tZQp0ZXh0") # base64.b64encode(b'some\ntext')
+        assert_that(rec[CONTENT]).is_equal_to(b'some\ntext')
+        assert_that(rec.get_content_bytes()).is_equal_to(b'some\ntext')
+
+    def test_content_base64(self):
+        # serialized records keep the content as base64 string
+        rec = Record({CONTENT: "c29tZQp0ZXh0"})
+        assert_that(rec.get_content_bytes()).is_equal_to(b'some\ntext')
+        rec = Record({CONTENT: memoryview(b'some\ntext')})
         assert_that(rec.get_content_bytes()).is_equal_to(b'some\ntext')
 
     def test_content_gzip(self):
@@ -121,7 +148,7 @@ class TestRecord():
             http_headers = [('Content-Encoding', 'deflate')],
         )
         # warcio should handle decompression during loading
-        assert_that(rec[CONTENT]).is_equal_to("c29tZQp0ZXh0") # base64.b64encode(b'some\ntext')
+        assert_that(rec[CONTENT]).is_equal_to(b'some\ntext')
         assert_that(rec.get_content_bytes()).is_equal_to(b'some\ntext')
 
     def test_content_brotli(self):
@@ -130,7 +157,7 @@ class TestRecord():
             http_headers = [('Content-Encoding', 'br')],
         )
         # warcio should handle decompression during loading
-        assert_that(rec[CONTENT]).is_equal_to("c29tZQp0ZXh0") # base64.b64encode(b'some\ntext')
+        assert_that(rec[CONTENT]).is_equal_to(b'some\ntext')
         assert_that(rec.get_content_bytes()).is_equal_to(b'some\ntext')
 
     def test_content_unk_compress(self):
@@ -138,7 +165,7 @@ class TestRecord():
             b'some\ntext',
             http_headers = [('Content-Encoding', 'non-exist-compression')],
         )
-        assert_that(rec[CONTENT]).is_equal_to("c29tZQp0ZXh0") # base64.b64encode(b'some\ntext')
+        assert_that(rec[CONTENT]).is_equal_to(b'some\ntext')
         assert_that(rec.get_content_bytes()).is_equal_to(b'some\ntext')
 
     def test_revisit(self):
@@ -181,3 +208,98 @@ class TestRecord():
         rec[WARCOFFSET] = "unsupported_type"
         rec.check_int_fileds()
         assert_that(rec.data).does_not_contain_key(WARCOFFSET)
+
+    def test_transaction_commit(self):
+        rec = Record({URL: "http://example.com", LINKS: ["a"], EXTRA: []})
+        links = rec.data[LINKS]
+
+        rec.begin()
+        rec[TITLE] = "Title"
+        rec[LINKS] += ["b"]
+        del rec[URL]
+        assert_that(rec[TITLE]).is_equal_to("Title")
+        assert_that(rec[LINKS]).is_equal_to(["a", "b"])
+        assert_that(URL in rec).is_false()
+        assert_that(rec[URL]).is_none()
+        # base data are untouched until commit
+        assert_that(rec.data).does_not_contain_key(TITLE)
+        assert_that(rec.data[URL]).is_equal_to("http://example.com")
+        assert_that(links).is_equal_to(["a"])
+        assert_that(rec.changed_fields()).is_equal_to({TITLE, LINKS, URL})
+
+        rec.commit()
+        assert_that(rec.in_transaction()).is_false()
+        assert_that(rec.data).does_not_contain_key(URL)
+        assert_that(rec.data[TITLE]).is_equal_to("Title")
+        assert_that(rec.data[LINKS]).is_equal_to(["a", "b"])
+
+    def test_transaction_rollback(self):
+        rec = Record({URL: "http://example.com", LINKS: ["a"], EXTRA: []})
+
+        rec.begin()
+        rec.update({TITLE: "Title", URL: "http://example.org"})
+        rec[LINKS].append("b")
+        rec[EXTRA] += [1]
+        assert_that(rec.as_dict()).contains_entry(
+            {TITLE: "Title"}, {URL: "http://example.org"}, {LINKS: ["a", "b"]}
+        )
+        rec.rollback()
+
+        assert_that(rec.data).is_equal_to(
+            {URL: "http://example.com", LINKS: ["a"], EXTRA: []}
+        )
+
+    def test_transaction_read_only(self):
+        rec = Record({LINKS: ["a"], EXTRA: []})
+        rec.begin()
+        assert_that(rec[LINKS]).is_equal_to(["a"])
+        assert_that(rec.changed_fields()).is_empty()
+
+    def test_modified_fields(self):
+        rec = Record({URL: "http://example.com", LINKS: ["a"], EXTRA: []})
+        assert_that(rec.modified_fields()).is_empty()
+        rec.begin()
+        # setting the stored value is not a change
+        rec[URL] = "http://example.com"
+        rec[LINKS] = ["a", "b"]
+        assert_that(rec.changed_fields()).is_equal_to({LINKS})
+        rec.commit()
+        rec.begin()
+        rec[TITLE] = "Title"
+        rec.rollback()
+        rec.begin()
+        del rec[URL]
+        rec.commit()
+        assert_that(rec.modified_fields()).is_equal_to({LINKS, URL})
+
+    def test_slots(self):
+        rec = Record({URL: "http://example.com", "foo": 1})
+        assert_that(hasattr(rec, "__dict__")).is_false()
+        assert_that(rec["foo"]).is_equal_to(1)
+        assert_that(dict(rec.data)).is_equal_to(
+            {URL: "http://example.com", "foo": 1, EXTRA: []}
+        )
+        del rec.data["foo"]
+        assert_that("foo" in rec).is_false()
+        assert_that(rec["foo"]).is_none()
+
+    def test_lazy_headers(self):
+        rec = create_record(
+            http_headers=[
+                ('Content-Type', 'text/plain'),
+                ('Location', '/a'),
+                ('Location', '/b'),
+            ]
+        )
+        assert_that(rec._values[FIELDS.index(HTTPHEADERS)]).is_instance_of(
+            StatusAndHeaders
+        )
+        # the last occurrence wins as when converted into dictionary
+        assert_that(rec.get_header(HTTPHEADERS, 'Location')).is_equal_to('/b')
+        assert_that(rec.get_header(HTTPHEADERS, 'foo', '')).is_equal_to('')
+        assert_that(rec[HTTPHEADERS]).contains_entry(
+            {'Content-Type': 'text/plain'}, {'Location': '/b'}
+        )
+        assert_that(rec._values[FIELDS.index(HTTPHEADERS)]).is_instance_of(
+            dict
+        )
@@ -0,0 +1,60 @@
+# coding: utf-8
+from assertpy import assert_that
+
+import sys
+import os
+import json
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+from jsonschema.exceptions import ValidationError
+
+from metadata import *
+from Record import Record
+from SchemaValidation import SchemaValidator, get_schema_validator
+
+SCHEMA = json.load(
+    open(os.path.join(os.path.dirname(__file__), "../schema.json"), "r")
+)
+
+
+class TestSchemaValidation():
+
+    def test_get_schema_validator(self):
+        validator = get_schema_validator(SCHEMA)
+        assert_that(validator).is_instance_of(SchemaValidator)
+        assert_that(validator.field_level).is_true()
+        assert_that(get_schema_validator(dict(SCHEMA))).is_same_as(validator)
+
+    def test_validate_fields(self):
+        validator = get_schema_validator(SCHEMA)
+        rec = Record({URL: "http://example.com", EXTRA: []})
+
+        rec.begin()
+        rec[TITLE] = "Title"
+        rec[TOKENS] = ["some", "tokens"]
+        validator.validate_fields(rec, rec.changed_fields())
+
+        rec[TOKENS] += [1]
+        assert_that(validator.validate_fields).raises(
+            ValidationError
+        ).when_called_with(rec, rec.changed_fields())
+
+    def test_validate_fields_required(self):
+        validator = get_schema_validator(SCHEMA)
+        rec = Record({URL: "http://example.com", TITLE: "Title", EXTRA: []})
+
+        rec.begin()
+        del rec[TITLE]
+        validator.validate_fields(rec, rec.changed_fields())
+        del rec[URL]
+        assert_that(validator.validate_fields).raises(
+            ValidationError
+        ).when_called_with(rec, rec.changed_fields())
+
+    def test_validate_fields_additional(self):
+        schema = dict(SCHEMA, additionalProperties=False)
+        validator = SchemaValidator(schema)
+        validator.validate_fields({TITLE: "Title"}, [TITLE])
+        assert_that(validator.validate_fields).raises(
+            ValidationError
+        ).when_called_with({"foo": 1}, ["foo"])
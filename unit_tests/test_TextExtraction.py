@@ -0,0 +1,163 @@
+# coding: utf-8
+from unittest import mock
+from assertpy import assert_that
+import copy
+import lxml.html
+from lxml.html.clean import Cleaner
+import justext
+import justext.core
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+from TextExtraction import HTMLTextExtractor
+from HostMemory import HostMemory
+from config import JUSTEXT_BASE_SETTING, JUSTEXT_FALLBACK_SETTING
+
+TEXT = ("A to je to, co se v tom textu ještě má a také bude, když to tak je "
+        "a na to se dá jen těžko něco říct. ")
+
+HTML_PAGES = [
+    # article with menu, headlines, script, style and comments
+    "<html><head><title>Titulek &amp; stránka</title>"
+    "<script>var a = 1;</script><style>p {color: red}</style></head>"
+    "<body><!-- menu --><div><a href='/menu'>Menu</a> | "
+    "<a href='http://example.org/'>Jinam</a></div>"
+    "<h2>Druhá úroveň</h2><p>" + TEXT * 3 + "</p>"
+    "<h1>První<br>úroveň</h1><p>krátký odstavec</p><p>" + TEXT * 4 + "</p>"
+    "<select><option>Volba</option></select><textarea>Pole</textarea>"
+    "<p>&copy; 2020 Firma</p></body></html>",
+    # main text mostly inside a link, found by fall-back setting only
+    "<html><body><div>" + TEXT + "<a href='#a'>" + TEXT * 2 + "</a></div>"
+    "<p>Odkazy: <a href='mailto:x@y.cz'>pošta</a> <a href=''>nic</a></p>"
+    "</body></html>",
+    # good, near-good and short paragraphs among boilerplate
+    "<html><body>" + "".join(
+        "<p>" + TEXT * 2 + "</p><p>A to je on.</p><p>" + TEXT + "</p>"
+        "<div>" + "menu " * 80 + "</div><p>To je ono.</p>"
+        for _ in range(3)
+    ) + "</body></html>",
+    # fragment without html element
+    "<p>" + TEXT * 2 + "</p><h3>Nadpis</h3>",
+]
+
+
+def get_settings():
+    settings = [dict(JUSTEXT_BASE_SETTING)]
+    for upd in JUSTEXT_FALLBACK_SETTING:
+        setting = dict(JUSTEXT_BASE_SETTING)
+        setting.update(upd)
+        settings.append(setting)
+    settings.append(dict(JUSTEXT_BASE_SETTING, no_headings=False,
+                         length_low=20, stopwords_low=0.1))
+    return settings
+
+
+def good_texts(paragraphs):
+    return [p['text'] for p in paragraphs if p['class'] == 'good']
+
+
+class TestTextExtraction():
+    class TestHTMLTextExtractor():
+
+        def test_justext(self):
+            ex = HTMLTextExtractor()
+            stoplist = ex.jstoplists['cs']
+            for page in HTML_PAGES:
+                paragraphs = ex._get_paragraphs(lxml.html.fromstring(page))
+                # paragraphs (and their statistics) are reused for all
+                # settings, the result must be the same as of jusText
+                for setting in get_settings():
+                    expected = good_texts(justext.justext(
+                        page.encode('utf-8'), stoplist, encoding='utf-8',
+                        **setting
+                    ))
+                    ret = ex._justext(paragraphs, stoplist, setting)
+                    assert_that([p['text'] for p in ret]) \
+                        .is_equal_to(expected)
+
+        def test_reclassify(self):
+            ex = HTMLTextExtractor()
+            stoplist = ex.jstoplists['cs']
+            settings = get_settings()
+            for page in HTML_PAGES:
+                paragraphs = ex._get_paragraphs(lxml.html.fromstring(page))
+                justext.core.classify_paragraphs(paragraphs, stoplist)
+                for setting in settings:
+                    csetting = dict(
+                        (k, v) for k, v in setting.items()
+                        if k in ex.jclassify_defaults
+                    )
+                    expected = copy.deepcopy(paragraphs)
+                    justext.core.classify_paragraphs(
+                        expected, stoplist, **csetting
+                    )
+                    ex._reclassify(paragraphs, **csetting)
+                    assert_that(paragraphs).is_equal_to(expected)
+
+        def test_walk_tree(self):
+            ex = HTMLTextExtractor()
+            cleaner = Cleaner(javascript=True, scripts=True, style=True)
+            for page in HTML_PAGES:
+                tree = lxml.html.fromstring(page)
+                ret = ex._walk_tree(tree)
+                headlines = tree.xpath(
+                    '//*[self::h1 or self::h2 or self::h3 or self::h4 or '
+                    'self::h5 or self::h6]/text()'
+                )
+                assert_that(ret['titles']).is_equal_to(
+                    tree.xpath('//title/text()')
+                )
+                assert_that(ret['headlines']).is_equal_to(headlines)
+                assert_that(ret['links']).is_equal_to(tree.xpath('//a/@href'))
+                assert_that(ret['text']).is_equal_to(
+                    cleaner.clean_html(tree).text_content()
+                )
+                # the tree is not modified
+                assert_that(lxml.html.tostring(tree)).is_equal_to(
+                    lxml.html.tostring(lxml.html.fromstring(page))
+                )
+
+        def test_get_metadata(self):
+            ex = HTMLTextExtractor()
+            tree = lxml.html.fromstring(HTML_PAGES[0])
+            page = ex._walk_tree(tree)
+            ret = ex._get_metadata(page)
+            assert_that(ret).is_equal_to({
+                'language': 'cs',
+                'title': 'Titulek & stránka',
+                'headlines': ['Druhá úroveň', 'První', 'úroveň'],
+            })
+            links = ex._get_abs_links(page['links'], 'http://example.cz/a/')
+            assert_that(links).is_equal_to(
+                ['http://example.cz/menu', 'http://example.org/']
+            )
+
+        def test_check_charset(self):
+            ex = HTMLTextExtractor()
+            html = "<html><body><p>" + TEXT + "</p></body></html>"
+            assert_that(ex._check_charset(html.encode('cp1250'), 'cp1250')).is_true()
+            assert_that(ex._check_charset(html.encode('utf-8'), 'utf-8')).is_true()
+            # valid UTF-8 is not confirmed as single byte charset
+            assert_that(ex._check_charset(html.encode('utf-8'), 'cp1250')).is_false()
+            assert_that(ex._check_charset(html.encode('cp1250'), 'utf-8')).is_false()
+            # pure ASCII is inconclusive
+            assert_that(ex._check_charset(b'<p>text</p>', 'utf-8')).is_false()
+            assert_that(ex._check_charset(html.encode('utf-8'), 'made-up-enc')).is_false()
+
+        def test_get_charset_remembered(self):
+            ex = HTMLTextExtractor()
+            ex.host_memory = HostMemory(10)
+            data = mock.Mock()
+            data.get_header.return_value = ''
+            host = 'cz,example)/'
+            ex.host_memory.set(host, 'charset', 'utf-8')
+            html = "<html><body><p>" + TEXT + "</p></body></html>"
+            ret = ex._get_charset(data, html.encode('utf-8'), host)
+            assert_that(ret).is_equal_to(('utf-8', 'remembered'))
+            # ASCII head, the body is checked too
+            html = "<html><head>" + " " * 70000 + "</head>" + html[6:]
+            ret = ex._get_charset(data, html.encode('cp1250'), host)
+            assert_that(ret).is_equal_to(('cp1250', 'guessed'))
+            assert_that(ex.host_memory.get(host, 'charset')).is_equal_to('cp1250')
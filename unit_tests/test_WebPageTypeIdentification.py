@@ -36,4 +36,20 @@ class TestWebPageTypeIdentification():
             ret = wpti.process(record)
             assert_that(ret.data[WEBPAGETYPE]).is_equal_to("eshop")
 
+        def test_configure(self):
+            wpti = WebPageTypeIdentifier()
+            # forum type is disabled in config table
+            wpti.configure({"webtypes": {"eshop": 0, "news": 1, "others": 3}})
+            record = Record({URL: "https://www.vari.cz/rady-a-navody/diskusni-forum/?thId=3681"})
+            ret = wpti.process(record)
+            assert_that(ret.data[WEBPAGETYPE]).is_equal_to("others")
+
+            record = Record({URL: "https://www.alza.cz/siguro-ek-l24-advanced-glass-d7056775.htm"})
+            ret = wpti.process(record)
+            assert_that(ret.data[WEBPAGETYPE]).is_equal_to("eshop")
 
+            # missing setting means default web types
+            wpti.configure({"webtypes": None})
+            record = Record({URL: "https://www.vari.cz/rady-a-navody/diskusni-forum/?thId=3681"})
+            ret = wpti.process(record)
+            assert_that(ret.data[WEBPAGETYPE]).is_equal_to("forum")
@@ -39,6 +39,27 @@ class TestUtils():
         assert_that(ret["type"]).is_equal_to("Test")
         assert_that(ret["date"]).is_equal_to("20190701")
       
+    def test_pack_by_size(self):
+        assert_that(pack_by_size([], 100)).is_equal_to([])
+
+        # small items are packed together
+        bins = pack_by_size([("a", 10), ("b", 20), ("c", 30)], 100)
+        assert_that(bins).is_length(1)
+        assert_that(bins[0]).is_equal_to(["c", "b", "a"])
+
+        # large items are distributed first, the rest is balanced
+        items = [("big", 300), ("a", 100), ("b", 100), ("c", 50), ("d", 50)]
+        bins = pack_by_size(items, 200)
+        assert_that(bins).is_length(3)
+        assert_that(bins[0]).is_equal_to(["big"])
+        sizes = dict(items)
+        totals = sorted(sum(sizes[i] for i in b) for b in bins)
+        assert_that(totals).is_equal_to([150, 150, 300])
+
+        # there are never more bins than items
+        bins = pack_by_size([("a", 1000), ("b", 1000)], 10)
+        assert_that(bins).is_equal_to([["a"], ["b"]])
+
     def test_bytes_to_base64(self):
         ret = bytes_to_base64(b"Python is fun")
         assert_that(ret).is_equal_to("UHl0aG9uIGlzIGZ1bg==")
@@ -64,7 +85,31 @@ class TestUtils():
         
         assert_that(guess_charset).raises(ValueError).when_called_with('')
         assert_that(guess_charset).raises(ValueError).when_called_with('A'.encode("utf-8"), encodings=["non-existing-enc"])
-        
+
+        # large content is sampled
+        text = ("Příliš žluťoučký kůň úpěl ďábelské ódy.\n" * 50000).encode("cp1250")
+        assert_that(guess_charset(text)).is_equal_to("cp1250")
+        assert_that(guess_charset(text, max_size=1000, n_windows=4)).is_equal_to("cp1250")
+        assert_that(guess_charset(b'abc\xe8', encodings=["ascii", "cp1250"])).is_equal_to("cp1250")
+
+        # samples of UTF-16/32 content are aligned to the code unit
+        text = '<html><head>' + '<meta name="x" content="y">\n' * 5000 + '</head><body>' \
+            + '<p>Příliš žluťoučký kůň úpěl ďábelské ódy.</p>\n' * 10000
+        for enc in ["utf-16", "utf-16-be", "utf-32"]:
+            content = text.encode(enc)
+            assert_that(len(content)).is_greater_than(262144)
+            encodings = ["ascii", "utf-8", "cp1250", "iso-8859-2", enc]
+            assert_that(guess_charset(content, encodings)).is_equal_to(enc)
+            assert_that(guess_charset(content, encodings, max_size=10**7)).is_equal_to(enc)
+
+    def test_get_byte_classes(self):
+        czech, errors = get_byte_classes("cp1250")
+        assert_that(czech).contains(*b"a\xe8\x9e")
+        assert_that(errors).is_equal_to(b"\x81\x83\x88\x90\x98")
+        assert_that(get_byte_classes("ascii")[1]).is_equal_to(bytes(range(128, 256)))
+        assert_that(get_byte_classes("utf-8")).is_none()
+        assert_that(get_byte_classes("utf-16")).is_none()
+
     def test_get_charset_from_BOM(self):
         assert_that(get_charset_from_BOM(b'text')).is_none()
         assert_that(get_charset_from_BOM(b'\xef\xbb\xbftext')).is_equal_to("utf-8-sig")